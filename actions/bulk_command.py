@@ -0,0 +1,81 @@
+from st2actions.runners.pythonrunner import Action
+from st2common import log as logging
+
+import time
+
+from exec_command import LiveStatus, build_command
+from lib.endpoint import parse_endpoint
+from lib.limiter import build_limiter
+from lib.proxy import command_proxy_url
+from lib.sites import default_site
+
+LOG = logging.getLogger(__name__)
+
+
+class BulkCommand(Action):
+    """
+    LiveStatus BulkCommand class, submits many external commands over one connection.
+    """
+    def run(self, commands, batch_size=500, site=None):
+        """
+        The run method to be called by Stackstorm.
+
+        commands - a list of command specs: {"command": "ACKNOWLEDGE_HOST_PROBLEM",
+                   "args": {"host_name": "web-450", "comment": "..."}}.
+        batch_size - the number of command lines written per send.
+        site - the configured site receiving the commands, the default site when None.
+
+        Every spec is validated before anything is sent, invalid specs are reported
+        in "rejected" and the valid ones are pipelined with a single timestamp.
+        """
+        try:
+            target = default_site(self.config, site)
+        except ValueError as e:
+            return (False, str(e))
+        host = target['host']
+        port = target.get('port')
+        # The proxy forwards to the default site.
+        proxy = command_proxy_url(self.config) if site is None else None
+
+        timestamp = int(time.time())
+        lines = []
+        indexes = []
+        rejected = []
+        for index, spec in enumerate(commands):
+            if not isinstance(spec, dict):
+                rejected.append({"index": index,
+                                 "error": "A command spec must be an object, got {}.".format(spec)})
+                continue
+            try:
+                line = build_command(spec.get('command'), spec.get('args', {})).execute(timestamp)
+            except (KeyError, TypeError, ValueError, NotImplementedError) as e:
+                rejected.append({"index": index, "error": "{}: {}".format(type(e).__name__, e)})
+                continue
+            lines.append(line)
+            indexes.append(index)
+
+        sent = 0
+        error = None
+        queue_wait = 0.0
+        start = time.time()
+        if lines:
+            live_status = LiveStatus(host, port, proxy=proxy,
+                                     limiter=build_limiter(self.config,
+                                                           parse_endpoint(host, port)))
+            sent, error = live_status.submit_commands(lines, batch_size)
+            queue_wait = live_status.queue_wait
+        elapsed = time.time() - start
+
+        if error is not None:
+            LOG.error("Submitting commands failed after {} lines: {}".format(sent, error))
+            for index in indexes[sent:]:
+                rejected.append({"index": index, "error": "Not sent: {}".format(error)})
+
+        result = {
+            "submitted": sent,
+            "rejected": rejected,
+            "elapsed": elapsed,
+            "queue_wait": queue_wait,
+            "commands_per_second": sent / elapsed if elapsed > 0 else None,
+        }
+        return (error is None and not rejected, result)
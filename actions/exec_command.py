@@ -2,11 +2,17 @@ from st2actions.runners.pythonrunner import Action
 from st2common import log as logging
 
 import json
+import time
+import errno
 import socket
-import parsedatetime
-from time import mktime
-from datetime import datetime
+import inspect
 
+from lib.endpoint import connect, parse_endpoint
+from lib.limiter import AdmissionTimeout, build_limiter
+from lib.proxy import command_proxy_url
+from lib.receive import recv_until_eof
+from lib.sites import default_site
+from lib.timespec import DEFAULT_DURATION, parse_duration, parse_time
 
 LOG = logging.getLogger(__name__)
 LS_EOL = '\n'
@@ -15,11 +21,36 @@ LS_EOL = '\n'
 class LiveStatus(object):
     """
     LiveStatus class provides network access to the Live status server.
+
+    proxy, a unix:// URL of the local livestatus proxy, is used instead of the
+    server while its socket accepts connections.
+
+    limiter, when given, admits command submissions at high priority, ahead of the
+    queued reads.  The time spent queued is kept in queue_wait.
     """
-    def __init__(self, host, port, max_recv=4096):
+    def __init__(self, host, port=None, max_recv=1048576, proxy=None, limiter=None,
+                 admission_timeout=30):
         self.host = host
-        self.port = int(port)
+        self.port = port
+        self.endpoint = parse_endpoint(host, port)
+        self.proxy = parse_endpoint(proxy) if proxy else None
         self.max_recv = int(max_recv)
+        self.limiter = limiter
+        self.admission_timeout = admission_timeout   # unit=seconds
+        self.queue_wait = 0.0
+
+    def connect(self):
+        """
+        Connect to the proxy, or to the server when the proxy isn't running.
+        """
+        if self.proxy is not None:
+            try:
+                return connect(self.proxy, None)
+            except socket.error as e:
+                if e.errno not in (errno.ENOENT, errno.ECONNREFUSED):
+                    raise
+                LOG.warning("Livestatus proxy unavailable ({}), connecting directly.".format(e))
+        return connect(self.endpoint, None)
 
     def execute(self, query):
         """
@@ -28,18 +59,14 @@ class LiveStatus(object):
 
         @query - a livestatus query.
         """
-        server = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-        server.connect((self.host, self.port))
+        server = self.connect()
         LOG.debug('Sending LiveStatus query: {}'.format(query))
-        server.send(query.encode('utf-8').rstrip() + LS_EOL)
+        server.sendall((query.rstrip() + LS_EOL).encode('utf-8'))
         # Notify server that transmission has finished.
         server.shutdown(socket.SHUT_WR)
-        answer = ''
-        buf = server.recv(self.max_recv)
-        while buf:
-            answer += buf
-            buf = server.recv(self.max_recv)
-        return answer
+        answer = recv_until_eof(server, max_chunk=self.max_recv)
+        server.close()
+        return answer.decode('utf-8')
 
     def get_json(self, query):
         """
@@ -50,43 +77,81 @@ class LiveStatus(object):
         """
         return json.loads(self.execute(query))
 
+    def submit_commands(self, lines, batch_size=500):
+        """
+        Pipeline external commands over a single connection.  Livestatus doesn't answer
+        commands, so every line is written without waiting for a reply.
+
+        @lines - commands as returned by ExternalCommand.execute().
+        Returns (number of lines written, error or None).
+        """
+        ticket = None
+        if self.limiter is not None:
+            try:
+                ticket, self.queue_wait = self.limiter.acquire('high', self.admission_timeout)
+            except AdmissionTimeout as e:
+                self.queue_wait = e.waited
+                return 0, str(e)
+        try:
+            server = self.connect()
+        except socket.error as e:
+            self._release(ticket)
+            return 0, str(e)
+        sent = 0
+        try:
+            for start in range(0, len(lines), batch_size):
+                batch = lines[start:start + batch_size]
+                payload = ''.join('COMMAND {}{}{}'.format(line, LS_EOL, LS_EOL) for line in batch)
+                LOG.debug('Sending {} LiveStatus commands.'.format(len(batch)))
+                server.sendall(payload.encode('utf-8'))
+                sent += len(batch)
+        except socket.error as e:
+            return sent, str(e)
+        finally:
+            server.close()
+            self._release(ticket)
+        return sent, None
+
+    def _release(self, ticket):
+        if self.limiter is not None:
+            self.limiter.release(ticket)
+
 
 class Command(Action):
     """
     LiveStatus External Command class.  This class provides a mapping between text command names
     and their Python implementations.
     """
-    def run(
-        self,
-        command='',
-        host_name,
-        service_desription,
-        start_time,
-        end_time,
-        fixed,
-        trigger_id,
-        duration,
-        author,
-        comment
-    ):
+    def run(self, command='', site=None, **kwargs):
         """
         The run method to be called by Stackstorm.
 
-        :command: the string to lookup the Python function.
-        :host_name: the host_name to query
-        filters - conditions to filter result set.
-        stats - Calculate statistics held in data.
-        limit - Not supported by Shinken.
-        output_format - json or csv formats.
+        :command: the string to lookup the Python function, e.g. ACKNOWLEDGE_HOST_PROBLEM.
+        :site: the configured site receiving the command, the default site when None.
+        :kwargs: the arguments of the command (host_name, sticky, notify, persistent,
+                 author, comment, ...).  st2 passes every parameter default, the
+                 arguments the command doesn't take are ignored.
         """
-        host = self.config['host']
-        port = self.config['port']
-
-        live_status = LiveStatus(host, port)
-
-		result = live_status.execute(query)
-
-        return result
+        try:
+            target = default_site(self.config, site)
+        except ValueError as e:
+            return (False, str(e))
+        host = target['host']
+        port = target.get('port')
+        # The proxy forwards to the default site.
+        proxy = command_proxy_url(self.config) if site is None else None
+
+        try:
+            line = build_command(command, kwargs, ignore_extra=True).execute()
+        except (TypeError, ValueError, NotImplementedError) as e:
+            return (False, "Invalid command {}: {}".format(command, e))
+
+        live_status = LiveStatus(host, port, proxy=proxy,
+                                 limiter=build_limiter(self.config, parse_endpoint(host, port)))
+        sent, error = live_status.submit_commands([line])
+        if error is not None:
+            return (False, "Failed to submit command: {}".format(error))
+        return (True, line)
 
     def _process_columns(self, columns):
         """
@@ -124,10 +189,7 @@ class ExternalCommand(object):
 
     @staticmethod
     def unix_epoch(dt):
-        cal = parsedatetime.Calendar()
-        time_struct, parse_status = cal.parse(dt)
-        mktime(datetime(*time_struct[:6]))
-        return int(time.time())
+        return parse_time(dt)
 
     @staticmethod
     def sticky(sticky=True):
@@ -148,8 +210,16 @@ class ExternalCommand(object):
     def __init__(self):
         self.args = None
 
-    def execute(self):
-        return "[{}] {} {}".format(Command.unix_epoch(), self.cmd, ";".join(self.args), LS_EOL)
+    def execute(self, timestamp=None):
+        """
+        Return the command line, "[timestamp] CMD;arg1;arg2", without the COMMAND keyword.
+        """
+        if timestamp is None:
+            timestamp = int(time.time())
+        for arg in self.args:
+            if LS_EOL in str(arg):
+                raise ValueError("Command arguments can't contain new lines.")
+        return "[{}] {};{}".format(timestamp, self.cmd, ";".join(str(arg) for arg in self.args))
 
 
 class RemoveHostAcknowledgement(ExternalCommand):
@@ -223,11 +293,42 @@ class AcknowledgeServiceProblem(ExternalCommand):
         comment="No comment provided."
     ):
         self.cmd = "ACKNOWLEDGE_SVC_PROBLEM"
-        self.args = []
-        raise NotImplementedError
+        self.args = [
+            host_name,
+            service_description,
+            self.sticky(sticky),
+            self.notify(notify),
+            self.persistent(persistent),
+            author,
+            comment
+        ]
+
+
+class ScheduleDowntime(ExternalCommand):
+    """
+    Base of the downtime commands, resolves the start, end and duration arguments.
+
+    Without start_time the downtime starts now.  Without end_time it lasts duration,
+    or 30 minutes when no duration is given either.  Times are epochs or date
+    expressions, e.g. "tomorrow 9am", durations are seconds or expressions, e.g. "2h".
+    """
+    def _window(self, start_time, end_time, duration):
+        now = int(time.time())
+        start = parse_time(start_time if start_time is not None else "now", now)
+        if duration is not None:
+            duration = parse_duration(duration, now)
+        if end_time is not None:
+            end = parse_time(end_time, now)
+        else:
+            end = start + (duration if duration is not None else DEFAULT_DURATION)
+        if end <= start:
+            raise ValueError("The downtime ends before it starts.")
+        if duration is None:
+            duration = end - start
+        return start, end, duration
 
 
-class ScheduleHostDowntime(ExternalCommand):
+class ScheduleHostDowntime(ScheduleDowntime):
     """
     Schedules downtime for a specified host.
     :fixed: True - the downtime will start and end at the times specified by the "start" and "end"
@@ -253,32 +354,20 @@ class ScheduleHostDowntime(ExternalCommand):
         comment="No comment provided."
     ):
         self.cmd = "SCHEDULE_HOST_DOWNTIME"
-        if start_time is end_time is duration is None:
-            # Use a default duration fo 60 mins
-            start_time = "now"
-            duration = "30min"
-        else if start_time is not None and duration is not None:
-            # handle a fixed duration.
-            fixed = False
-            if end_time is None:
-                end_time = start_time
-        else:
-            # handle start/end datetime range here.
-            fixed = True
-            if start_time is None:
-                start_time = "now"
-            if end_time is None:
-                end_time = "{} + 30min".format(start_time)
-
+        start, end, duration = self._window(start_time, end_time, duration)
         self.args = [
             host_name,
-            start_time,
-            end_time,
-            self.fixed(fixed), ]
-        raise NotImplementedError
+            start,
+            end,
+            self.fixed(fixed),
+            trigger_id,
+            duration,
+            author,
+            comment
+        ]
 
 
-class ScheduleServiceDowntime(ExternalCommand):
+class ScheduleServiceDowntime(ScheduleDowntime):
     """
     Schedules downtime for a specified service.
     :fixed: True - downtime will start and end at the times specified by the "start" and "end"
@@ -295,27 +384,100 @@ class ScheduleServiceDowntime(ExternalCommand):
     def __init__(
         self,
         host_name,
-        service_desription,
-        start_time,
-        end_time,
-        fixed,
-        trigger_id,
-        duration,
-        author,
-        comment
+        service_description,
+        start_time=None,
+        end_time=None,
+        fixed=True,
+        trigger_id=0,
+        duration=None,
+        author="Unknown",
+        comment="No comment provided."
     ):
         self.cmd = "SCHEDULE_SVC_DOWNTIME"
-        raise NotImplementedError
+        start, end, duration = self._window(start_time, end_time, duration)
+        self.args = [
+            host_name,
+            service_description,
+            start,
+            end,
+            self.fixed(fixed),
+            trigger_id,
+            duration,
+            author,
+            comment
+        ]
+
+
+class DisableHostNotifications(ExternalCommand):
+    """
+    Disables notifications for a particular host.
+    """
+    def __init__(self, host_name):
+        self.cmd = "DISABLE_HOST_NOTIFICATIONS"
+        self.args = [host_name]
+
+
+class EnableHostNotifications(ExternalCommand):
+    """
+    Enables notifications for a particular host.
+    """
+    def __init__(self, host_name):
+        self.cmd = "ENABLE_HOST_NOTIFICATIONS"
+        self.args = [host_name]
+
+
+class DisableServiceNotifications(ExternalCommand):
+    """
+    Disables notifications for a particular service.
+    """
+    def __init__(self, host_name, service_description):
+        self.cmd = "DISABLE_SVC_NOTIFICATIONS"
+        self.args = [host_name, service_description]
+
+
+class EnableServiceNotifications(ExternalCommand):
+    """
+    Enables notifications for a particular service.
+    """
+    def __init__(self, host_name, service_description):
+        self.cmd = "ENABLE_SVC_NOTIFICATIONS"
+        self.args = [host_name, service_description]
+
+
+COMMANDS = {
+    "REMOVE_HOST_ACKNOWLEDGEMENT": RemoveHostAcknowledgement,
+    "REMOVE_SVC_ACKNOWLEDGEMENT": RemoveServiceAcknowledgement,
+    "ACKNOWLEDGE_HOST_PROBLEM": AcknowledgeHostProblem,
+    "ACKNOWLEDGE_SVC_PROBLEM": AcknowledgeServiceProblem,
+    "SCHEDULE_HOST_DOWNTIME": ScheduleHostDowntime,
+    "SCHEDULE_SVC_DOWNTIME": ScheduleServiceDowntime,
+    "DISABLE_HOST_NOTIFICATIONS": DisableHostNotifications,
+    "ENABLE_HOST_NOTIFICATIONS": EnableHostNotifications,
+    "DISABLE_SVC_NOTIFICATIONS": DisableServiceNotifications,
+    "ENABLE_SVC_NOTIFICATIONS": EnableServiceNotifications,
+}
+
+
+def build_command(command, args, ignore_extra=False):
+    """
+    Instantiate the ExternalCommand registered under the command name.
+
+    ignore_extra - drop the arguments the command doesn't take rather than failing.
+
+    Raises ValueError for unknown commands and TypeError for invalid arguments.
+    """
+    try:
+        command_class = COMMANDS[command.upper()]
+    except (AttributeError, KeyError):
+        raise ValueError("Unknown command, expected one of {}.".format(", ".join(sorted(COMMANDS))))
+    if ignore_extra:
+        accepted = inspect.signature(command_class.__init__).parameters
+        args = dict((name, value) for name, value in args.items()
+                    if name in accepted and name != 'self')
+    return command_class(**args)
 
 """
 # To do:
-# date parsing with parsedatetime
-#
-# date examples.
-# .st2 sd web-450 for 5d
-# .st2 sd web-450 from 5 jan 2018 to 6 jan 2018
-# .st2 sd web-450 in 1 hour for 4 hours
-# .st2 sd web-450 at 1pm to 2pm
 
 GET hosts
 Columns: name comments_with_info
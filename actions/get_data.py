@@ -1,193 +1,34 @@
 from st2actions.runners.pythonrunner import Action
 from st2common import log as logging
 
-import json
 import time
 import socket
+import sqlite3
+import functools
+
+from concurrent.futures import ThreadPoolExecutor
+
+from lib.aggregate import Aggregation
+from lib.cache import CACHE_MAX_ENTRIES, CACHE_PATH, QueryCache
+from lib.client import POOL, ConnectionPool, LiveStatus  # noqa: F401
+from lib.endpoint import parse_endpoint
+from lib.limiter import build_limiter, priority_level
+from lib.metrics import SLOW_QUERY_THRESHOLD, build_sink, report_query
+from lib.proxy import proxy_url
+from lib.query import (LS_EOL, BaseItem, FilterItem, StatsItem, build_query,  # noqa: F401
+                       output_format_headers, process_columns, process_filters,
+                       process_stats, process_wait, build_list, wait_timeout)
+from lib.receive import LiveStatusError, TimeoutException
+from lib.reducers import build_reducer
+from lib.retry import (CIRCUIT_FAILURE_THRESHOLD, CIRCUIT_RESET_TIMEOUT, STATE_PATH,
+                       CircuitBreaker, endpoint_key)
+from lib.schema import (SCHEMA_RECHECK, SCHEMA_TTL, SchemaCache, default_columns,
+                        referenced_columns, validate)
+from lib.sites import (SITE_COLUMN, load_sites, merge_rows, merge_stats, select_sites,
+                       split_site_column, stats_aggregates, stats_weights)
+from lib.stream import CSV_SEPARATORS, PARSERS, csv_column_types, iter_csv_rows, iter_json_rows
 
 LOG = logging.getLogger(__name__)
-LS_EOL = '\n'
-
-
-class BaseItem(object):
-    def __init__(self,
-                 _item,
-                 prefix_base=None,
-                 prefix_add=None,
-                 prefix_or=None,
-                 prefix_not=None,
-                 postfix=None):
-        self.prefix = None
-        self.postfix = postfix
-
-        if _item.startswith('&'):
-            self.prefix = prefix_add
-            self._item = int(_item.split("&")[1])
-        elif _item.startswith('|'):
-            self.prefix = prefix_or
-            self._item = int(_item.split("|")[1])
-        elif _item == '!':
-            self.prefix = prefix_not
-            self._item = ""
-        else:
-            self.prefix = prefix_base
-            self._item = _item
-
-    def __str__(self):
-        return "{}{}{}".format(self.prefix, self._item, self.postfix)
-
-
-class StatsItem(BaseItem):
-    """
-    The StatsItem class is used to convert logic operators to livestatus format as well as
-    return a correctly formatted string for livestatus queries.
-
-    The idea is to allow stackstorm to supply stats listed in the following form:
-
-    ["state = 0", "host_up = 0", "&2"]
-
-    The above list would produce a LiveStatus query like the following:
-    Stats: state = 0
-    Stats: host_up = 0
-    StatsAnd: 2
-    """
-    def __init__(self,
-                 _item,
-                 prefix_base="Stats: ",
-                 prefix_add="StatsAnd: ",
-                 prefix_or="StatsOr: ",
-                 prefix_not="StatsNegate:",
-                 postfix=LS_EOL):
-        super(StatsItem, self).__init__(_item,
-                                        prefix_base,
-                                        prefix_add,
-                                        prefix_or,
-                                        prefix_not,
-                                        postfix)
-
-
-class FilterItem(BaseItem):
-    """
-    The FilterItem class is used to convert logic operators to livestatus format as well as
-    return a correctly formatted string for livestatus queries.
-
-    The idea is to allow stackstorm to supply stats listed in the following manner:
-
-    ["state = 0", "host_up = 0", "&2"]
-
-    The above list would produce a LiveStatus query like the following:
-    Filter: state = 0
-    Filter: host_up = 0
-    And: 2
-    """
-    def __init__(self,
-                 _item,
-                 prefix_base="Filter: ",
-                 prefix_add="And: ",
-                 prefix_or="Or: ",
-                 prefix_not="Negate:",
-                 postfix=LS_EOL):
-        super(FilterItem, self).__init__(_item,
-                                         prefix_base,
-                                         prefix_add,
-                                         prefix_or,
-                                         prefix_not,
-                                         postfix)
-
-
-class TimeoutException(Exception):
-    def __init__(self, msg="Execution timeout has been exceeded."):
-        self.msg = msg
-
-    def __str__(self):
-        return repr(self.msg)
-
-
-class LiveStatus(object):
-    """
-    LiveStatus class provides network access to the Live status server.
-    """
-    def __init__(self, host, port, max_recv=4096, query_max_retries=5,
-                 query_duration=5, query_retry_delay=60, allow_empty_list=True):
-        self.host = host
-        self.port = int(port)
-        self.max_recv = int(max_recv)
-        self.query_duration = query_duration           # unit=seconds
-        self.query_retry_delay = query_retry_delay     # unit=seconds
-        self.query_max_retries = query_max_retries
-        self.query_attempt = 0
-
-    def execute(self, query):
-        """
-        execute method sends the query to the live status server and
-        returns the result.
-
-        @query - a livestatus query.
-        """
-        result = None
-        start = int(time.time())
-
-        while self.query_attempt < self.query_max_retries:
-            try:
-                LOG.debug("Attempt number {}".format(self.query_attempt))
-                server = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-                server.settimeout(float(self.query_duration))
-                server.connect((self.host, self.port))
-                LOG.debug('Sending LiveStatus query: {}'.format(query))
-                server.send(query.encode('utf-8').rstrip() + LS_EOL)
-                # Notify server that transmission has finished.
-                server.shutdown(socket.SHUT_WR)
-                buffer_ = ''
-                data = server.recv(self.max_recv)
-                while data:
-                    buffer_ += data
-                    data = server.recv(self.max_recv)
-                    if (int(time.time()) - start > self.query_duration):
-                        raise TimeoutException()
-                result = buffer_
-                server.close()
-                break
-            except socket.timeout as e:
-                LOG.error("Timeout {}/{}".format(self.query_attempt, self.query_max_retries))
-                self.query_attempt += 1
-                time.sleep(self.query_retry_delay)
-            except socket.error as e:
-                LOG.error("Socket error occurred! {}".format(type(e)))
-                self.query_attempt += 1
-                time.sleep(self.query_retry_delay)
-            except TimeoutException as e:
-                LOG.error("Livestatus didn't respond within the time allocated.")
-                self.query_attempt += 1
-                time.sleep(self.query_retry_delay)
-            except Exception as e:
-                LOG.error("Unhandled error occurred: {}".format(sys.exc_info()))
-                break
-        return result
-
-    def get_json(self, query, allow_empty_list=True):
-        """
-        Parse the result of a live status query as JSON.
-
-        @query - a livestatus query. The query MUST request the result
-                 is returned in JSON format.
-        """
-        result = None
-        while self.query_attempt < self.query_max_retries:
-            try:
-                data = json.loads(self.execute(query))
-                if allow_empty_list is not True and data == []:
-                    raise ValueError()
-                result = data
-                break
-            except TypeError as e:
-                LOG.error("No or invalid data received from livestatus API")
-                self.query_attempt += 1
-                time.sleep(self.query_retry_delay)
-            except ValueError as e:
-                LOG.error("Error while deserialising JSON from livestatus API.")
-                self.query_attempt += 1
-                time.sleep(self.query_retry_delay)
-        return result
 
 
 class Get(Action):
@@ -197,99 +38,484 @@ class Get(Action):
     def run(self, table='', columns=None, filters=None,
             stats=None, limit=None, output_format="json",
             query_max_retries=None, query_duration=None,
-            query_retry_delay=None, allow_empty_list=True):
+            query_retry_delay=None, allow_empty_list=True,
+            stream=False, reducer=None, cache=None, include_meta=False,
+            query_deadline=None, sites=None, site_timeout=None, aggregate=None, wait=None,
+            priority="normal"):
         """
         The run method to be called by Stackstorm.
 
         table - the table query.
-        columns - the columns to return in the dataset.
+        columns - the columns to return in the dataset, defaults to the table's
+                  default projection when one is configured, otherwise every column.
         filters - conditions to filter result set.
         stats - Calculate statistics held in data.
         limit - Not supported by Shinken.
-        output_format - json or csv formats.
+        output_format - json, csv, python or python3 rows, columnar returns
+                        {"count", "columns", "data": {column: [values]}}.
+        stream - parse JSON rows as they are received instead of the whole reply.
+        reducer - reduce streamed rows incrementally, e.g. {"type": "count"}.
+        cache - use the host wide result cache, defaults to the cache_enabled config.
+        include_meta - return {"result": ..., "meta": {...}} with cache counters and
+                       the query metrics.
+        query_deadline - overall time in seconds for the query including its retries.
+        sites - names of the configured sites to query, defaults to all of them.
+        site_timeout - overall time in seconds allowed for each site to reply.
+        aggregate - aggregation computed by livestatus and returned as labelled dicts,
+                    e.g. {"group_by": ["host_name"], "metrics": "state"}.
+        wait - hold the reply in livestatus until a condition holds, e.g.
+               {"object": "web-450", "condition": ["state = 0"], "trigger": "state",
+                "timeout": 300}.  An expired wait fails with the timing data and the
+               rows livestatus answered with.
+        priority - the queue priority when admission control is enabled, high, normal
+                   or low.  The time spent queued is the queue_ms metric.
         """
-        host = self.config['host']
-        port = self.config['port']
-
-        passthrough = {}
+        try:
+            priority_level(priority)
+        except ValueError as e:
+            return (False, str(e))
+        passthrough = {"keepalive": self.config.get('keepalive', True), "priority": priority}
         if query_max_retries is not None:
             passthrough["query_max_retries"] = query_max_retries
         if query_duration is not None:
             passthrough["query_duration"] = query_duration
         if query_retry_delay is not None:
             passthrough["query_retry_delay"] = query_retry_delay
+        if query_deadline is not None:
+            passthrough["query_deadline"] = query_deadline
+        if wait is not None:
+            try:
+                process_wait(wait)
+            except (TypeError, ValueError) as e:
+                LOG.error("Invalid wait: {}".format(e))
+                return (False, "Invalid wait: {}".format(e))
+            passthrough["wait_timeout"] = wait_timeout(wait)
+            # A wait observes the broker now, a cached reply would defeat it.
+            cache = False
 
         result = (False, "An error occurred fetching data from Livestatus.")
 
-        live_status = LiveStatus(host, port, **passthrough)
-        query = 'GET {}{}'.format(table, LS_EOL)
+        output_format = output_format.lower()
+        if output_format == 'columnar':
+            if stats is not None or aggregate is not None:
+                # Stats rows hold values without a column header.
+                return (False, "The columnar output format can't be combined with stats "
+                               "or aggregate.")
+            if not columns:
+                return (False, "The columnar output format requires columns.")
+            if reducer is not None:
+                return (False, "The columnar output format can't be combined with a reducer.")
+            reducer = {"type": "columnar"}
+            output_format = 'json'
+        if output_format not in PARSERS:
+            return (False, "Unknown output format '{}', expected one of: columnar, {}".format(
+                output_format, ", ".join(sorted(PARSERS))))
+        parser = PARSERS[output_format]
+
+        aggregation = None
+        if aggregate is not None:
+            if columns is not None or stats is not None or stream or reducer is not None:
+                return (False, "aggregate can't be combined with columns, stats, stream "
+                               "or reducer.")
+            try:
+                aggregation = Aggregation(aggregate, table)
+            except ValueError as e:
+                LOG.error("Invalid aggregation: {}".format(e))
+                return (False, str(e))
+            columns = aggregation.columns
+            stats = aggregation.stats
 
-        if columns is not None:
-            query += self._process_columns(columns)
+        if columns is None and stats is None:
+            columns = default_columns(self.config, table)
+        if stats is not None:
+            try:
+                stats_aggregates(stats)
+            except ValueError as e:
+                LOG.error("Invalid stats {}: {}".format(stats, e))
+                return (False, "Invalid stats: {}".format(e))
 
-        if filters is not None:
-            query += self._process_filters(filters)
+        site_list = None
+        query_columns = columns
+        if self.config.get('sites') or sites is not None:
+            try:
+                site_list = select_sites(load_sites(self.config), sites)
+            except ValueError as e:
+                LOG.error("Invalid sites: {}".format(e))
+                return (False, str(e))
+            query_columns, site_index = split_site_column(columns)
+            if wait is not None and len(site_list) > 1:
+                return (False, "A wait applies to a single site, select it with sites.")
 
-        if stats is not None:
-            query += self._process_stats(stats)
+        try:
+            endpoints = [parse_endpoint(site['host'], site.get('port'))
+                         for site in site_list or load_sites(self.config)]
+        except ValueError as e:
+            LOG.error("Invalid livestatus endpoint: {}".format(e))
+            return (False, str(e))
+
+        if reducer is not None:
+            reducer_columns = columns
+            if site_list is not None and site_index is None:
+                reducer_columns = [SITE_COLUMN] + list(columns or [])
+            try:
+                build_reducer(reducer, reducer_columns)
+            except (TypeError, ValueError) as e:
+                LOG.error("Invalid reducer {}: {}".format(reducer, e))
+                return (False, "Invalid reducer: {}".format(e))
 
-        if limit is not None:
-            query += 'Limit: {}{}'.format(limit, LS_EOL)
+        schema = None
+        if self.config.get('schema_validation', True):
+            try:
+                schema = self._validate(table, referenced_columns(columns, filters, stats, wait),
+                                        site_list, passthrough)
+            except ValueError as e:
+                LOG.error("Invalid query: {}".format(e))
+                return (False, str(e))
+        if parser is iter_csv_rows:
+            known = schema.get(table) if schema is not None else None
+            parser = functools.partial(iter_csv_rows,
+                                       types=csv_column_types(query_columns, known))
+
+        query_stats = stats
+        weighted = 0
+        if site_list is not None and stats is not None and site_index is None and \
+                not stream and reducer is None:
+            # Merged site averages are weighted by each site's row count.
+            try:
+                hidden = stats_weights(stats)
+            except ValueError as e:
+                LOG.error("Invalid stats: {}".format(e))
+                return (False, str(e))
+            query_stats = stats + hidden
+            weighted = len(stats_aggregates(hidden))
+
+        query = build_query(table, query_columns, filters, query_stats, limit, wait)
+        query += output_format_headers(output_format, CSV_SEPARATORS)
 
+        meta = {}
+        query_cache = self._open_cache(cache)
         tmp = None
-        if output_format.lower() == 'json':
-            query += 'OutputFormat: json{}'.format(LS_EOL)
-            tmp = live_status.get_json(query, allow_empty_list)
-        else:
-            tmp = live_status.execute(query)
+        if query_cache is not None:
+            site_names = None
+            if site_list is not None:
+                site_names = [site['name'] for site in site_list]
+                site_names.append(site_index)
+            cache_key = query_cache.key(query, [endpoint_key(endpoint) for endpoint in endpoints],
+                                        reducer, site_names)
+            tmp = self._cache_get(query_cache, cache_key, allow_empty_list)
+
+        started = time.time()
+        if tmp is None:
+            if site_list is None:
+                live_status = LiveStatus(self.config['host'], self.config.get('port'),
+                                         proxy=proxy_url(self.config), **passthrough)
+                live_status.breaker = self._circuit_breaker(live_status.upstream)
+                live_status.limiter = build_limiter(self.config, live_status.upstream)
+                tmp = self._fetch(live_status, query, parser, columns, stream, reducer,
+                                  allow_empty_list)
+                if live_status.breaker is not None:
+                    live_status.breaker.close()
+                if live_status.limiter is not None:
+                    live_status.limiter.close()
+                meta["metrics"] = self._report_metrics(live_status)
+            else:
+                if site_timeout is None:
+                    site_timeout = self.config.get('site_timeout')
+                if site_timeout is not None:
+                    passthrough["query_deadline"] = site_timeout
+                tmp = self._fetch_sites(site_list, passthrough, query, parser, columns,
+                                        site_index, query_stats, limit, stream, reducer,
+                                        allow_empty_list, meta, weighted)
+            if tmp is not None and query_cache is not None:
+                self._cache_set(query_cache, cache_key, table, tmp)
+
+        if query_cache is not None:
+            meta["cache"] = query_cache.counters()
+            query_cache.close()
+
+        if wait is not None:
+            meta["wait"] = self._wait_status(wait, tmp, time.time() - started)
+            if meta["wait"]["status"] == "failed":
+                LOG.error("Livestatus wait failed after {}s.".format(meta["wait"]["waited"]))
+                return (False, {"error": result[1], "wait": meta["wait"]})
+            if meta["wait"]["status"] == "expired":
+                LOG.warning("Livestatus wait expired after {}s.".format(meta["wait"]["waited"]))
+                return (False, {"result": tmp, "wait": meta["wait"]})
 
         if tmp is not None:
+            if aggregation is not None:
+                tmp = aggregation.label(tmp)
+            if include_meta:
+                tmp = {"result": tmp, "meta": meta}
             result = (True, tmp)
 
         return result
 
+    def _wait_status(self, wait, reply, waited):
+        """
+        Return the outcome of a wait.  Livestatus answers when the condition holds or
+        the timeout expired, so a reply arriving after the timeout means it expired.
+        """
+        timeout = wait_timeout(wait)
+        if reply is None:
+            status = "failed"
+        elif waited >= timeout:
+            status = "expired"
+        else:
+            status = "met"
+        return {"status": status, "waited": round(waited, 3), "timeout": timeout}
+
+    def _fetch(self, live_status, query, parser, columns, stream, reducer,
+               allow_empty_list=True):
+        """
+        Send the query to livestatus and return the parsed result or None.
+        """
+        if stream or reducer is not None:
+            return self._reduce_stream(live_status, query, parser, columns, reducer,
+                                       allow_empty_list)
+        if parser is iter_json_rows:
+            return live_status.get_json(query, allow_empty_list)
+        return live_status.get_rows(query, parser, allow_empty_list)
+
+    def _fetch_sites(self, site_list, passthrough, query, parser, columns, site_index, stats,
+                     limit, stream, reducer, allow_empty_list, meta, weighted=0):
+        """
+        Send the query to every site in parallel and merge the replies.  A site
+        which fails or times out is reported in meta["sites"] and left out of the result.
+        Streamed rows are reduced per site, a site's rows are merged once it replied
+        completely so a failure part-way leaves none of its rows in the result.
+        """
+        merged_reducer = None
+        row_index = site_index if site_index is not None else 0
+        if stream or reducer is not None:
+            if site_index is None:
+                columns = [SITE_COLUMN] + list(columns or [])
+            try:
+                merged_reducer = build_reducer(reducer, columns)
+            except (TypeError, ValueError) as e:
+                LOG.error("Invalid reducer {}: {}".format(reducer, e))
+                return None
+
+        meta["metrics"] = {}
+
+        def fetch(site):
+            live_status = LiveStatus(site['host'], site.get('port'), **passthrough)
+            live_status.breaker = self._circuit_breaker(live_status.upstream)
+            live_status.limiter = build_limiter(self.config, live_status.upstream)
+            try:
+                if merged_reducer is None:
+                    if parser is iter_json_rows:
+                        return live_status.get_json(query)
+                    return live_status.get_rows(query, parser)
+                site_reducer = site_reducers[site['name']]
+                for row in live_status.iter_rows(query, parser):
+                    row.insert(row_index, site['name'])
+                    site_reducer.add(row)
+                return site_reducer
+            finally:
+                if live_status.breaker is not None:
+                    live_status.breaker.close()
+                if live_status.limiter is not None:
+                    live_status.limiter.close()
+                meta["metrics"][site['name']] = self._report_metrics(live_status,
+                                                                     site['name'])
+
+        site_reducers = {}
+        if merged_reducer is not None:
+            site_reducers = dict((site['name'], merged_reducer.fork()) for site in site_list)
+
+        replies = []
+        meta["sites"] = {}
+        with ThreadPoolExecutor(max_workers=len(site_list)) as executor:
+            futures = [(site['name'], executor.submit(fetch, site)) for site in site_list]
+            for name, future in futures:
+                try:
+                    rows = future.result()
+                except (socket.error, EOFError, TimeoutException, LiveStatusError,
+                        ValueError, TypeError) as e:
+                    rows = None
+                    LOG.error("Site {} failed: {}".format(name, e))
+                if rows is None:
+                    LOG.warning("Site {} didn't reply, leaving it out of the result.".format(name))
+                    meta["sites"][name] = "failed"
+                    continue
+                meta["sites"][name] = "ok"
+                if merged_reducer is not None:
+                    merged_reducer.merge(rows)
+                    rows = []
+                replies.append((name, rows))
+
+        if not replies:
+            LOG.error("None of the sites replied.")
+            return None
+        if merged_reducer is not None:
+            if allow_empty_list is not True and merged_reducer.count == 0:
+                LOG.error("No data received from livestatus API")
+                return None
+            return merged_reducer.result()
+
+        if stats is not None and site_index is None:
+            data = merge_stats(replies, stats_aggregates(stats), weighted)
+        else:
+            data = merge_rows(replies, site_index)
+            if limit is not None:
+                data = data[:int(limit)]
+        if allow_empty_list is not True and data == []:
+            LOG.error("No data received from livestatus API")
+            return None
+        return data
+
+    def _report_metrics(self, live_status, site=None):
+        """
+        Emit the metrics of the last query to the configured sink and return them
+        as a dict.
+        """
+        metrics = live_status.metrics
+        if metrics is None:
+            return None
+        report_query(metrics, build_sink(self.config),
+                     self.config.get('slow_query_threshold', SLOW_QUERY_THRESHOLD),
+                     {'site': site} if site is not None else None)
+        return metrics.as_dict()
+
+    def _circuit_breaker(self, endpoint):
+        """
+        Return the host wide circuit breaker of the endpoint unless it is disabled.
+        """
+        if not self.config.get('circuit_breaker_enabled', True):
+            return None
+        return CircuitBreaker(endpoint,
+                              self.config.get('state_path', STATE_PATH),
+                              self.config.get('circuit_failure_threshold',
+                                              CIRCUIT_FAILURE_THRESHOLD),
+                              self.config.get('circuit_reset_timeout', CIRCUIT_RESET_TIMEOUT))
+
+    def _validate(self, table, names, site_list, passthrough):
+        """
+        Check the table and column names against the schema of the first site and
+        return the schema.  The query is sent unchecked, and None returned, when the
+        schema can't be fetched.
+
+        A cached schema is used without a broker round trip.  The fetch shares the
+        query's circuit breaker and time limits, so it fails fast while the circuit
+        is open rather than waiting on a hung broker.
+        """
+        options = {"keepalive": passthrough["keepalive"], "query_max_retries": 1,
+                   "priority": passthrough["priority"]}
+        for key in ("query_duration", "query_deadline"):
+            if key in passthrough:
+                options[key] = passthrough[key]
+        if site_list is None:
+            live_status = LiveStatus(self.config['host'], self.config.get('port'),
+                                     proxy=proxy_url(self.config), **options)
+        else:
+            live_status = LiveStatus(site_list[0]['host'], site_list[0].get('port'), **options)
+        live_status.breaker = self._circuit_breaker(live_status.upstream)
+        live_status.limiter = build_limiter(self.config, live_status.upstream)
+        try:
+            schema_cache = SchemaCache(self.config.get('state_path', STATE_PATH),
+                                       self.config.get('schema_ttl', SCHEMA_TTL))
+            try:
+                schema = schema_cache.schema(live_status)
+                if schema is None:
+                    return None
+                try:
+                    validate(schema, table, names)
+                except ValueError:
+                    schema = schema_cache.schema(live_status, SCHEMA_RECHECK)
+                    validate(schema, table, names)
+                return schema
+            finally:
+                schema_cache.close()
+        except (sqlite3.Error, socket.error, EOFError, TimeoutException,
+                LiveStatusError) as e:
+            LOG.warning("Livestatus schema unavailable, query not checked. {}".format(e))
+        finally:
+            if live_status.breaker is not None:
+                live_status.breaker.close()
+            if live_status.limiter is not None:
+                live_status.limiter.close()
+
+    def _open_cache(self, cache=None):
+        """
+        Return a QueryCache when caching is enabled, otherwise None.
+        """
+        if cache is None:
+            cache = self.config.get('cache_enabled', False)
+        if not cache:
+            return None
+        try:
+            return QueryCache(self.config.get('cache_path', CACHE_PATH),
+                              self.config.get('cache_ttl'),
+                              self.config.get('cache_max_entries', CACHE_MAX_ENTRIES))
+        except sqlite3.Error as e:
+            LOG.warning("Result cache unavailable, querying livestatus directly. {}".format(e))
+            return None
+
+    def _cache_get(self, query_cache, key, allow_empty_list=True):
+        try:
+            value = query_cache.get(key)
+        except sqlite3.Error as e:
+            LOG.warning("Result cache lookup failed. {}".format(e))
+            return None
+        if allow_empty_list is not True and value == []:
+            return None
+        return value
+
+    def _cache_set(self, query_cache, key, table, value):
+        try:
+            query_cache.set(key, table, value)
+        except (sqlite3.Error, TypeError, ValueError) as e:
+            LOG.warning("Result cache update failed. {}".format(e))
+
+    def _reduce_stream(self, live_status, query, parser, columns, reducer,
+                       allow_empty_list=True):
+        """
+        Feed the streamed rows of a query to a reducer and return its result.
+        """
+        try:
+            reduced = build_reducer(reducer, columns)
+        except (TypeError, ValueError) as e:
+            LOG.error("Invalid reducer {}: {}".format(reducer, e))
+            return None
+        try:
+            for row in live_status.iter_rows(query, parser):
+                reduced.add(row)
+        except (socket.error, EOFError, TimeoutException, LiveStatusError) as e:
+            LOG.error("Streaming from livestatus API failed: {}".format(e))
+            return None
+        except ValueError as e:
+            LOG.error("Error while parsing the livestatus reply. {}".format(e))
+            return None
+        except TypeError as e:
+            LOG.error("Unable to reduce the livestatus rows. {}".format(e))
+            return None
+        if allow_empty_list is not True and reduced.count == 0:
+            LOG.error("No data received from livestatus API")
+            return None
+        return reduced.result()
+
     def _process_columns(self, columns):
         """
         Convert columns list to livestatus formatted string.
         """
-        return self._build_list('Columns: ', LS_EOL, [' '.join(columns)])
+        return process_columns(columns)
 
     def _process_filters(self, filters):
         """
         Convert filters list to livestatus formatted string.
         """
-        formatted_filters = []
-        try:
-            for _item in filters:
-                formatted_filters.append(FilterItem(_item))
-        except (ValueError) as e:
-            LOG.error("Incorrectly formatted logic operator in query. {}".format(filters))
-        return self._build_list(items=formatted_filters)
+        return process_filters(filters)
 
     def _process_stats(self, stats):
         """
         Convert stats list to livestatus formatted string.
         """
-        formatted_stats = []
-        try:
-            for _item in stats:
-                formatted_stats.append(StatsItem(_item))
-        except (ValueError) as e:
-            LOG.error("Incorrectly formatted logic operator in query. {}".format(stats))
-        return self._build_list(items=formatted_stats)
+        return process_stats(stats)
 
     def _build_list(self, prefix=None, postfix=None, items=[]):
         """
         Loop over list items and apply a prefix/postfix to each element.
         Returns a livestatus formatted string.
         """
-        tmp = ''
-        for _item in items:
-            if isinstance(_item, StatsItem) or isinstance(_item, FilterItem):
-                tmp += "%s" % _item
-            else:
-                tmp += '{}{}{}'.format(prefix, _item, postfix)
-        else:
-            postfix = ''
-        tmp += postfix
-        return tmp
+        return build_list(prefix, postfix, items)
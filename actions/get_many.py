@@ -0,0 +1,92 @@
+from st2actions.runners.pythonrunner import Action
+from st2common import log as logging
+
+from concurrent.futures import ThreadPoolExecutor
+
+from get_data import Get
+
+LOG = logging.getLogger(__name__)
+
+QUERY_KEYS = ('table', 'columns', 'filters', 'stats', 'limit', 'output_format',
+              'allow_empty_list', 'stream', 'reducer', 'cache', 'include_meta',
+              'sites', 'site_timeout', 'aggregate', 'wait', 'priority')
+
+
+class GetMany(Action):
+    """
+    LiveStatus GetMany class, runs a batch of Get queries concurrently.
+    """
+    def run(self, queries, max_workers=4, query_max_retries=None,
+            query_duration=None, query_retry_delay=None, query_deadline=None):
+        """
+        The run method to be called by Stackstorm.
+
+        queries - a list of query specs, each one takes the Get parameters
+                  (table, columns, filters, stats, limit, ...) and an optional name.
+        max_workers - the number of queries sent to livestatus at the same time.
+        query_max_retries, query_duration, query_retry_delay, query_deadline - applied
+        to every query.
+
+        The queries share the pooled livestatus connections.  A failing query is
+        reported in "errors" and doesn't fail the other queries of the batch.
+        """
+        passthrough = {}
+        if query_max_retries is not None:
+            passthrough["query_max_retries"] = query_max_retries
+        if query_duration is not None:
+            passthrough["query_duration"] = query_duration
+        if query_retry_delay is not None:
+            passthrough["query_retry_delay"] = query_retry_delay
+        if query_deadline is not None:
+            passthrough["query_deadline"] = query_deadline
+
+        results = {}
+        errors = {}
+        pending = {}
+        names = set()
+        get = Get(self.config)
+
+        with ThreadPoolExecutor(max_workers=max(1, int(max_workers))) as executor:
+            for index, spec in enumerate(queries):
+                if not isinstance(spec, dict):
+                    errors['query_{}'.format(index)] = \
+                        "A query spec must be an object, got {}.".format(spec)
+                    continue
+                name = spec.get('name', 'query_{}'.format(index))
+                if name in names:
+                    errors['query_{}'.format(index)] = "Duplicate query name '{}'.".format(name)
+                    continue
+                names.add(name)
+                try:
+                    params = self._process_spec(spec)
+                except ValueError as e:
+                    errors[name] = str(e)
+                    continue
+                params.update(passthrough)
+                pending[name] = executor.submit(get.run, **params)
+
+            for name, future in pending.items():
+                try:
+                    success, data = future.result()
+                except Exception as e:
+                    LOG.error("Query {} raised an error: {}".format(name, e))
+                    errors[name] = "Unhandled error: {}".format(e)
+                    continue
+                if success:
+                    results[name] = data
+                else:
+                    errors[name] = data
+
+        result = {"results": results, "errors": errors}
+        return (len(results) > 0 or len(errors) == 0, result)
+
+    def _process_spec(self, spec):
+        """
+        Return the Get.run parameters for a query spec.
+        """
+        if 'table' not in spec:
+            raise ValueError("Query spec requires a table.")
+        unknown = set(spec.keys()) - set(QUERY_KEYS) - set(['name'])
+        if unknown:
+            raise ValueError("Unknown query spec keys: {}".format(", ".join(sorted(unknown))))
+        return dict((key, spec[key]) for key in QUERY_KEYS if key in spec)
@@ -0,0 +1,85 @@
+from st2actions.runners.pythonrunner import Action
+from st2common import log as logging
+
+import socket
+
+from lib.client import LiveStatus
+from lib.limiter import build_limiter
+from lib.paginate import LOG_WINDOW, PAGE_SIZE, Paginator
+from lib.proxy import proxy_url
+from lib.receive import LiveStatusError, TimeoutException
+from lib.sites import load_sites, select_sites
+
+LOG = logging.getLogger(__name__)
+
+
+class GetPages(Action):
+    """
+    LiveStatus GetPages class, reads a large table a few pages at a time.
+    """
+    def run(self, table, columns, filters=None, page_size=PAGE_SIZE, max_pages=10,
+            cursor=None, key=None, since=None, until=None, window=LOG_WINDOW, site=None):
+        """
+        The run method to be called by Stackstorm.
+
+        table - the table query.
+        columns - the columns to return in the dataset.
+        filters - conditions to filter result set.
+        page_size - the number of rows per query.
+        max_pages - the number of pages read by this execution, empty log windows included.
+        cursor - the cursor returned by the previous execution to continue from.
+        key - ordered key columns, the table's name or id columns by default.
+        since, until - epochs bounding a walk of the log table, the last day by default.
+        window - the initial time window in seconds of a log walk.
+        site - the configured site to read, required when several sites are configured.
+
+        Returns {"rows", "count", "pages", "cursor"}, cursor is null once the walk
+        completed.  A failure returns the rows read so far and the cursor after them.
+        """
+        try:
+            configured = load_sites(self.config)
+            sites = configured
+            if site is not None:
+                sites = select_sites(sites, [site])
+            elif len(sites) > 1:
+                raise ValueError("Several sites are configured, choose one with site.")
+        except ValueError as e:
+            return (False, str(e))
+        endpoint = sites[0]
+        # The proxy forwards to the default site.
+        proxy = proxy_url(self.config) if endpoint is configured[0] else None
+        # Exports queue behind interactive reads and commands.
+        live_status = LiveStatus(endpoint['host'], endpoint.get('port'), proxy=proxy,
+                                 keepalive=self.config.get('keepalive', True), priority='low')
+        live_status.limiter = build_limiter(self.config, live_status.upstream)
+
+        try:
+            paginator = Paginator(live_status, table, columns, filters, page_size, key, cursor,
+                                  since, until, window, endpoint['name'])
+        except ValueError as e:
+            LOG.error("Invalid pagination: {}".format(e))
+            return (False, str(e))
+
+        rows = []
+        error = None
+        try:
+            for page in paginator.pages(max_pages):
+                rows.extend(page)
+        except (socket.error, EOFError, TimeoutException, LiveStatusError, ValueError) as e:
+            LOG.error("Reading page {} of {} failed: {}".format(
+                paginator.pages_read + 1, table, e))
+            error = str(e)
+
+        if live_status.limiter is not None:
+            live_status.limiter.close()
+
+        result = {
+            "rows": rows,
+            "count": len(rows),
+            "pages": paginator.pages_read,
+            "cursor": paginator.cursor,
+        }
+        if error is not None:
+            result["error"] = error
+            return (False, result)
+        return (True, result)
@@ -0,0 +1,63 @@
+from st2actions.runners.pythonrunner import Action
+from st2common import log as logging
+
+from get_data import Get
+from lib.join import HashJoinReducer, JoinSpec, build_index
+from lib.sites import SITE_COLUMN
+
+LOG = logging.getLogger(__name__)
+
+
+class Join(Action):
+    """
+    LiveStatus Join class, joins the rows of several tables client side.
+    """
+    def run(self, queries, how='left', sites=None):
+        """
+        The run method to be called by Stackstorm.
+
+        queries - Get-style sub-queries, the first one is streamed and probed against
+                  the others, see lib/join.py for the format.
+        how - left keeps every probe row, inner drops the rows missing a join.
+        sites - names of the configured sites to query, defaults to all of them.
+
+        Every sub-query is sent once.  Returns {"count", "probed", "built", "rows"}
+        where built is the number of rows hashed per build sub-query.
+        """
+        try:
+            spec = JoinSpec(queries, how)
+        except ValueError as e:
+            LOG.error("Invalid join: {}".format(e))
+            return (False, str(e))
+
+        multi_site = bool(self.config.get('sites')) or sites is not None
+        get = Get(self.config)
+
+        joins = []
+        built = {}
+        for build in spec.builds:
+            columns = build.columns
+            if multi_site:
+                columns = [SITE_COLUMN] + columns
+            success, rows = get.run(build.table, columns, build.filters, limit=build.limit,
+                                    cache=False, sites=sites)
+            if not success:
+                return (False, "Sub-query '{}' failed: {}".format(build.name, rows))
+            joins.append((build.name, build.probe_key,
+                          build_index(rows, columns, build.build_key), build.many))
+            built[build.name] = len(rows)
+
+        probe = spec.probe
+        columns = probe.columns
+        if multi_site:
+            columns = [SITE_COLUMN] + columns
+        try:
+            reducer = HashJoinReducer(columns, joins, spec.how)
+        except ValueError as e:
+            return (False, str(e))
+        success, rows = get.run(probe.table, columns, probe.filters, limit=probe.limit,
+                                stream=True, reducer=reducer, cache=False, sites=sites)
+        if not success:
+            return (False, "Sub-query '{}' failed: {}".format(probe.name, rows))
+        return (True, {"count": len(rows), "probed": reducer.count, "built": built,
+                       "rows": rows})
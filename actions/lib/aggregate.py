@@ -0,0 +1,94 @@
+"""
+Structured aggregation compiled to livestatus Stats queries.
+
+An aggregation is described by a dict, for example:
+
+    {"metrics": "state"}
+    {"group_by": ["host_name"], "metrics": {"problems": "state > 0",
+                                            "unhandled": ["state > 0", "acknowledged = 0", "&2"],
+                                            "worst_latency": "max latency"}}
+
+Each metric is a stats list producing a single value: a filter counting the
+matching rows, a "sum/min/max/avg/std column" function, or several filters
+combined with the "&N", "|N" and "!" operators used by the stats parameter.
+metrics may also name a preset from PRESETS.
+
+The aggregation is answered by livestatus, only the group columns and the
+metric values are returned, and they are labelled back into dicts.
+"""
+from lib.sites import stats_aggregates
+
+STATE_LABELS = {
+    'services': ['ok', 'warning', 'critical', 'unknown'],
+    'hosts': ['up', 'down', 'unreachable'],
+}
+
+PRESETS = {
+    'acknowledged': {'acknowledged': 'acknowledged = 1', 'unacknowledged': 'acknowledged = 0'},
+    'state_type': {'soft': 'state_type = 0', 'hard': 'state_type = 1'},
+    'downtime': {'in_downtime': 'scheduled_downtime_depth > 0',
+                 'not_in_downtime': 'scheduled_downtime_depth = 0'},
+}
+
+
+def preset_metrics(name, table):
+    """
+    Return the (label, stats list) pairs of a preset for the table.
+    """
+    if name == 'state':
+        if table not in STATE_LABELS:
+            raise ValueError("The state preset only applies to {}.".format(
+                " and ".join(sorted(STATE_LABELS))))
+        return [(label, ['state = {}'.format(state)])
+                for state, label in enumerate(STATE_LABELS[table])]
+    if name not in PRESETS:
+        raise ValueError("Unknown aggregation preset '{}', expected one of: {}".format(
+            name, ", ".join(['state'] + sorted(PRESETS))))
+    return sorted((label, [stats]) for label, stats in PRESETS[name].items())
+
+
+class Aggregation(object):
+    """
+    Aggregation compiles an aggregation spec to the columns and stats parameters of
+    a Get query and labels the stats rows livestatus returns.
+    """
+    def __init__(self, spec, table):
+        if not isinstance(spec, dict):
+            raise ValueError("An aggregation must be an object, got {}.".format(spec))
+        unknown = set(spec.keys()) - set(['group_by', 'metrics'])
+        if unknown:
+            raise ValueError("Unknown aggregation keys: {}".format(", ".join(sorted(unknown))))
+
+        self.group_by = list(spec.get('group_by') or [])
+        metrics = spec.get('metrics', 'state')
+        if isinstance(metrics, dict):
+            metrics = sorted((label, stats if isinstance(stats, list) else [stats])
+                             for label, stats in metrics.items())
+        else:
+            metrics = preset_metrics(metrics, table)
+        if not metrics:
+            raise ValueError("An aggregation needs at least one metric.")
+
+        self.labels = []
+        self.stats = []
+        for label, stats in metrics:
+            if len(stats_aggregates(stats)) != 1:
+                raise ValueError("Metric '{}' must produce a single value, got {}.".format(
+                    label, stats))
+            self.labels.append(label)
+            self.stats.extend(stats)
+
+    @property
+    def columns(self):
+        return self.group_by or None
+
+    def label(self, rows):
+        """
+        Convert the stats rows to dicts.  Without group_by the single row becomes one
+        dict of metrics, otherwise every group is a dict of its columns and metrics.
+        """
+        names = self.group_by + self.labels
+        labelled = [dict(zip(names, row)) for row in rows]
+        if not self.group_by:
+            return labelled[0] if labelled else dict((label, 0) for label in self.labels)
+        return labelled
@@ -0,0 +1,144 @@
+"""
+Asyncio livestatus client.
+
+AsyncLiveStatus mirrors the blocking LiveStatus class for sensors and other
+long running processes: queries are built with the same FilterItem/StatsItem
+semantics as the Get action, run over pooled KeepAlive streams, are bounded
+by asyncio.wait_for and back off without blocking the event loop.
+"""
+import json
+import time
+import socket
+import asyncio
+import logging
+
+from lib.endpoint import parse_endpoint
+from lib.query import LS_EOL, build_query, keepalive_query
+from lib.receive import LS_FIXED16_LEN, LiveStatusError, parse_fixed16
+from lib.retry import backoff_delay
+
+LOG = logging.getLogger(__name__)
+
+
+class AsyncLiveStatus(object):
+    """
+    AsyncLiveStatus provides concurrent, non-blocking access to one livestatus server.
+
+    @max_connections - the number of queries in flight against this server.
+    @query_duration - per query timeout in seconds, applied with asyncio.wait_for.
+    @query_retry_delay - base delay of the exponential backoff between attempts.
+    """
+    def __init__(self, host, port=None, query_max_retries=5, query_duration=5,
+                 query_retry_delay=1, max_retry_delay=30, max_connections=16,
+                 idle_timeout=30):
+        self.host = host
+        self.port = port
+        self.endpoint = parse_endpoint(host, port)
+        self.query_max_retries = query_max_retries
+        self.query_duration = query_duration           # unit=seconds
+        self.query_retry_delay = query_retry_delay     # unit=seconds
+        self.max_retry_delay = max_retry_delay         # unit=seconds
+        self.max_connections = max_connections
+        self.idle_timeout = idle_timeout               # unit=seconds
+        self._idle = []
+        self._slots = None
+
+    async def execute(self, query):
+        """
+        Send the query and return the decoded reply, retrying with backoff on
+        timeouts and connection errors.
+
+        @query - a livestatus query.
+        """
+        if self._slots is None:
+            self._slots = asyncio.Semaphore(self.max_connections)
+        attempt = 0
+        while True:
+            try:
+                async with self._slots:
+                    body = await asyncio.wait_for(self._query(query), self.query_duration)
+                return body.decode('utf-8')
+            except LiveStatusError:
+                raise
+            except (asyncio.TimeoutError, OSError, asyncio.IncompleteReadError) as e:
+                attempt += 1
+                LOG.error("Livestatus query failed {}/{}: {}".format(
+                    attempt, self.query_max_retries, type(e).__name__))
+                if attempt >= self.query_max_retries:
+                    raise
+                await asyncio.sleep(backoff_delay(attempt, self.query_retry_delay,
+                                                  self.max_retry_delay))
+
+    async def get_json(self, query, allow_empty_list=True):
+        """
+        Parse the result of a live status query as JSON.
+
+        @query - a livestatus query. The query MUST request the result
+                 is returned in JSON format.
+        """
+        data = json.loads(await self.execute(query))
+        if allow_empty_list is not True and data == []:
+            raise ValueError("Livestatus returned an empty list.")
+        return data
+
+    async def get(self, table, columns=None, filters=None, stats=None, limit=None,
+                  allow_empty_list=True):
+        """
+        Run a JSON query built from the same parameters as the Get action.
+        """
+        query = build_query(table, columns, filters, stats, limit)
+        query += 'OutputFormat: json{}'.format(LS_EOL)
+        return await self.get_json(query, allow_empty_list)
+
+    async def close(self):
+        """
+        Close every idle stream.
+        """
+        idle, self._idle = self._idle, []
+        for _, writer, _ in idle:
+            writer.close()
+
+    async def _query(self, query):
+        payload = keepalive_query(query).encode('utf-8')
+        while True:
+            reader, writer, reused = await self._acquire()
+            try:
+                writer.write(payload)
+                await writer.drain()
+                status, length = parse_fixed16(await reader.readexactly(LS_FIXED16_LEN))
+                body = await reader.readexactly(length)
+            except (OSError, asyncio.IncompleteReadError):
+                writer.close()
+                if reused:
+                    LOG.debug("Pooled livestatus stream was broken, reconnecting.")
+                    continue
+                raise
+            except BaseException:
+                # Includes the cancellation from wait_for, the stream state is unknown.
+                writer.close()
+                raise
+            self._release(reader, writer)
+            if status != 200:
+                raise LiveStatusError(status, body.decode('utf-8', 'replace').strip())
+            return body
+
+    async def _acquire(self):
+        while self._idle:
+            reader, writer, last_used = self._idle.pop()
+            if (time.time() - last_used > self.idle_timeout or reader.at_eof() or
+                    writer.is_closing()):
+                writer.close()
+                continue
+            return reader, writer, True
+        family, address = self.endpoint
+        if family == socket.AF_UNIX:
+            reader, writer = await asyncio.open_unix_connection(address)
+        else:
+            reader, writer = await asyncio.open_connection(*address)
+        return reader, writer, False
+
+    def _release(self, reader, writer):
+        if len(self._idle) < self.max_connections:
+            self._idle.append((reader, writer, time.time()))
+        else:
+            writer.close()
@@ -0,0 +1,116 @@
+"""
+TTL + LRU cache for livestatus query results.
+
+Every python-script execution runs in a new process, so the cache lives in a
+local SQLite file which all executions on the host share.  Entries expire
+after a per-table TTL and the least recently used entries are evicted once
+max_entries is exceeded.
+"""
+import os
+import re
+import json
+import time
+import logging
+
+from lib.private import STATE_DIRECTORY, open_database
+
+LOG = logging.getLogger(__name__)
+
+CACHE_PATH = os.path.join(STATE_DIRECTORY, 'cache.sqlite')
+CACHE_TTL = {"default": 30, "services": 10, "hosts": 30, "contacts": 3600}
+CACHE_MAX_ENTRIES = 1000
+
+SPACES = re.compile(r'[ \t]+')
+
+
+def normalize_query(query):
+    """
+    Return the query with blank lines and redundant whitespace removed, so that
+    equivalent query texts share a cache entry.
+    """
+    lines = [SPACES.sub(' ', line).strip() for line in query.splitlines()]
+    return '\n'.join(line for line in lines if line)
+
+
+class QueryCache(object):
+    """
+    QueryCache stores JSON serialisable query results in a SQLite file.
+    """
+    def __init__(self, path=CACHE_PATH, ttl=None, max_entries=CACHE_MAX_ENTRIES):
+        self.path = path
+        self.ttl = dict(CACHE_TTL)
+        self.ttl.update(ttl or {})
+        self.max_entries = int(max_entries)
+        self.hit = False
+        self._db = open_database(path, timeout=5)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        with self._db:
+            self._db.execute("CREATE TABLE IF NOT EXISTS entries ("
+                             "key TEXT PRIMARY KEY, tbl TEXT, value TEXT, "
+                             "expires REAL, last_access REAL)")
+            self._db.execute("CREATE TABLE IF NOT EXISTS counters ("
+                             "name TEXT PRIMARY KEY, value INTEGER)")
+
+    @staticmethod
+    def key(query, endpoints, *extra):
+        """
+        Build the cache key from the query text, the endpoint_key() of each broker
+        answering it, and any other result shaping options.
+        """
+        key = normalize_query(query) + '\n#' + json.dumps(list(endpoints))
+        for item in extra:
+            if item is not None:
+                key += '\n#' + json.dumps(item, sort_keys=True)
+        return key
+
+    def ttl_for(self, table):
+        return float(self.ttl.get(table, self.ttl.get("default", 0)))
+
+    def get(self, key):
+        """
+        Return the cached value or None, counting the hit or miss.
+        """
+        now = time.time()
+        with self._db:
+            row = self._db.execute("SELECT value, expires FROM entries WHERE key = ?",
+                                   (key,)).fetchone()
+            if row is not None and row[1] > now:
+                self._db.execute("UPDATE entries SET last_access = ? WHERE key = ?", (now, key))
+                self._count("hits")
+                self.hit = True
+                return json.loads(row[0])
+            self._count("misses")
+        self.hit = False
+        return None
+
+    def set(self, key, table, value):
+        """
+        Store the value for the table's TTL and evict expired and least recently used entries.
+        """
+        ttl = self.ttl_for(table)
+        if ttl <= 0:
+            return
+        now = time.time()
+        with self._db:
+            self._db.execute("INSERT OR REPLACE INTO entries VALUES (?, ?, ?, ?, ?)",
+                             (key, table, json.dumps(value), now + ttl, now))
+            self._db.execute("DELETE FROM entries WHERE expires <= ?", (now,))
+            self._db.execute("DELETE FROM entries WHERE key IN ("
+                             "SELECT key FROM entries ORDER BY last_access DESC "
+                             "LIMIT -1 OFFSET ?)", (self.max_entries,))
+
+    def counters(self):
+        """
+        Return the host wide hit and miss counters and the last lookup's outcome.
+        """
+        counters = dict(self._db.execute("SELECT name, value FROM counters").fetchall())
+        return {"hit": self.hit,
+                "hits": counters.get("hits", 0),
+                "misses": counters.get("misses", 0)}
+
+    def close(self):
+        self._db.close()
+
+    def _count(self, name):
+        self._db.execute("INSERT OR IGNORE INTO counters VALUES (?, 0)", (name,))
+        self._db.execute("UPDATE counters SET value = value + 1 WHERE name = ?", (name,))
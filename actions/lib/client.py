@@ -0,0 +1,530 @@
+"""
+Blocking livestatus client shared by the actions and the sensors.
+"""
+import sys
+import json
+import errno
+import time
+import atexit
+import select
+import socket
+import logging
+import threading
+
+from lib.endpoint import connect, parse_endpoint
+from lib.limiter import AdmissionTimeout
+from lib.metrics import QueryMetrics
+from lib.query import LS_EOL, keepalive_query
+from lib.receive import (LS_FIXED16_LEN, LiveStatusError, TimeoutException, iter_recv,
+                         parse_fixed16, recv_exact, recv_until_eof)
+from lib.retry import CircuitOpenError, backoff_delay
+from lib.stream import iter_json_rows
+
+LOG = logging.getLogger(__name__)
+
+
+class ConnectionPool(object):
+    """
+    ConnectionPool keeps idle livestatus sockets so KeepAlive queries can reuse them.
+
+    Sockets are keyed by endpoint.  Idle sockets older than idle_timeout are evicted
+    and sockets which became readable while idle (closed by the broker) are discarded.
+    """
+    def __init__(self, max_idle=4, idle_timeout=30):
+        self.max_idle = max_idle
+        self.idle_timeout = idle_timeout           # unit=seconds
+        self._idle = {}
+        self._lock = threading.Lock()
+
+    def acquire(self, endpoint, timeout):
+        """
+        Return a (socket, reused) tuple for the endpoint.
+        """
+        while True:
+            with self._lock:
+                idle = self._idle.get(endpoint, [])
+                if not idle:
+                    break
+                server, last_used = idle.pop()
+            if time.time() - last_used > self.idle_timeout or self._is_broken(server):
+                LOG.debug("Evicting idle livestatus connection to {}".format(endpoint))
+                self.discard(server)
+                continue
+            server.settimeout(timeout)
+            return server, True
+
+        return connect(endpoint, timeout), False
+
+    def release(self, endpoint, server):
+        """
+        Return a healthy socket to the pool.
+        """
+        with self._lock:
+            idle = self._idle.setdefault(endpoint, [])
+            if len(idle) < self.max_idle:
+                idle.append((server, time.time()))
+                return
+        self.discard(server)
+
+    def discard(self, server):
+        try:
+            server.close()
+        except socket.error:
+            pass
+
+    def clear(self):
+        with self._lock:
+            idle, self._idle = self._idle, {}
+        for connections in idle.values():
+            for server, _ in connections:
+                self.discard(server)
+
+    @staticmethod
+    def _is_broken(server):
+        """
+        An idle KeepAlive socket must not be readable, readable means EOF or stray data.
+        """
+        try:
+            readable, _, _ = select.select([server], [], [], 0)
+        except (socket.error, ValueError):
+            return True
+        return bool(readable)
+
+
+POOL = ConnectionPool()
+atexit.register(POOL.clear)
+
+
+class LiveStatus(object):
+    """
+    LiveStatus class provides network access to the Live status server.
+
+    When keepalive is enabled, queries are sent with "KeepAlive: on" and
+    "ResponseHeader: fixed16" over sockets borrowed from the shared POOL.
+
+    Every query has its own retry budget: query_max_retries attempts of at most
+    query_duration seconds each, separated by exponential backoff with jitter
+    starting at query_retry_delay, all within query_deadline seconds overall.  When
+    query_deadline is None the attempts and their backoff bound the query instead.
+    The circuit breaker, when given, makes queries fail fast while the endpoint
+    is known to be down.
+
+    The timings and sizes of the last query are kept in the metrics attribute.
+
+    proxy, a unix:// URL of the local livestatus proxy, is used instead of the
+    broker while its socket accepts connections.
+
+    wait_timeout is the WaitTimeout, in seconds, of queries holding Wait headers.
+    Every attempt is allowed that much longer since the broker only answers once
+    the wait condition holds or the timeout expired.
+
+    The limiter, when given, admits every attempt in the host wide queue at the
+    given priority, the time spent queued is the queue phase of the metrics.
+    """
+    def __init__(self, host, port=None, max_recv=1048576, query_max_retries=5,
+                 query_duration=5, query_retry_delay=1, allow_empty_list=True,
+                 keepalive=True, pool=None, query_deadline=None, max_retry_delay=10,
+                 breaker=None, proxy=None, wait_timeout=None, limiter=None,
+                 priority='normal'):
+        self.host = host
+        self.port = port
+        self.upstream = parse_endpoint(host, port)
+        self.endpoint = parse_endpoint(proxy) if proxy else self.upstream
+        self.max_recv = int(max_recv)
+        self.query_duration = query_duration           # unit=seconds
+        self.query_retry_delay = query_retry_delay     # unit=seconds
+        self.max_retry_delay = max_retry_delay         # unit=seconds
+        self.wait_timeout = wait_timeout or 0          # unit=seconds
+        if query_deadline is None:
+            query_deadline = query_max_retries * (query_duration + self.wait_timeout +
+                                                  max_retry_delay)
+        self.query_deadline = query_deadline           # unit=seconds
+        self.query_max_retries = query_max_retries
+        self.query_attempt = 0
+        self.keepalive = keepalive
+        self.pool = pool if pool is not None else POOL
+        self.breaker = breaker
+        self.limiter = limiter
+        self.priority = priority
+        self._ticket = None
+        self.metrics = None
+        self.last_error = None
+
+    def execute(self, query):
+        """
+        execute method sends the query to the live status server and
+        returns the result.
+
+        @query - a livestatus query.
+        """
+        buffer_ = self.fetch(query)
+        if buffer_ is None:
+            return None
+        start = time.time()
+        text = buffer_.decode('utf-8')
+        self.metrics.decode = time.time() - start
+        self.metrics.finish()
+        return text
+
+    def fetch(self, query):
+        """
+        Return the undecoded reply of the query, None when it could not be completed.
+        The error livestatus answered with, if any, is kept in last_error.
+
+        @query - a livestatus query.
+        """
+        if self.keepalive:
+            return self._retry(self._execute_keepalive, query)
+        return self._retry(self._execute_oneshot, query)
+
+    def iter_json(self, query):
+        """
+        Yield the rows of a JSON livestatus reply as they are received, so the
+        whole reply never sits in memory at once.
+
+        Retries only cover connecting and receiving the reply header, an error
+        once rows have been yielded is raised to the caller.
+
+        @query - a livestatus query. The query MUST request the result
+                 is returned in JSON format.
+        """
+        return self.iter_rows(query, iter_json_rows)
+
+    def iter_rows(self, query, parser):
+        """
+        Yield the rows of a livestatus reply as they are received, parsed by
+        parser(chunks), e.g. iter_json_rows or iter_csv_rows matching the query's
+        OutputFormat.
+        """
+        opened = self._retry(self._open_stream, query, hold=True)
+        if opened is None:
+            raise LiveStatusError(0, "No reply after {} attempts.".format(self.query_attempt))
+        server, length, deadline = opened
+        metrics = self.metrics
+        completed = False
+        try:
+            if length is None:
+                self._wait_first_byte(server, deadline)
+            chunks = self._timed_chunks(iter_recv(server, length, deadline,
+                                                  chunk_size=self.max_recv))
+            rows = parser(chunks)
+            metrics.rows = 0
+            parsing = 0.0
+            while True:
+                start = time.time()
+                try:
+                    row = next(rows)
+                except StopIteration:
+                    break
+                finally:
+                    parsing += time.time() - start
+                metrics.rows += 1
+                yield row
+            # Receiving happens while the parser asks for the next chunk.
+            metrics.decode = parsing - metrics.receive
+            metrics.finish()
+            completed = True
+        finally:
+            self._release()
+            if completed and length is not None:
+                self.pool.release(self.endpoint, server)
+            else:
+                self.pool.discard(server)
+
+    def _timed_chunks(self, chunks):
+        """
+        Pass the received chunks through, adding up the receive time and size.
+        """
+        metrics = self.metrics
+        while True:
+            start = time.time()
+            try:
+                chunk = next(chunks)
+            except StopIteration:
+                return
+            finally:
+                metrics.receive += time.time() - start
+            metrics.bytes += len(chunk)
+            yield chunk
+
+    def _retry(self, operation, query, hold=False):
+        """
+        Call operation(query, deadline) until it succeeds, the attempts are exhausted
+        or the overall deadline is reached.  Returns None when the query could not be
+        completed.
+
+        Timeouts and socket errors count against the circuit breaker, invalid replies
+        (ValueError) are retried without tripping it.  With hold, the admission of the
+        successful attempt is kept until the caller calls _release().
+        """
+        deadline = time.time() + self.query_deadline
+        self.query_attempt = 0
+        self.last_error = None
+        self.metrics = QueryMetrics(self.endpoint, query)
+
+        while self.query_attempt < self.query_max_retries:
+            try:
+                if self.breaker is not None:
+                    self.breaker.check()
+                LOG.debug("Attempt number {}".format(self.query_attempt))
+                self.metrics.start_attempt()
+                self._admit(deadline)
+                try:
+                    result = operation(query, min(deadline, time.time() + self.query_duration +
+                                                  self.wait_timeout))
+                except BaseException:
+                    self._release()
+                    raise
+                if not hold:
+                    self._release()
+                self.metrics.retries = self.query_attempt
+                if self.breaker is not None:
+                    self.breaker.record_success()
+                return result
+            except (CircuitOpenError, AdmissionTimeout) as e:
+                LOG.error("Livestatus query not sent. {}".format(e))
+                break
+            except socket.timeout as e:
+                LOG.error("Timeout {}/{}".format(self.query_attempt, self.query_max_retries))
+                self._record_failure()
+            except socket.error as e:
+                LOG.error("Socket error occurred! {}".format(type(e)))
+                self._record_failure()
+            except TimeoutException as e:
+                LOG.error("Livestatus didn't respond within the time allocated.")
+                self._record_failure()
+            except LiveStatusError as e:
+                LOG.error("Livestatus rejected the query: {}".format(e))
+                self.last_error = e
+                break
+            except ValueError as e:
+                LOG.error("Invalid reply from livestatus API. {}".format(e))
+            except Exception as e:
+                LOG.error("Unhandled error occurred: {}".format(sys.exc_info()))
+                break
+            self.query_attempt += 1
+            if self.query_attempt >= self.query_max_retries:
+                break
+            delay = backoff_delay(self.query_attempt, self.query_retry_delay,
+                                  self.max_retry_delay)
+            if time.time() + delay >= deadline:
+                LOG.error("Livestatus query deadline of {}s reached.".format(self.query_deadline))
+                break
+            time.sleep(delay)
+        self.metrics.retries = self.query_attempt
+        self.metrics.finish()
+        return None
+
+    def _admit(self, deadline):
+        """
+        Wait for the limiter to admit the attempt, at most until the deadline.
+        """
+        if self.limiter is None:
+            return
+        self._ticket, waited = self.limiter.acquire(self.priority,
+                                                    max(0, deadline - time.time()))
+        self.metrics.queue += waited
+
+    def _release(self):
+        if self.limiter is not None and self._ticket is not None:
+            self.limiter.release(self._ticket)
+        self._ticket = None
+
+    def _proxy_down(self, error):
+        """
+        Switch to the broker's endpoint when the local proxy isn't running.
+        Returns True when the connection should be retried directly.
+        """
+        if self.endpoint == self.upstream or \
+                getattr(error, 'errno', None) not in (errno.ENOENT, errno.ECONNREFUSED):
+            return False
+        LOG.warning("Livestatus proxy unavailable ({}), connecting directly.".format(error))
+        self.endpoint = self.upstream
+        return True
+
+    def _record_failure(self):
+        if self.breaker is not None:
+            self.breaker.record_failure()
+
+    def _execute_oneshot(self, query, deadline):
+        """
+        Send the query on a new socket and read the reply until the server closes it.
+        """
+        server = self._open_oneshot(query)
+        try:
+            self._wait_first_byte(server, deadline)
+            start = time.time()
+            body = recv_until_eof(server, deadline, max_chunk=self.max_recv)
+            self.metrics.receive = time.time() - start
+            self.metrics.bytes = len(body)
+            return body
+        finally:
+            server.close()
+
+    def _wait_first_byte(self, server, deadline):
+        """
+        Block until the reply starts arriving, to time the broker's processing.
+        """
+        readable, _, _ = select.select([server], [], [], max(0, deadline - time.time()))
+        if not readable:
+            raise TimeoutException()
+        self.metrics.first_byte()
+
+    def _execute_keepalive(self, query, deadline):
+        """
+        Send the query on a pooled socket and read exactly the length declared by
+        the fixed16 response header.
+        """
+        server, status, length = self._open_keepalive(query, deadline)
+        try:
+            start = time.time()
+            body = recv_exact(server, length, deadline, max_chunk=self.max_recv)
+            self.metrics.receive = time.time() - start
+            self.metrics.bytes = LS_FIXED16_LEN + len(body)
+        except (socket.error, EOFError) as e:
+            self.pool.discard(server)
+            raise socket.error(str(e))
+        except Exception:
+            self.pool.discard(server)
+            raise
+        self.pool.release(self.endpoint, server)
+        if status != 200:
+            raise LiveStatusError(status, body.decode('utf-8', 'replace').strip())
+        return body
+
+    def _open_stream(self, query, deadline):
+        """
+        Send the query and return (socket, reply length, deadline) ready for streaming.
+        The reply length is None when the reply ends with the connection.
+        """
+        if not self.keepalive:
+            return self._open_oneshot(query), None, deadline
+        server, status, length = self._open_keepalive(query, deadline)
+        if status != 200:
+            try:
+                body = recv_exact(server, length, deadline, max_chunk=self.max_recv)
+            finally:
+                self.pool.discard(server)
+            raise LiveStatusError(status, body.decode('utf-8', 'replace').strip())
+        return server, length, deadline
+
+    def _open_oneshot(self, query):
+        """
+        Connect, send the query and half-close the socket.
+        """
+        start = time.time()
+        try:
+            server = connect(self.endpoint, float(self.query_duration))
+        except socket.error as e:
+            if not self._proxy_down(e):
+                raise
+            server = connect(self.endpoint, float(self.query_duration))
+        try:
+            connected = time.time()
+            self.metrics.connect = connected - start
+            LOG.debug('Sending LiveStatus query: {}'.format(query))
+            server.sendall((query.rstrip() + LS_EOL).encode('utf-8'))
+            # Notify server that transmission has finished.
+            server.shutdown(socket.SHUT_WR)
+            self.metrics.sent = time.time()
+            self.metrics.send = self.metrics.sent - connected
+        except Exception:
+            server.close()
+            raise
+        return server
+
+    def _open_keepalive(self, query, deadline):
+        """
+        Send the query on a pooled socket and return (socket, status, length) once the
+        fixed16 response header was read.  A reused socket which turns out to be broken
+        is replaced once by a fresh connection without counting as an attempt.
+        """
+        payload = keepalive_query(query).encode('utf-8')
+        while True:
+            start = time.time()
+            try:
+                server, reused = self.pool.acquire(self.endpoint, float(self.query_duration))
+            except socket.error as e:
+                if self._proxy_down(e):
+                    continue
+                raise
+            try:
+                connected = time.time()
+                self.metrics.connect = connected - start
+                self.metrics.reused = reused
+                LOG.debug('Sending LiveStatus query: {}'.format(query))
+                server.sendall(payload)
+                self.metrics.sent = time.time()
+                self.metrics.send = self.metrics.sent - connected
+                if self.wait_timeout:
+                    # The broker holds the reply until the wait condition holds.
+                    server.settimeout(self.query_duration + self.wait_timeout)
+                header = recv_exact(server, LS_FIXED16_LEN, deadline)
+                self.metrics.first_byte()
+                self.metrics.bytes = LS_FIXED16_LEN
+                status, length = parse_fixed16(header)
+            except (socket.error, EOFError) as e:
+                self.pool.discard(server)
+                if reused and not isinstance(e, socket.timeout):
+                    LOG.debug("Pooled livestatus connection was broken, reconnecting.")
+                    continue
+                if isinstance(e, EOFError):
+                    raise socket.error(str(e))
+                raise
+            except Exception:
+                self.pool.discard(server)
+                raise
+            return server, status, length
+
+    def get_json(self, query, allow_empty_list=True):
+        """
+        Parse the result of a live status query as JSON.
+
+        @query - a livestatus query. The query MUST request the result
+                 is returned in JSON format.
+        """
+        if self.keepalive:
+            execute = self._execute_keepalive
+        else:
+            execute = self._execute_oneshot
+
+        def operation(query, deadline):
+            body = execute(query, deadline)
+            start = time.time()
+            data = json.loads(body.decode('utf-8'))
+            self._decoded(start, data)
+            if allow_empty_list is not True and data == []:
+                raise ValueError("Empty list received from livestatus API.")
+            return data
+
+        return self._finish(self._retry(operation, query))
+
+    def get_rows(self, query, parser, allow_empty_list=True):
+        """
+        Parse the result of a live status query with parser(chunks), e.g.
+        iter_csv_rows for a csv query, and return the list of rows.
+        """
+        if self.keepalive:
+            execute = self._execute_keepalive
+        else:
+            execute = self._execute_oneshot
+
+        def operation(query, deadline):
+            body = execute(query, deadline)
+            start = time.time()
+            data = list(parser([body]))
+            self._decoded(start, data)
+            if allow_empty_list is not True and data == []:
+                raise ValueError("Empty list received from livestatus API.")
+            return data
+
+        return self._finish(self._retry(operation, query))
+
+    def _decoded(self, start, data):
+        self.metrics.decode = time.time() - start
+        if isinstance(data, list):
+            self.metrics.rows = len(data)
+
+    def _finish(self, result):
+        self.metrics.finish()
+        return result
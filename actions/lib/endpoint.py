@@ -0,0 +1,41 @@
+"""
+Livestatus endpoint parsing.
+
+The host setting is either a TCP host name/address used with the port setting
+or a "unix:///path/to/live" URL naming the broker's Unix domain socket.
+"""
+import socket
+
+UNIX_PREFIX = 'unix://'
+
+
+def parse_endpoint(host, port=None):
+    """
+    Return a (family, address) tuple suitable for socket.socket() and connect().
+    """
+    if host.startswith(UNIX_PREFIX):
+        path = host[len(UNIX_PREFIX):]
+        if not path:
+            raise ValueError("Unix socket endpoint {} has no path.".format(host))
+        return socket.AF_UNIX, path
+    if port is None:
+        raise ValueError("A port is required for the TCP endpoint {}.".format(host))
+    try:
+        return socket.AF_INET, (host, int(port))
+    except (TypeError, ValueError):
+        raise ValueError("Invalid port {} for the TCP endpoint {}.".format(port, host))
+
+
+def connect(endpoint, timeout):
+    """
+    Open a connected socket to the endpoint.
+    """
+    family, address = endpoint
+    server = socket.socket(family, socket.SOCK_STREAM)
+    server.settimeout(timeout)
+    try:
+        server.connect(address)
+    except Exception:
+        server.close()
+        raise
+    return server
@@ -0,0 +1,153 @@
+"""
+Local lookup index of the hosts and contacts tables.
+
+The lookup chains resolve one name per execution.  LookupIndex keeps a
+snapshot of host addresses, the services of every host with their state and
+contact email addresses in a local SQLite file, so a lookup is a primary key
+read instead of a livestatus round trip.
+
+A full snapshot is taken on the first refresh, after full_refresh seconds and
+whenever the monitoring core restarted (status.program_start changed).  In
+between, refreshes only fetch the services checked since the previous refresh,
+so host addresses and contacts are only as fresh as the last full snapshot.
+"""
+import os
+import json
+import time
+import logging
+
+from lib.private import STATE_DIRECTORY, open_database
+from lib.query import LS_EOL, build_query
+
+LOG = logging.getLogger(__name__)
+
+INDEX_PATH = os.path.join(STATE_DIRECTORY, 'index.sqlite')
+INDEX_FULL_REFRESH = 3600
+
+HOST_COLUMNS = ['name', 'address']
+SERVICE_COLUMNS = ['host_name', 'description', 'state', 'has_been_checked', 'last_check']
+CONTACT_COLUMNS = ['name', 'email']
+
+
+def _json_query(table, columns, filters=None):
+    return build_query(table, columns, filters) + 'OutputFormat: json' + LS_EOL
+
+
+class LookupIndex(object):
+    """
+    LookupIndex answers host and contact lookups from a SQLite snapshot.
+    """
+    def __init__(self, path=INDEX_PATH, full_refresh=INDEX_FULL_REFRESH):
+        self.path = path
+        self.full_refresh = float(full_refresh)              # unit=seconds
+        self._db = open_database(path, timeout=5)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        with self._db:
+            self._db.execute("CREATE TABLE IF NOT EXISTS hosts ("
+                             "name TEXT PRIMARY KEY, address TEXT)")
+            self._db.execute("CREATE TABLE IF NOT EXISTS services ("
+                             "host_name TEXT, description TEXT, state INTEGER, "
+                             "has_been_checked INTEGER, "
+                             "PRIMARY KEY (host_name, description))")
+            self._db.execute("CREATE TABLE IF NOT EXISTS contacts ("
+                             "name TEXT PRIMARY KEY, email TEXT)")
+            self._db.execute("CREATE TABLE IF NOT EXISTS state ("
+                             "name TEXT PRIMARY KEY, value TEXT)")
+
+    def staleness(self, full=False):
+        """
+        Return the seconds since the last refresh, None when the index is empty.
+
+        full - measure from the last full snapshot, the age of the hosts and contacts
+               which incremental refreshes don't update.
+        """
+        refreshed = self._state('full_refreshed' if full else 'refreshed')
+        if refreshed is None:
+            return None
+        return max(0.0, time.time() - float(refreshed))
+
+    def host_address(self, name):
+        row = self._db.execute("SELECT address FROM hosts WHERE name = ?", (name,)).fetchone()
+        return row[0] if row is not None else None
+
+    def host_services(self, name):
+        """
+        Return the host's services as [description, state, has_been_checked] lists,
+        the services_with_state column of the hosts table, or None for an unknown host.
+        """
+        if self.host_address(name) is None:
+            return None
+        rows = self._db.execute("SELECT description, state, has_been_checked FROM services "
+                                "WHERE host_name = ? ORDER BY description", (name,))
+        return [list(row) for row in rows]
+
+    def contact_email(self, name):
+        row = self._db.execute("SELECT email FROM contacts WHERE name = ?", (name,)).fetchone()
+        return row[0] if row is not None else None
+
+    def refresh(self, live_status):
+        """
+        Bring the index up to date.  Returns "full", "incremental" or None when
+        livestatus didn't answer, in which case the index is left untouched.
+        """
+        now = time.time()
+        program_start = self._program_start(live_status)
+        full_at = self._state('full_refreshed')
+        if (full_at is None or now - float(full_at) >= self.full_refresh or
+                program_start != self._state('program_start')):
+            if not self._refresh_full(live_status, now):
+                return None
+            self._set_state(program_start=program_start, full_refreshed=now, refreshed=now)
+            return "full"
+
+        high_water = int(self._state('high_water') or 0)
+        rows = live_status.get_json(_json_query('services', SERVICE_COLUMNS,
+                                                ['last_check >= {}'.format(high_water)]))
+        if rows is None:
+            return None
+        with self._db:
+            self._db.executemany("INSERT OR REPLACE INTO services VALUES (?, ?, ?, ?)",
+                                 [row[:4] for row in rows])
+        self._set_state(high_water=max([high_water] + [row[4] for row in rows]), refreshed=now)
+        LOG.debug("Lookup index updated {} services.".format(len(rows)))
+        return "incremental"
+
+    def close(self):
+        self._db.close()
+
+    def _refresh_full(self, live_status, now):
+        hosts = live_status.get_json(_json_query('hosts', HOST_COLUMNS))
+        services = live_status.get_json(_json_query('services', SERVICE_COLUMNS))
+        contacts = live_status.get_json(_json_query('contacts', CONTACT_COLUMNS))
+        if hosts is None or services is None or contacts is None:
+            return False
+        with self._db:
+            self._db.execute("DELETE FROM hosts")
+            self._db.execute("DELETE FROM services")
+            self._db.execute("DELETE FROM contacts")
+            self._db.executemany("INSERT OR REPLACE INTO hosts VALUES (?, ?)", hosts)
+            self._db.executemany("INSERT OR REPLACE INTO services VALUES (?, ?, ?, ?)",
+                                 [row[:4] for row in services])
+            self._db.executemany("INSERT OR REPLACE INTO contacts VALUES (?, ?)", contacts)
+        self._set_state(high_water=max([0] + [row[4] for row in services]))
+        LOG.debug("Lookup index snapshot of {} hosts, {} services and {} contacts.".format(
+            len(hosts), len(services), len(contacts)))
+        return True
+
+    def _program_start(self, live_status):
+        """
+        Return the monitoring core's start time, a restart may change every object.
+        """
+        rows = live_status.get_json(_json_query('status', ['program_start']))
+        if not rows:
+            return None
+        return str(rows[0][0])
+
+    def _state(self, name):
+        row = self._db.execute("SELECT value FROM state WHERE name = ?", (name,)).fetchone()
+        return json.loads(row[0]) if row is not None else None
+
+    def _set_state(self, **values):
+        with self._db:
+            self._db.executemany("INSERT OR REPLACE INTO state VALUES (?, ?)",
+                                 [(name, json.dumps(value)) for name, value in values.items()])
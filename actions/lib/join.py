@@ -0,0 +1,169 @@
+"""
+Client side hash join of livestatus tables.
+
+Livestatus can't join tables.  A join is described by a list of Get-style
+sub-queries, the first one is the probe side and every other one is joined to
+it, for example critical services with their host address and contact emails:
+
+    [{"table": "services", "columns": ["host_name", "description", "contacts"],
+      "filters": ["state = 2"]},
+     {"name": "host", "table": "hosts", "columns": ["address"], "on": ["host_name", "name"]},
+     {"name": "contact", "table": "contacts", "columns": ["email"], "on": ["contacts", "name"]}]
+
+"on" pairs a probe column with a build column.  Every build sub-query is run
+once and hashed on its build column, then the probe rows are streamed and
+matched against the hashes, so only the build tables are held in memory; the
+largest table should be the probe side.
+
+A probe row is returned as a dict of its columns plus one entry per join: the
+first matching build row as a dict, or None, or the list of matching rows when
+the probe column holds a list (e.g. contacts) or the join sets "many".  A build
+column holding a list (e.g. members of a group) indexes the row under every
+member, so hosts can be joined to the hostgroups listing them.
+
+When the rows carry the site column of a multi-site query, rows only match rows
+of the same site.
+"""
+from lib.reducers import Reducer
+from lib.sites import SITE_COLUMN
+
+JOIN_TYPES = ('left', 'inner')
+SUB_QUERY_KEYS = set(['name', 'table', 'columns', 'filters', 'limit', 'on', 'many'])
+
+
+def _with_column(columns, column):
+    if column in columns:
+        return list(columns)
+    return list(columns) + [column]
+
+
+class SubQuery(object):
+    """
+    One sub-query of a join, columns include the join key.
+    """
+    def __init__(self, spec, probe=False):
+        if not isinstance(spec, dict):
+            raise ValueError("A join sub-query must be an object, got {}.".format(spec))
+        unknown = set(spec.keys()) - SUB_QUERY_KEYS
+        if unknown:
+            raise ValueError("Unknown sub-query keys: {}".format(", ".join(sorted(unknown))))
+        if not spec.get('table'):
+            raise ValueError("Every join sub-query needs a table.")
+        self.table = spec['table']
+        self.name = spec.get('name', self.table)
+        self.columns = list(spec.get('columns') or [])
+        self.filters = spec.get('filters')
+        self.limit = spec.get('limit')
+        self.many = bool(spec.get('many', False))
+        self.probe_key = self.build_key = None
+        if probe:
+            if 'on' in spec:
+                raise ValueError("The first sub-query is the probe side, it can't have 'on'.")
+            return
+        on = spec.get('on')
+        if not isinstance(on, (list, tuple)) or len(on) != 2:
+            raise ValueError("Sub-query '{}' needs 'on': [probe column, build column].".format(
+                self.name))
+        self.probe_key, self.build_key = on
+        self.columns = _with_column(self.columns, self.build_key)
+
+
+class JoinSpec(object):
+    """
+    JoinSpec validates the sub-queries of a join and adds the join keys to the
+    columns each sub-query fetches.
+    """
+    def __init__(self, queries, how='left'):
+        if how not in JOIN_TYPES:
+            raise ValueError("Unknown join type '{}', expected one of: {}".format(
+                how, ", ".join(JOIN_TYPES)))
+        if not isinstance(queries, list) or len(queries) < 2:
+            raise ValueError("A join needs a probe sub-query and at least one build sub-query.")
+        self.how = how
+        self.probe = SubQuery(queries[0], probe=True)
+        self.builds = [SubQuery(spec) for spec in queries[1:]]
+        names = [self.probe.name] + [build.name for build in self.builds]
+        if len(set(names)) != len(names):
+            raise ValueError("Sub-query names must be unique, got {}.".format(names))
+        if not self.probe.columns:
+            raise ValueError("The probe sub-query needs columns.")
+        for build in self.builds:
+            if build.name in self.probe.columns or build.name == SITE_COLUMN:
+                raise ValueError("Sub-query name '{}' is also a probe column, "
+                                 "give it another name.".format(build.name))
+        for build in self.builds:
+            self.probe.columns = _with_column(self.probe.columns, build.probe_key)
+
+
+def _hashable(value):
+    # Livestatus list members may be lists themselves, e.g. services_with_state.
+    return tuple(value) if isinstance(value, list) else value
+
+
+def build_index(rows, columns, key):
+    """
+    Hash build rows on the key column.  Returns {key value: [row dicts]}, keys are
+    (site, key value) when the columns include the site.  A row whose key column
+    holds a list is indexed under each of its members.
+    """
+    key_index = columns.index(key)
+    site_index = columns.index(SITE_COLUMN) if SITE_COLUMN in columns else None
+    index = {}
+    for row in rows:
+        values = row[key_index]
+        if not isinstance(values, list):
+            values = [values]
+        entry = dict(zip(columns, row))
+        for value in set(_hashable(value) for value in values):
+            if site_index is not None:
+                value = (row[site_index], value)
+            index.setdefault(value, []).append(entry)
+    return index
+
+
+class HashJoinReducer(Reducer):
+    """
+    Probe streamed rows against the build indexes and keep the joined rows.
+
+    joins - (name, probe column, index, many) tuples.
+    """
+    def __init__(self, columns=None, joins=None, how='left'):
+        super(HashJoinReducer, self).__init__(columns)
+        self.joins = [(name, self._column_index(key), index, many)
+                      for name, key, index, many in joins or []]
+        self.inner = how == 'inner'
+        self.site_index = self.columns.index(SITE_COLUMN) if SITE_COLUMN in self.columns else None
+        self.rows = []
+
+    def _key(self, row, value):
+        value = _hashable(value)
+        if self.site_index is None:
+            return value
+        return (row[self.site_index], value)
+
+    def _add(self, row):
+        joined = dict(zip(self.columns, row))
+        for name, key_index, index, many in self.joins:
+            key = row[key_index]
+            if isinstance(key, list):
+                match = []
+                for value in key:
+                    match.extend(found for found in index.get(self._key(row, value), [])
+                                 if not any(found is seen for seen in match))
+            elif many:
+                match = index.get(self._key(row, key), [])
+            else:
+                match = index.get(self._key(row, key), [None])[0]
+            if self.inner and not match:
+                return
+            joined[name] = match
+        self.rows.append(joined)
+
+    def _reset(self):
+        self.rows = []
+
+    def _merge(self, other):
+        self.rows.extend(other.rows)
+
+    def result(self):
+        return self.rows
@@ -0,0 +1,236 @@
+"""
+Host wide admission control of livestatus queries.
+
+During an outage many rules fire at once and their executions would all query
+the broker together, exhausting its worker threads.  Limiter admits at most
+max_concurrency queries per endpoint at a time, and with a rate at most rate
+queries per second with bursts of burst queries (token bucket), across every
+process of the host.  The tickets and buckets live in the shared state file.
+
+Waiting queries are admitted by priority, then in arrival order: commands go
+ahead of interactive reads, which go ahead of bulk reads.  Tickets of dead
+processes, and slots held longer than the lease since admission, are dropped so
+a crash can't leak a slot.  Queued queries poll the queue with reads and only
+take the write lock when they may be admitted or a ticket has to be dropped.
+"""
+import os
+import time
+import errno
+import logging
+import sqlite3
+
+from lib.private import open_database
+from lib.retry import STATE_PATH, endpoint_key
+
+LOG = logging.getLogger(__name__)
+
+ADMISSION_MAX_CONCURRENCY = 8
+ADMISSION_RATE = 0
+ADMISSION_BURST = 10
+ADMISSION_LEASE = 600
+PRIORITIES = {'high': 0, 'normal': 1, 'low': 2}
+# Polling interval bounds while queued, in seconds.
+POLL_MIN = 0.005
+POLL_MAX = 0.05
+
+
+class AdmissionTimeout(Exception):
+    def __init__(self, endpoint, waited):
+        self.endpoint = endpoint
+        self.waited = waited
+
+    def __str__(self):
+        return "Not admitted to {} after {:.3f}s in the queue.".format(self.endpoint, self.waited)
+
+
+def priority_level(priority):
+    """
+    Return the queue level of a priority name, raises ValueError for unknown names.
+    """
+    if priority not in PRIORITIES:
+        raise ValueError("Unknown priority '{}', expected one of: {}".format(
+            priority, ", ".join(sorted(PRIORITIES, key=PRIORITIES.get))))
+    return PRIORITIES[priority]
+
+
+def _alive(pid):
+    try:
+        os.kill(pid, 0)
+    except OSError as e:
+        return e.errno == errno.EPERM
+    return True
+
+
+def build_limiter(config, endpoint):
+    """
+    Create the endpoint's Limiter when admission control is enabled, otherwise None.
+    """
+    if not config.get('admission_enabled', False):
+        return None
+    return Limiter(endpoint,
+                   config.get('state_path', STATE_PATH),
+                   config.get('admission_max_concurrency', ADMISSION_MAX_CONCURRENCY),
+                   config.get('admission_rate', ADMISSION_RATE),
+                   config.get('admission_burst', ADMISSION_BURST))
+
+
+class Limiter(object):
+    """
+    Limiter queues queries to one endpoint behind a cross-process semaphore and an
+    optional token bucket.
+
+    rate - queries per second, 0 disables the token bucket.
+    burst - the number of queries allowed at once after an idle period.
+    """
+    def __init__(self, endpoint, path=STATE_PATH, max_concurrency=ADMISSION_MAX_CONCURRENCY,
+                 rate=ADMISSION_RATE, burst=ADMISSION_BURST, lease=ADMISSION_LEASE):
+        self.key = endpoint_key(endpoint)
+        self.path = path
+        self.max_concurrency = int(max_concurrency)
+        self.rate = float(rate)                             # unit=queries/second
+        self.burst = max(1.0, float(burst))
+        self.lease = float(lease)                           # unit=seconds
+        self._db = None
+        try:
+            # Transactions are opened explicitly with BEGIN IMMEDIATE.
+            self._db = open_database(path, timeout=5, isolation_level=None)
+            self._db.execute("CREATE TABLE IF NOT EXISTS admission_tickets ("
+                             "id INTEGER PRIMARY KEY AUTOINCREMENT, endpoint TEXT, "
+                             "priority INTEGER, pid INTEGER, running INTEGER, enqueued REAL, "
+                             "admitted REAL)")
+            columns = [row[1] for row in self._db.execute("PRAGMA table_info(admission_tickets)")]
+            if 'admitted' not in columns:
+                self._db.execute("ALTER TABLE admission_tickets ADD COLUMN admitted REAL")
+            self._db.execute("CREATE TABLE IF NOT EXISTS admission_buckets ("
+                             "endpoint TEXT PRIMARY KEY, tokens REAL, updated REAL)")
+        except sqlite3.Error as e:
+            LOG.warning("Admission state unavailable, queries aren't limited. {}".format(e))
+            self._db = None
+
+    def acquire(self, priority='normal', timeout=None):
+        """
+        Wait for a slot and return (ticket, seconds waited).  Raises AdmissionTimeout
+        when no slot was granted within timeout seconds.
+        """
+        level = priority_level(priority)
+        start = time.time()
+        if self._db is None:
+            return None, 0.0
+        try:
+            ticket = self._db.execute(
+                "INSERT INTO admission_tickets (endpoint, priority, pid, running, enqueued) "
+                "VALUES (?, ?, ?, 0, ?)", (self.key, level, os.getpid(), start)).lastrowid
+        except sqlite3.Error as e:
+            LOG.warning("Admission state unavailable, query not limited. {}".format(e))
+            return None, 0.0
+
+        poll = POLL_MIN
+        try:
+            while True:
+                retry_in = self._try_admit(ticket)
+                waited = time.time() - start
+                if retry_in is None:
+                    return ticket, waited
+                if timeout is not None and waited + poll > timeout:
+                    raise AdmissionTimeout(self.key, waited)
+                time.sleep(min(max(poll, retry_in), POLL_MAX))
+                poll = min(poll * 2, POLL_MAX)
+        except sqlite3.Error as e:
+            LOG.warning("Admission state unavailable, query not limited. {}".format(e))
+            self.release(ticket)
+            return None, time.time() - start
+        except BaseException:
+            self.release(ticket)
+            raise
+
+    def release(self, ticket):
+        if ticket is None or self._db is None:
+            return
+        try:
+            self._db.execute("DELETE FROM admission_tickets WHERE id = ?", (ticket,))
+        except sqlite3.Error as e:
+            LOG.warning("Unable to release admission ticket {}. {}".format(ticket, e))
+
+    def close(self):
+        if self._db is not None:
+            self._db.close()
+
+    def _try_admit(self, ticket):
+        """
+        Admit the ticket when it heads the queue and a slot and a token are free.
+        Returns None once admitted, otherwise the seconds to wait before trying again.
+        """
+        now = time.time()
+        if not self._may_admit(ticket, now):
+            return POLL_MIN
+        self._db.execute("BEGIN IMMEDIATE")
+        try:
+            retry_in = self._admit(ticket, now)
+        except Exception:
+            self._db.execute("ROLLBACK")
+            raise
+        self._db.execute("COMMIT")
+        return retry_in
+
+    def _admit(self, ticket, now):
+        self._expire(now)
+        running = self._db.execute(
+            "SELECT COUNT(*) FROM admission_tickets WHERE endpoint = ? AND running = 1",
+            (self.key,)).fetchone()[0]
+        head = self._db.execute(
+            "SELECT id FROM admission_tickets WHERE endpoint = ? AND running = 0 "
+            "ORDER BY priority, id LIMIT 1", (self.key,)).fetchone()
+        if running >= self.max_concurrency or head is None or head[0] != ticket:
+            return POLL_MIN
+        if self.rate > 0:
+            row = self._db.execute("SELECT tokens, updated FROM admission_buckets "
+                                   "WHERE endpoint = ?", (self.key,)).fetchone()
+            tokens = self.burst if row is None else \
+                min(self.burst, row[0] + (now - row[1]) * self.rate)
+            if tokens < 1:
+                return (1 - tokens) / self.rate
+            self._db.execute("INSERT OR REPLACE INTO admission_buckets VALUES (?, ?, ?)",
+                             (self.key, tokens - 1, now))
+        self._db.execute("UPDATE admission_tickets SET running = 1, admitted = ? WHERE id = ?",
+                         (now, ticket))
+        return None
+
+    def _may_admit(self, ticket, now):
+        """
+        Read only check whether the ticket heads the queue with a free slot, or a
+        stale ticket has to be dropped.  Either needs the write lock of _admit.
+        """
+        rows = self._db.execute("SELECT id, pid, running, admitted, priority "
+                                "FROM admission_tickets WHERE endpoint = ?",
+                                (self.key,)).fetchall()
+        if self._stale(rows, now):
+            return True
+        running = len([row for row in rows if row[2]])
+        queued = [(row[4], row[0]) for row in rows if not row[2]]
+        return running < self.max_concurrency and bool(queued) and min(queued)[1] == ticket
+
+    def _stale(self, rows, now):
+        """
+        Return the ids of the tickets of dead processes and of the slots held longer
+        than the lease.
+        """
+        alive = {}
+        stale = []
+        for row in rows:
+            ticket, pid, running, admitted = row[:4]
+            if pid not in alive:
+                alive[pid] = _alive(pid)
+            if not alive[pid] or (running and now - admitted > self.lease):
+                stale.append(ticket)
+        return stale
+
+    def _expire(self, now):
+        """
+        Drop the tickets of dead processes and the slots held longer than the lease.
+        """
+        rows = self._db.execute("SELECT id, pid, running, admitted FROM admission_tickets "
+                                "WHERE endpoint = ?", (self.key,)).fetchall()
+        stale = [(ticket,) for ticket in self._stale(rows, now)]
+        if stale:
+            LOG.warning("Dropping {} stale admission tickets of {}.".format(len(stale), self.key))
+            self._db.executemany("DELETE FROM admission_tickets WHERE id = ?", stale)
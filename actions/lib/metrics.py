@@ -0,0 +1,159 @@
+"""
+Per-query timing and size metrics of the livestatus client.
+
+LiveStatus records a QueryMetrics for every query: the time spent queued for
+admission, connecting, sending, waiting for the first byte of the reply,
+receiving and decoding it, plus the bytes received, the retries used and the
+rows parsed.  The metrics are emitted to a sink chosen by the metrics_sink pack
+setting and queries slower than slow_query_threshold are logged with their
+full text.
+"""
+import time
+import socket
+import logging
+
+LOG = logging.getLogger(__name__)
+
+STATSD_PORT = 8125
+STATSD_PREFIX = 'st2.livestatus'
+SLOW_QUERY_THRESHOLD = 10
+PHASES = ('queue', 'connect', 'send', 'ttfb', 'receive', 'decode', 'total')
+
+
+class QueryMetrics(object):
+    """
+    QueryMetrics holds the timings, in seconds, and sizes of one query.  The phase
+    timings describe the successful attempt, queue and total cover every attempt.
+    """
+    def __init__(self, endpoint=None, query=None):
+        self.endpoint = endpoint
+        self.query = query
+        self.started = time.time()
+        self.sent = None
+        self.queue = 0.0
+        self.connect = 0.0
+        self.send = 0.0
+        self.ttfb = 0.0
+        self.receive = 0.0
+        self.decode = 0.0
+        self.total = None
+        self.bytes = 0
+        self.rows = None
+        self.retries = 0
+        self.reused = False
+
+    def start_attempt(self):
+        """
+        Forget the phases of a failed attempt.
+        """
+        self.sent = None
+        self.connect = self.send = self.ttfb = self.receive = self.decode = 0.0
+        self.bytes = 0
+        self.reused = False
+
+    def first_byte(self):
+        if self.sent is not None:
+            self.ttfb = time.time() - self.sent
+
+    def finish(self):
+        self.total = time.time() - self.started
+
+    def as_dict(self):
+        result = {}
+        for phase in PHASES:
+            value = getattr(self, phase)
+            result[phase + '_ms'] = round(value * 1000, 3) if value is not None else None
+        result.update({
+            'bytes': self.bytes,
+            'rows': self.rows,
+            'retries': self.retries,
+            'reused_connection': self.reused,
+        })
+        return result
+
+
+class LogSink(object):
+    """
+    Write the metrics of every query as a single log line.
+    """
+    def __init__(self, logger=None):
+        self.logger = logger or LOG
+
+    def emit(self, metrics, tags=None):
+        fields = metrics.as_dict()
+        fields.update(tags or {})
+        self.logger.info("livestatus query metrics {}".format(
+            " ".join("{}={}".format(key, fields[key]) for key in sorted(fields))))
+
+
+class StatsdSink(object):
+    """
+    Send the metrics as statsd timers and counters in a single UDP datagram.
+    Errors are ignored, metrics must never fail a query.
+    """
+    def __init__(self, host='127.0.0.1', port=STATSD_PORT, prefix=STATSD_PREFIX):
+        self.address = (host, int(port))
+        self.prefix = prefix
+
+    def emit(self, metrics, tags=None):
+        prefix = self.prefix
+        if tags and tags.get('site'):
+            prefix += '.' + tags['site']
+        lines = []
+        for phase in PHASES:
+            value = getattr(metrics, phase)
+            if value is not None:
+                lines.append("{}.{}:{:.3f}|ms".format(prefix, phase, value * 1000))
+        lines.append("{}.bytes:{}|c".format(prefix, metrics.bytes))
+        lines.append("{}.retries:{}|c".format(prefix, metrics.retries))
+        if metrics.rows is not None:
+            lines.append("{}.rows:{}|c".format(prefix, metrics.rows))
+        try:
+            sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+            try:
+                sock.sendto('\n'.join(lines).encode('utf-8'), self.address)
+            finally:
+                sock.close()
+        except socket.error as e:
+            LOG.debug("Unable to send metrics to statsd. {}".format(e))
+
+
+SINKS = {
+    'log': LogSink,
+    'statsd': StatsdSink,
+}
+
+
+def build_sink(config):
+    """
+    Create the sink named by the metrics_sink setting, None when metrics are disabled.
+    """
+    name = config.get('metrics_sink')
+    if not name or name == 'none':
+        return None
+    if name == 'statsd':
+        return StatsdSink(config.get('statsd_host', '127.0.0.1'),
+                          config.get('statsd_port', STATSD_PORT),
+                          config.get('statsd_prefix', STATSD_PREFIX))
+    if name not in SINKS:
+        LOG.warning("Unknown metrics_sink '{}', metrics are disabled.".format(name))
+        return None
+    return SINKS[name]()
+
+
+def report_query(metrics, sink=None, slow_query_threshold=SLOW_QUERY_THRESHOLD, tags=None):
+    """
+    Emit the metrics of a query and log it when it took longer than the threshold.
+    """
+    if metrics is None:
+        return
+    if metrics.total is None:
+        metrics.finish()
+    if slow_query_threshold and metrics.total > float(slow_query_threshold):
+        LOG.warning("Slow livestatus query took {:.3f}s {}: {}".format(
+            metrics.total, metrics.as_dict(), metrics.query))
+    if sink is not None:
+        try:
+            sink.emit(metrics, tags)
+        except Exception as e:
+            LOG.warning("Unable to emit livestatus query metrics. {}".format(e))
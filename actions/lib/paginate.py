@@ -0,0 +1,239 @@
+"""
+Keyset pagination of large livestatus tables.
+
+Livestatus only has a Limit header, without an offset.  Paginator walks a table
+in pages of page_size rows by adding a keyset filter to the query: the rows
+after the last key of the previous page, e.g. for services
+
+    Filter: host_name > web-450
+    Filter: host_name = web-450
+    Filter: description > Disk
+    And: 2
+    Or: 2
+
+Limit keeps the first rows in the broker's order.  Livestatus returns objects in
+name order but not every implementation does (Shinken doesn't guarantee it), so
+a full page is checked to hold every row up to its last key, with a query of the
+key columns counting them.  A broker which didn't return the first keys is an
+error rather than silently skipped rows.  The log table is walked in time
+windows instead, halved while a window holds more than page_size entries and
+doubled while windows are empty.
+
+The position is kept in an opaque cursor token, so a walk can be resumed by a
+later execution, e.g. after a failure part-way through an export.
+"""
+import json
+import time
+import base64
+import hashlib
+
+from lib.query import LS_EOL, build_query
+from lib.receive import LiveStatusError
+
+PAGE_SIZE = 1000
+LOG_WINDOW = 3600
+LOG_SINCE = 86400
+
+# table: key columns, livestatus returns the rows ordered by them.
+KEYS = {
+    'hosts': ['name'],
+    'services': ['host_name', 'description'],
+    'contacts': ['name'],
+    'hostgroups': ['name'],
+    'servicegroups': ['name'],
+    'contactgroups': ['name'],
+    'commands': ['name'],
+    'timeperiods': ['name'],
+    'downtimes': ['id'],
+    'comments': ['id'],
+}
+
+
+def encode_cursor(state):
+    return base64.urlsafe_b64encode(json.dumps(state, sort_keys=True).encode('utf-8')) \
+        .decode('ascii')
+
+
+def decode_cursor(token):
+    """
+    Return the state of a cursor token, raises ValueError for an invalid token.
+    """
+    try:
+        state = json.loads(base64.urlsafe_b64decode(token.encode('ascii')).decode('utf-8'))
+    except (TypeError, ValueError, UnicodeError) as e:
+        raise ValueError("Invalid cursor: {}".format(e))
+    if not isinstance(state, dict):
+        raise ValueError("Invalid cursor.")
+    return state
+
+
+def keyset_filters(key, last):
+    """
+    Return the filters list selecting the rows whose key columns come after last.
+    """
+    filters = []
+    for position, column in enumerate(key):
+        for previous, value in zip(key[:position], last[:position]):
+            filters.append('{} = {}'.format(previous, value))
+        filters.append('{} > {}'.format(column, last[position]))
+        if position:
+            filters.append('&{}'.format(position + 1))
+    if len(key) > 1:
+        filters.append('|{}'.format(len(key)))
+    return filters
+
+
+class Paginator(object):
+    """
+    Paginator yields the pages of a query, over a single pooled connection when the
+    LiveStatus client uses keepalive.
+
+    key - the ordered key columns, defaults to KEYS for the table.
+    since, until, window - the time range and initial window, in seconds, of a log walk.
+    cursor - a token returned by an earlier walk of the same query.
+    site - the name of the site read, a cursor only resumes a walk of the same site.
+    """
+    def __init__(self, live_status, table, columns, filters=None, page_size=PAGE_SIZE,
+                 key=None, cursor=None, since=None, until=None, window=LOG_WINDOW, site=None):
+        if not columns:
+            raise ValueError("Pagination requires columns.")
+        self.live_status = live_status
+        self.table = table
+        self.columns = list(columns)
+        self.filters = list(filters or [])
+        self.page_size = int(page_size)
+        if self.page_size < 1:
+            raise ValueError("page_size must be positive, got {}.".format(page_size))
+        self.by_time = table == 'log' and key is None
+        if self.by_time:
+            self.key = ['time']
+        else:
+            self.key = list(key or KEYS.get(table, []))
+            if not self.key:
+                raise ValueError("No pagination key known for table '{}', give one.".format(
+                    table))
+        self.query_columns = self.columns + [column for column in self.key
+                                             if column not in self.columns]
+        self.fingerprint = hashlib.sha1(json.dumps(
+            [site, table, self.columns, self.filters, self.key]).encode('utf-8')).hexdigest()
+
+        now = int(time.time())
+        self.state = {'query': self.fingerprint, 'done': False}
+        if self.by_time:
+            self.state['until'] = int(until if until is not None else now)
+            self.state['start'] = int(since if since is not None
+                                      else self.state['until'] - LOG_SINCE)
+            self.state['window'] = int(window)
+            self.max_window = int(window)
+        else:
+            self.state['last'] = None
+        if cursor:
+            self._resume(decode_cursor(cursor))
+        self.pages_read = 0
+        self.rows_read = 0
+
+    @property
+    def cursor(self):
+        """
+        The token resuming the walk after the last page read, None once it completed.
+        """
+        if self.state['done']:
+            return None
+        return encode_cursor(self.state)
+
+    def pages(self, max_pages=None):
+        """
+        Yield non-empty lists of rows, with the requested columns, until the table is
+        exhausted or max_pages pages were read.  Empty log windows count toward
+        max_pages, so a sparse log can't turn one call into thousands of queries.
+        Raises LiveStatusError when livestatus doesn't answer, the cursor still
+        points after the last page yielded.
+        """
+        read = 0
+        while not self.state['done'] and (max_pages is None or read < max_pages):
+            if self.by_time:
+                page = self._log_page()
+            else:
+                page = self._key_page()
+            read += 1
+            if not page:
+                # Empty log windows and the end of the table aren't pages.
+                continue
+            self.pages_read += 1
+            self.rows_read += len(page)
+            yield page
+
+    def _resume(self, state):
+        if state.get('query') != self.fingerprint:
+            raise ValueError("The cursor belongs to another query.")
+        self.state.update(state)
+
+    def _fetch(self, filters, limit, columns=None):
+        query = build_query(self.table, columns or self.query_columns, self.filters + filters,
+                            None, limit)
+        rows = self.live_status.get_json(query + 'OutputFormat: json' + LS_EOL)
+        if rows is None:
+            error = self.live_status.last_error
+            if error is not None:
+                raise error
+            raise LiveStatusError(0, "No reply from livestatus.")
+        return rows
+
+    def _strip(self, rows):
+        width = len(self.columns)
+        if width == len(self.query_columns):
+            return rows
+        return [row[:width] for row in rows]
+
+    def _key_page(self):
+        last = self.state['last']
+        filters = keyset_filters(self.key, last) if last is not None else []
+        rows = self._fetch(filters, self.page_size)
+        indexes = [self.query_columns.index(column) for column in self.key]
+        rows.sort(key=lambda row: [row[index] for index in indexes])
+        keys = [[row[index] for index in indexes] for row in rows]
+        for previous, key in zip(keys, keys[1:]):
+            if key == previous:
+                raise ValueError("The {} key {} isn't unique, pagination needs unique "
+                                 "keys.".format(self.table, self.key))
+        if len(rows) == self.page_size:
+            # A full page must hold every row up to its last key, or rows would be skipped.
+            between = self._fetch(filters + keyset_filters(self.key, keys[-1]) + ['!'], None,
+                                  self.key)
+            if len(between) != len(rows):
+                raise ValueError("Livestatus didn't return the {} rows in {} order, {} rows "
+                                 "up to the page end but {} in the page.".format(
+                                     self.table, self.key, len(between), len(rows)))
+        if rows:
+            self.state['last'] = keys[-1]
+        if len(rows) < self.page_size:
+            self.state['done'] = True
+        return self._strip(rows)
+
+    def _log_page(self):
+        """
+        Read the entries of the next time window, halving it while it holds more than
+        page_size entries.  A single second is read whole.
+        """
+        start = self.state['start']
+        window = self.state['window']
+        while True:
+            end = min(start + window, self.state['until'] + 1)
+            filters = ['time >= {}'.format(start), 'time < {}'.format(end)]
+            limit = self.page_size + 1 if end - start > 1 else None
+            rows = self._fetch(filters, limit)
+            if limit is None or len(rows) <= self.page_size:
+                break
+            window = max(1, (end - start) // 2)
+        self.state['start'] = end
+        if not rows:
+            # Skip quiet periods geometrically, a dense window is halved again.
+            self.state['window'] = window * 2
+        elif len(rows) < self.page_size // 2:
+            # Grow back after a dense window.
+            self.state['window'] = min(self.max_window, window * 2)
+        else:
+            self.state['window'] = window
+        if end > self.state['until']:
+            self.state['done'] = True
+        return self._strip(rows)
@@ -0,0 +1,46 @@
+"""
+Private local state files.
+
+The result cache, the circuit breaker and admission state and the lookup index
+are SQLite files shared by every execution on the host.  Under a fixed name in a
+world-writable directory another user could create the file first, or replace
+it with a link, and read or poison the state.  They are kept in a directory only
+their owner can enter, created with mode 0700, and a directory or file owned by
+another user is refused.
+"""
+import os
+import stat
+import sqlite3
+
+STATE_DIRECTORY = "/tmp/st2_livestatus"
+
+
+def private_directory(path):
+    """
+    Create the directory of path readable by its owner only, and refuse a directory
+    which another user owns or can write to.  Raises OSError.
+    """
+    directory = os.path.dirname(os.path.abspath(path))
+    if not os.path.isdir(directory):
+        os.makedirs(directory, 0o700)
+    info = os.lstat(directory)
+    if not stat.S_ISDIR(info.st_mode) or info.st_uid != os.getuid() or \
+            info.st_mode & (stat.S_IWGRP | stat.S_IWOTH):
+        raise OSError("Directory {} must be owned by the StackStorm user and not writable "
+                      "by others.".format(directory))
+
+
+def open_database(path, **options):
+    """
+    Open the SQLite file at path in a private directory, refusing a file another
+    user owns or a link.  Raises sqlite3.Error, like sqlite3.connect().
+    """
+    try:
+        private_directory(path)
+        if os.path.lexists(path):
+            info = os.lstat(path)
+            if stat.S_ISLNK(info.st_mode) or info.st_uid != os.getuid():
+                raise OSError("State file {} must be owned by the StackStorm user.".format(path))
+    except OSError as e:
+        raise sqlite3.OperationalError(str(e))
+    return sqlite3.connect(path, **options)
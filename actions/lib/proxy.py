@@ -0,0 +1,283 @@
+"""
+Local livestatus proxy daemon.
+
+Every python-script execution runs in a new interpreter, so connection pools
+and in-memory caches die with it.  The proxy is a long lived process which
+speaks the livestatus protocol on a local Unix socket and forwards queries to
+the broker over pooled KeepAlive connections.  It answers repeated queries
+from a TTL cache and coalesces identical queries which are in flight, so that
+one broker round trip serves all of them.  Replies to queries with Wait headers
+aren't cached, they are only valid for the moment the wait ended.
+
+Clients use the proxy by connecting to its socket instead of the broker, the
+pack's LiveStatus clients fall back to the broker when the socket is absent.
+The socket is created with mode 0660 in a directory only its owner can enter,
+since anything connecting to it reaches the broker.  Commands are refused
+unless allow_commands is set, they are then passed through to the broker, one
+upstream connection per client connection.
+
+Run it with the LivestatusProxySensor or as a service from the actions
+directory:
+
+    python -m lib.proxy --host nagios.example.com --port 6557 \\
+        --socket /tmp/st2_livestatus_proxy/live.sock
+"""
+import os
+import time
+import socket
+import logging
+import argparse
+import threading
+import collections
+import socketserver
+
+from lib.cache import CACHE_TTL, normalize_query
+from lib.client import LiveStatus
+from lib.endpoint import connect, parse_endpoint
+from lib.private import private_directory
+from lib.query import LS_EOL
+from lib.receive import LiveStatusError
+
+LOG = logging.getLogger(__name__)
+
+PROXY_SOCKET = "/tmp/st2_livestatus_proxy/live.sock"
+PROXY_CACHE_MAX_ENTRIES = 1000
+# Status returned when the broker couldn't be reached, livestatus itself uses 4xx.
+STATUS_UPSTREAM_ERROR = 502
+# Request headers handled by the proxy itself rather than forwarded.
+CONNECTION_HEADERS = ('KeepAlive:', 'ResponseHeader:')
+
+
+def wait_timeout(query):
+    """
+    Return the WaitTimeout of a query in seconds, None when it doesn't wait.
+    """
+    for line in query.split(LS_EOL):
+        if line.startswith('WaitTimeout:'):
+            return int(line[len('WaitTimeout:'):]) / 1000.0
+    return None
+
+
+def proxy_url(config):
+    """
+    Return the unix:// URL of the local proxy when the pack is configured to use it.
+    """
+    if not config.get('proxy_enabled', False):
+        return None
+    return 'unix://' + config.get('proxy_socket', PROXY_SOCKET)
+
+
+def command_proxy_url(config):
+    """
+    Return the unix:// URL of the local proxy for external commands, None unless
+    the proxy is configured to forward them.
+    """
+    if not config.get('proxy_commands', False):
+        return None
+    return proxy_url(config)
+
+
+class _InFlight(object):
+    """
+    A query being answered by the broker, other requests for it wait on done.
+    """
+    def __init__(self):
+        self.done = threading.Event()
+        self.status = None
+        self.body = None
+
+
+class LivestatusProxy(object):
+    """
+    LivestatusProxy answers livestatus queries received on a Unix socket.
+
+    upstream - (host, port) of the broker, host may be a unix:// URL.
+    ttl - seconds a reply is cached per table, the "default" key applies to other tables.
+    client_options - LiveStatus options used for the upstream queries.
+    allow_commands - forward external commands to the broker, they are refused otherwise.
+    """
+    def __init__(self, upstream, path=PROXY_SOCKET, ttl=None,
+                 max_entries=PROXY_CACHE_MAX_ENTRIES, client_options=None, allow_commands=False):
+        self.upstream = upstream
+        self.upstream_endpoint = parse_endpoint(*upstream)
+        self.path = path
+        self.ttl = dict(CACHE_TTL)
+        self.ttl.update(ttl or {})
+        self.max_entries = int(max_entries)
+        self.client_options = dict(client_options or {})
+        self.client_options['keepalive'] = True
+        self.allow_commands = allow_commands
+        self.counters = collections.Counter()
+        self._cache = collections.OrderedDict()
+        self._inflight = {}
+        self._lock = threading.Lock()
+        self._server = None
+
+    def serve_forever(self):
+        private_directory(self.path)
+        if os.path.exists(self.path):
+            os.unlink(self.path)
+        # The socket is created with the umask applied, restrict it before binding.
+        umask = os.umask(0o117)
+        try:
+            self._server = ProxyServer(self.path, ProxyHandler, self)
+        finally:
+            os.umask(umask)
+        LOG.info("Livestatus proxy listening on {} for {}.".format(self.path, self.upstream))
+        try:
+            self._server.serve_forever()
+        finally:
+            self._server.server_close()
+            if os.path.exists(self.path):
+                os.unlink(self.path)
+
+    def shutdown(self):
+        if self._server is not None:
+            self._server.shutdown()
+
+    def query(self, query):
+        """
+        Return (status, body bytes) of the query from the cache, an identical query
+        in flight or the broker.
+        """
+        key = normalize_query(query)
+        now = time.time()
+        with self._lock:
+            cached = self._cache.get(key)
+            if cached is not None and cached[0] > now:
+                self._cache.move_to_end(key)
+                self.counters['hits'] += 1
+                return 200, cached[1]
+            call = self._inflight.get(key)
+            leader = call is None
+            if leader:
+                call = self._inflight[key] = _InFlight()
+                self.counters['misses'] += 1
+            else:
+                self.counters['coalesced'] += 1
+
+        if not leader:
+            call.done.wait()
+            return call.status, call.body
+
+        try:
+            try:
+                call.status, call.body = self._query_upstream(query)
+            except Exception as e:
+                # Every waiter gets the failure, not an empty reply.
+                LOG.error("Livestatus query failed upstream. {}".format(e))
+                call.status = STATUS_UPSTREAM_ERROR
+                call.body = "Livestatus query failed upstream: {}".format(e).encode('utf-8')
+            if call.status == 200:
+                self._store(key, query, call.body)
+        finally:
+            with self._lock:
+                del self._inflight[key]
+            call.done.set()
+        return call.status, call.body
+
+    def _query_upstream(self, query):
+        live_status = LiveStatus(self.upstream[0], self.upstream[1],
+                                 wait_timeout=wait_timeout(query), **self.client_options)
+        body = live_status.fetch(query)
+        if body is not None:
+            return 200, bytes(body)
+        error = live_status.last_error
+        if error is None:
+            error = LiveStatusError(STATUS_UPSTREAM_ERROR, "Livestatus broker unavailable.")
+        return error.status, error.msg.encode('utf-8')
+
+    def _store(self, key, query, body):
+        table = query.split(LS_EOL, 1)[0][4:].strip()
+        ttl = float(self.ttl.get(table, self.ttl.get("default", 0)))
+        if ttl <= 0 or wait_timeout(query) is not None:
+            return
+        with self._lock:
+            self._cache[key] = (time.time() + ttl, body)
+            self._cache.move_to_end(key)
+            while len(self._cache) > self.max_entries:
+                self._cache.popitem(last=False)
+
+
+class ProxyServer(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+    daemon_threads = True
+
+    def __init__(self, path, handler, proxy):
+        self.proxy = proxy
+        socketserver.UnixStreamServer.__init__(self, path, handler)
+
+
+class ProxyHandler(socketserver.StreamRequestHandler):
+    """
+    Answer the requests of one client connection, keeping it open while the
+    client asks for KeepAlive.
+    """
+    def handle(self):
+        self.upstream = None
+        try:
+            while self._handle_request():
+                pass
+        finally:
+            if self.upstream is not None:
+                self.upstream.close()
+
+    def _handle_request(self):
+        lines = []
+        while True:
+            line = self.rfile.readline().decode('utf-8')
+            if not line or not line.strip():
+                break
+            lines.append(line.rstrip('\r\n'))
+        if not lines:
+            return False
+
+        if lines[0].startswith('COMMAND '):
+            return self._forward_command(lines)
+
+        keepalive = 'KeepAlive: on' in lines
+        fixed16 = 'ResponseHeader: fixed16' in lines
+        query = LS_EOL.join(line for line in lines
+                            if not line.startswith(CONNECTION_HEADERS)) + LS_EOL
+        status, body = self.server.proxy.query(query)
+        if fixed16:
+            self.wfile.write('{:3d} {:11d}\n'.format(status, len(body)).encode('utf-8'))
+        self.wfile.write(body)
+        self.wfile.flush()
+        return keepalive
+
+    def _forward_command(self, lines):
+        """
+        Pass a command through to the broker.  Livestatus doesn't answer commands and
+        keeps the connection open after them.  Without allow_commands the connection
+        is closed instead.
+        """
+        if not self.server.proxy.allow_commands:
+            LOG.warning("Refused a command, the proxy doesn't forward commands: {}".format(
+                lines[0][:80]))
+            return False
+        try:
+            if self.upstream is None:
+                self.upstream = connect(self.server.proxy.upstream_endpoint, 30)
+            self.upstream.sendall((LS_EOL.join(lines) + LS_EOL + LS_EOL).encode('utf-8'))
+        except socket.error as e:
+            LOG.error("Unable to forward command to livestatus. {}".format(e))
+            return False
+        return True
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Local livestatus proxy daemon.")
+    parser.add_argument('--host', required=True, help="Broker host or unix:///path/to/live.")
+    parser.add_argument('--port', type=int, default=None)
+    parser.add_argument('--socket', default=PROXY_SOCKET, help="Unix socket to listen on.")
+    parser.add_argument('--max-entries', type=int, default=PROXY_CACHE_MAX_ENTRIES)
+    parser.add_argument('--allow-commands', action='store_true',
+                        help="Forward external commands to the broker.")
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO)
+    LivestatusProxy((args.host, args.port), args.socket, max_entries=args.max_entries,
+                    allow_commands=args.allow_commands).serve_forever()
+
+
+if __name__ == '__main__':
+    main()
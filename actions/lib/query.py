@@ -0,0 +1,265 @@
+"""
+Livestatus query building shared by the blocking and asyncio clients.
+"""
+import logging
+
+LOG = logging.getLogger(__name__)
+LS_EOL = '\n'
+WAIT_TIMEOUT = 60
+WAIT_TRIGGERS = ('check', 'state', 'log', 'downtime', 'comment', 'command', 'program', 'all')
+WAIT_KEYS = set(['object', 'condition', 'trigger', 'timeout'])
+
+
+class BaseItem(object):
+    def __init__(self,
+                 _item,
+                 prefix_base=None,
+                 prefix_add=None,
+                 prefix_or=None,
+                 prefix_not=None,
+                 postfix=None):
+        self.prefix = None
+        self.postfix = postfix
+
+        if _item.startswith('&'):
+            self.prefix = prefix_add
+            self._item = int(_item.split("&")[1])
+        elif _item.startswith('|'):
+            self.prefix = prefix_or
+            self._item = int(_item.split("|")[1])
+        elif _item == '!':
+            self.prefix = prefix_not
+            self._item = ""
+        else:
+            self.prefix = prefix_base
+            self._item = _item
+
+    def __str__(self):
+        return "{}{}{}".format(self.prefix, self._item, self.postfix)
+
+
+class StatsItem(BaseItem):
+    """
+    The StatsItem class is used to convert logic operators to livestatus format as well as
+    return a correctly formatted string for livestatus queries.
+
+    The idea is to allow stackstorm to supply stats listed in the following form:
+
+    ["state = 0", "host_up = 0", "&2"]
+
+    The above list would produce a LiveStatus query like the following:
+    Stats: state = 0
+    Stats: host_up = 0
+    StatsAnd: 2
+    """
+    def __init__(self,
+                 _item,
+                 prefix_base="Stats: ",
+                 prefix_add="StatsAnd: ",
+                 prefix_or="StatsOr: ",
+                 prefix_not="StatsNegate:",
+                 postfix=LS_EOL):
+        super(StatsItem, self).__init__(_item,
+                                        prefix_base,
+                                        prefix_add,
+                                        prefix_or,
+                                        prefix_not,
+                                        postfix)
+
+
+class FilterItem(BaseItem):
+    """
+    The FilterItem class is used to convert logic operators to livestatus format as well as
+    return a correctly formatted string for livestatus queries.
+
+    The idea is to allow stackstorm to supply stats listed in the following manner:
+
+    ["state = 0", "host_up = 0", "&2"]
+
+    The above list would produce a LiveStatus query like the following:
+    Filter: state = 0
+    Filter: host_up = 0
+    And: 2
+    """
+    def __init__(self,
+                 _item,
+                 prefix_base="Filter: ",
+                 prefix_add="And: ",
+                 prefix_or="Or: ",
+                 prefix_not="Negate:",
+                 postfix=LS_EOL):
+        super(FilterItem, self).__init__(_item,
+                                         prefix_base,
+                                         prefix_add,
+                                         prefix_or,
+                                         prefix_not,
+                                         postfix)
+
+
+class WaitConditionItem(BaseItem):
+    """
+    The WaitConditionItem class converts a wait condition list, written like the filters
+    list, to the WaitCondition headers:
+
+    ["state = 0", "has_been_checked = 1", "&2"]
+
+    WaitCondition: state = 0
+    WaitCondition: has_been_checked = 1
+    WaitConditionAnd: 2
+    """
+    def __init__(self,
+                 _item,
+                 prefix_base="WaitCondition: ",
+                 prefix_add="WaitConditionAnd: ",
+                 prefix_or="WaitConditionOr: ",
+                 prefix_not="WaitConditionNegate:",
+                 postfix=LS_EOL):
+        super(WaitConditionItem, self).__init__(_item,
+                                                prefix_base,
+                                                prefix_add,
+                                                prefix_or,
+                                                prefix_not,
+                                                postfix)
+
+
+def build_query(table, columns=None, filters=None, stats=None, limit=None, wait=None):
+    """
+    Assemble a GET query, without an OutputFormat header, from Get style parameters.
+    """
+    query = 'GET {}{}'.format(table, LS_EOL)
+
+    if columns is not None:
+        query += process_columns(columns)
+
+    if filters is not None:
+        query += process_filters(filters)
+
+    if stats is not None:
+        query += process_stats(stats)
+
+    if limit is not None:
+        query += 'Limit: {}{}'.format(limit, LS_EOL)
+
+    if wait is not None:
+        query += process_wait(wait)
+
+    return query
+
+
+def wait_timeout(wait):
+    """
+    Return the timeout of a wait in seconds.
+    """
+    return float(wait.get('timeout', WAIT_TIMEOUT))
+
+
+def process_wait(wait):
+    """
+    Convert a wait dict to the Wait headers which make livestatus hold the reply
+    until the condition holds or the timeout expires:
+
+    {"object": "web-450", "condition": ["state = 0"], "trigger": "state", "timeout": 60}
+
+    object - the host name, "host_name service_description" or group name waited on.
+    condition - filters list the object must match.
+    trigger - the event waking up the condition check, check, state, log, downtime,
+              comment, command, program or all.
+    timeout - seconds before livestatus answers anyway, defaults to WAIT_TIMEOUT.
+
+    Raises ValueError for an invalid wait.
+    """
+    if not isinstance(wait, dict):
+        raise ValueError("A wait must be an object, got {}.".format(wait))
+    unknown = set(wait.keys()) - WAIT_KEYS
+    if unknown:
+        raise ValueError("Unknown wait keys: {}".format(", ".join(sorted(unknown))))
+    if not wait.get('condition') and not wait.get('trigger'):
+        raise ValueError("A wait needs a condition or a trigger.")
+    trigger = wait.get('trigger', 'all')
+    if trigger not in WAIT_TRIGGERS:
+        raise ValueError("Unknown wait trigger '{}', expected one of: {}".format(
+            trigger, ", ".join(WAIT_TRIGGERS)))
+    timeout = wait_timeout(wait)
+    if timeout <= 0:
+        raise ValueError("The wait timeout must be positive, got {}.".format(timeout))
+
+    headers = ''
+    if wait.get('object'):
+        headers += 'WaitObject: {}{}'.format(wait['object'], LS_EOL)
+    condition = wait.get('condition') or []
+    if not isinstance(condition, list):
+        condition = [condition]
+    headers += build_list(items=[WaitConditionItem(_item) for _item in condition])
+    headers += 'WaitTrigger: {}{}'.format(trigger, LS_EOL)
+    headers += 'WaitTimeout: {}{}'.format(int(timeout * 1000), LS_EOL)
+    return headers
+
+
+def output_format_headers(output_format, separators=None):
+    """
+    Return the OutputFormat header, and for csv the Separators header, of a query.
+    """
+    headers = 'OutputFormat: {}{}'.format(output_format, LS_EOL)
+    if output_format == 'csv' and separators is not None:
+        headers += 'Separators: {}{}'.format(' '.join(str(ord(sep)) for sep in separators),
+                                             LS_EOL)
+    return headers
+
+
+def keepalive_query(query):
+    """
+    Terminate a query with the KeepAlive and fixed16 ResponseHeader headers.
+    """
+    return (query.rstrip() + LS_EOL +
+            'KeepAlive: on' + LS_EOL +
+            'ResponseHeader: fixed16' + LS_EOL + LS_EOL)
+
+
+def process_columns(columns):
+    """
+    Convert columns list to livestatus formatted string.
+    """
+    return build_list('Columns: ', LS_EOL, [' '.join(columns)])
+
+
+def process_filters(filters):
+    """
+    Convert filters list to livestatus formatted string.
+    """
+    formatted_filters = []
+    try:
+        for _item in filters:
+            formatted_filters.append(FilterItem(_item))
+    except (ValueError) as e:
+        LOG.error("Incorrectly formatted logic operator in query. {}".format(filters))
+    return build_list(items=formatted_filters)
+
+
+def process_stats(stats):
+    """
+    Convert stats list to livestatus formatted string.
+    """
+    formatted_stats = []
+    try:
+        for _item in stats:
+            formatted_stats.append(StatsItem(_item))
+    except (ValueError) as e:
+        LOG.error("Incorrectly formatted logic operator in query. {}".format(stats))
+    return build_list(items=formatted_stats)
+
+
+def build_list(prefix=None, postfix=None, items=[]):
+    """
+    Loop over list items and apply a prefix/postfix to each element.
+    Returns a livestatus formatted string.
+    """
+    tmp = ''
+    for _item in items:
+        if isinstance(_item, BaseItem):
+            tmp += "%s" % _item
+        else:
+            tmp += '{}{}{}'.format(prefix, _item, postfix)
+    else:
+        postfix = ''
+    tmp += postfix
+    return tmp
@@ -0,0 +1,120 @@
+"""
+Receive engine shared by the LiveStatus clients.
+
+Replies are read with recv_into into a single preallocated bytearray.  When the
+reply length is known (fixed16 response header) the buffer is sized exactly,
+otherwise it grows geometrically until the server closes the connection.  The
+caller decodes the returned buffer once.
+"""
+import time
+
+LS_FIXED16_LEN = 16
+RECV_INITIAL_SIZE = 65536
+RECV_MAX_CHUNK = 1048576
+
+
+class TimeoutException(Exception):
+    def __init__(self, msg="Execution timeout has been exceeded."):
+        self.msg = msg
+
+    def __str__(self):
+        return repr(self.msg)
+
+
+class LiveStatusError(Exception):
+    def __init__(self, status, msg="Livestatus returned an error."):
+        self.status = status
+        self.msg = msg
+
+    def __str__(self):
+        return "{} {}".format(self.status, repr(self.msg))
+
+
+def parse_fixed16(header):
+    """
+    Split a fixed16 header, e.g. "200          42", into status and length.
+    """
+    try:
+        return int(header[0:3]), int(header[4:15])
+    except ValueError:
+        raise LiveStatusError(0, "Malformed fixed16 header {}".format(repr(header)))
+
+
+def _check_deadline(deadline):
+    if deadline is not None and time.time() > deadline:
+        raise TimeoutException()
+
+
+def recv_exact(server, size, deadline=None, max_chunk=RECV_MAX_CHUNK):
+    """
+    Read exactly size bytes from the socket into a preallocated bytearray.
+
+    @server - a connected socket.
+    @size - the number of bytes to read.
+    @deadline - absolute time.time() after which TimeoutException is raised.
+    """
+    buffer_ = bytearray(size)
+    view = memoryview(buffer_)
+    received = 0
+    try:
+        while received < size:
+            count = server.recv_into(view[received:], min(size - received, max_chunk))
+            if count == 0:
+                raise EOFError("Livestatus closed the connection mid-reply.")
+            received += count
+            _check_deadline(deadline)
+    finally:
+        view.release()
+    return buffer_
+
+
+def recv_until_eof(server, deadline=None, initial_size=RECV_INITIAL_SIZE,
+                   max_chunk=RECV_MAX_CHUNK):
+    """
+    Read from the socket until the server closes the connection.
+
+    The buffer doubles whenever it is full, so the total copying stays linear in
+    the size of the reply.
+    """
+    buffer_ = bytearray(initial_size)
+    received = 0
+    while True:
+        if received == len(buffer_):
+            buffer_.extend(bytes(len(buffer_)))
+        view = memoryview(buffer_)
+        try:
+            count = server.recv_into(view[received:], min(len(buffer_) - received, max_chunk))
+        finally:
+            view.release()
+        if count == 0:
+            break
+        received += count
+        _check_deadline(deadline)
+    del buffer_[received:]
+    return buffer_
+
+
+def iter_recv(server, size=None, deadline=None, chunk_size=RECV_INITIAL_SIZE):
+    """
+    Yield the reply as bytes chunks of at most chunk_size.
+
+    Reads exactly size bytes when the reply length is known, otherwise reads
+    until the server closes the connection.
+    """
+    buffer_ = bytearray(chunk_size)
+    view = memoryview(buffer_)
+    remaining = size
+    try:
+        while remaining is None or remaining > 0:
+            wanted = chunk_size if remaining is None else min(chunk_size, remaining)
+            count = server.recv_into(view, wanted)
+            if count == 0:
+                if remaining is None:
+                    return
+                raise EOFError("Livestatus closed the connection mid-reply.")
+            if remaining is not None:
+                remaining -= count
+            _check_deadline(deadline)
+            yield bytes(view[:count])
+    finally:
+        view.release()
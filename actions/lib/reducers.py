@@ -0,0 +1,289 @@
+"""
+Incremental reducers applied to livestatus rows while they are streamed.
+
+A reducer is described by a dict, for example:
+
+    {"type": "count"}
+    {"type": "group_by", "column": "state"}
+    {"type": "top", "column": "last_check", "n": 10}
+    {"type": "columnar"}
+
+Columns are referenced by name (looked up in the query's columns list) or by
+position in the row.
+"""
+import sys
+import copy
+import array
+import heapq
+import itertools
+
+
+class Reducer(object):
+    """
+    Base reducer, collects every row.
+    """
+    def __init__(self, columns=None):
+        self.columns = columns or []
+        self.count = 0
+
+    def add(self, row):
+        self.count += 1
+        self._add(row)
+
+    def _add(self, row):
+        raise NotImplementedError
+
+    def fork(self):
+        """
+        Return an empty reducer with the same settings, e.g. one per site whose rows
+        are merged only once the site replied completely.
+        """
+        clone = copy.copy(self)
+        clone.count = 0
+        clone._reset()
+        return clone
+
+    def merge(self, other):
+        """
+        Add the rows reduced by other, a fork of this reducer.
+        """
+        self.count += other.count
+        self._merge(other)
+
+    def _reset(self):
+        raise NotImplementedError
+
+    def _merge(self, other):
+        raise NotImplementedError
+
+    def result(self):
+        raise NotImplementedError
+
+    def _column_index(self, column):
+        if isinstance(column, int):
+            return column
+        try:
+            return self.columns.index(column)
+        except ValueError:
+            raise ValueError("Reducer column '{}' isn't one of the query columns {}.".format(
+                column, self.columns))
+
+
+class ListReducer(Reducer):
+    """
+    Keep every row, the result is the same list of rows get_json returns.
+    """
+    def __init__(self, columns=None):
+        super(ListReducer, self).__init__(columns)
+        self.rows = []
+
+    def _add(self, row):
+        self.rows.append(row)
+
+    def _reset(self):
+        self.rows = []
+
+    def _merge(self, other):
+        self.rows.extend(other.rows)
+
+    def result(self):
+        return self.rows
+
+
+class CountReducer(Reducer):
+    """
+    Count the rows.
+    """
+    def _add(self, row):
+        pass
+
+    def _reset(self):
+        pass
+
+    def _merge(self, other):
+        pass
+
+    def result(self):
+        return {"count": self.count}
+
+
+class GroupByReducer(Reducer):
+    """
+    Count the rows per distinct value of a column.
+    """
+    def __init__(self, columns=None, column=None):
+        super(GroupByReducer, self).__init__(columns)
+        self.index = self._column_index(column)
+        self.groups = {}
+
+    def _add(self, row):
+        key = row[self.index]
+        if isinstance(key, list):
+            key = tuple(key)
+        self.groups[key] = self.groups.get(key, 0) + 1
+
+    def _reset(self):
+        self.groups = {}
+
+    def _merge(self, other):
+        for key, count in other.groups.items():
+            self.groups[key] = self.groups.get(key, 0) + count
+
+    def result(self):
+        # Result keys must be strings to be stored in the execution result.
+        return {"count": self.count,
+                "groups": dict((str(key), value) for key, value in self.groups.items())}
+
+
+class _Reversed(object):
+    """
+    Invert the ordering of a value, so the min-heap of TopReducer keeps the
+    smallest values of any comparable type, strings included.
+    """
+    __slots__ = ('value',)
+
+    def __init__(self, value):
+        self.value = value
+
+    def __lt__(self, other):
+        return other.value < self.value
+
+    def __gt__(self, other):
+        return other.value > self.value
+
+    def __eq__(self, other):
+        return self.value == other.value
+
+
+TOP_ORDERS = ('asc', 'desc')
+
+
+class TopReducer(Reducer):
+    """
+    Keep the n rows with the largest (desc) or smallest (asc) value in a column.
+    """
+    def __init__(self, columns=None, column=None, n=10, order="desc"):
+        super(TopReducer, self).__init__(columns)
+        if order not in TOP_ORDERS:
+            raise ValueError("Unknown top order '{}', expected one of: {}.".format(
+                order, ", ".join(TOP_ORDERS)))
+        self.index = self._column_index(column)
+        self.n = int(n)
+        self.ascending = order == "asc"
+        self.heap = []
+        self.sequence = itertools.count()
+
+    def _add(self, row):
+        value = row[self.index]
+        if self.ascending:
+            value = _Reversed(value)
+        self._push((value, next(self.sequence), row))
+
+    def _push(self, item):
+        if len(self.heap) < self.n:
+            heapq.heappush(self.heap, item)
+        elif item > self.heap[0]:
+            heapq.heapreplace(self.heap, item)
+
+    def _reset(self):
+        # Forks share the sequence, so items of different forks never tie.
+        self.heap = []
+
+    def _merge(self, other):
+        for item in other.heap:
+            self._push(item)
+
+    def result(self):
+        return {"count": self.count,
+                "rows": [row for _, _, row in sorted(self.heap, reverse=True)]}
+
+
+def _new_column(value):
+    # bool is an int subclass, keep it in a list so it stays a JSON boolean.
+    if isinstance(value, int) and not isinstance(value, bool):
+        return array.array('q')
+    if isinstance(value, float):
+        return array.array('d')
+    return []
+
+
+def _widen_column(column, value):
+    """
+    Return a copy of the typed column able to hold value, a list when no typed
+    array can.
+    """
+    if column.typecode == 'q' and isinstance(value, float):
+        return array.array('d', column)
+    return list(column)
+
+
+class ColumnarReducer(Reducer):
+    """
+    Collect the rows column by column.  Integer and float columns are kept in
+    typed arrays and strings are interned, so a large result is held in one
+    array per column rather than one list per row.
+    """
+    def __init__(self, columns=None):
+        if not columns:
+            raise ValueError("The columnar format requires the columns to be listed.")
+        super(ColumnarReducer, self).__init__(columns)
+        self.data = [None] * len(self.columns)
+
+    def _add(self, row):
+        data = self.data
+        for index, value in enumerate(row):
+            column = data[index]
+            if column is None:
+                column = data[index] = _new_column(value)
+            if isinstance(column, list):
+                if isinstance(value, str):
+                    value = sys.intern(value)
+                column.append(value)
+                continue
+            try:
+                column.append(value)
+            except (TypeError, OverflowError):
+                column = data[index] = _widen_column(column, value)
+                column.append(value)
+
+    def _reset(self):
+        self.data = [None] * len(self.columns)
+
+    def _merge(self, other):
+        for position in range(other.count):
+            self._add([column[position] for column in other.data])
+
+    def result(self):
+        data = {}
+        for name, column in zip(self.columns, self.data):
+            if column is None:
+                column = []
+            elif isinstance(column, array.array):
+                column = column.tolist()
+            data[name] = column
+        return {"count": self.count, "columns": self.columns, "data": data}
+
+
+REDUCERS = {
+    "list": ListReducer,
+    "count": CountReducer,
+    "group_by": GroupByReducer,
+    "top": TopReducer,
+    "columnar": ColumnarReducer,
+}
+
+
+def build_reducer(spec, columns=None):
+    """
+    Create a reducer from its dict description, a Reducer instance is used as is.
+    """
+    if spec is None:
+        return ListReducer(columns)
+    if isinstance(spec, Reducer):
+        return spec
+    spec = dict(spec)
+    name = spec.pop("type", None)
+    if name not in REDUCERS:
+        raise ValueError("Unknown reducer type '{}', expected one of {}.".format(
+            name, sorted(REDUCERS.keys())))
+    return REDUCERS[name](columns, **spec)
@@ -0,0 +1,125 @@
+"""
+Retry policy and circuit breaker for livestatus queries.
+
+Each query gets one overall deadline and retries with exponential backoff and
+full jitter.  A per-endpoint circuit breaker opens after consecutive failures
+and makes queries fail fast until reset_timeout has passed.  The breaker state
+lives in a local SQLite file so that it is shared by every action execution
+on the host.
+"""
+import os
+import time
+import random
+import logging
+import sqlite3
+
+from lib.private import STATE_DIRECTORY, open_database
+
+LOG = logging.getLogger(__name__)
+
+STATE_PATH = os.path.join(STATE_DIRECTORY, 'state.sqlite')
+CIRCUIT_FAILURE_THRESHOLD = 5
+CIRCUIT_RESET_TIMEOUT = 30
+
+
+class CircuitOpenError(Exception):
+    def __init__(self, endpoint, retry_at):
+        self.endpoint = endpoint
+        self.retry_at = retry_at
+
+    def __str__(self):
+        return "Circuit open for {}, retrying in {:.0f}s.".format(
+            self.endpoint, max(0, self.retry_at - time.time()))
+
+
+def backoff_delay(attempt, base_delay, max_delay):
+    """
+    Exponential backoff with full jitter for the given 1-based attempt number.
+    """
+    return random.uniform(0, min(max_delay, base_delay * (2 ** (attempt - 1))))
+
+
+def endpoint_key(endpoint):
+    family, address = endpoint
+    if isinstance(address, tuple):
+        return "{}:{}".format(*address)
+    return "unix://{}".format(address)
+
+
+class CircuitBreaker(object):
+    """
+    CircuitBreaker tracks consecutive failures of one endpoint.
+
+    closed    - queries are allowed, failures are counted.
+    open      - failure_threshold was reached, queries fail fast until reset_timeout.
+    half-open - once reset_timeout passed a single trial query is let through,
+                its outcome closes or re-opens the circuit.
+    """
+    def __init__(self, endpoint, path=STATE_PATH, failure_threshold=CIRCUIT_FAILURE_THRESHOLD,
+                 reset_timeout=CIRCUIT_RESET_TIMEOUT):
+        self.key = endpoint_key(endpoint)
+        self.path = path
+        self.failure_threshold = int(failure_threshold)
+        self.reset_timeout = float(reset_timeout)          # unit=seconds
+        self._db = None
+        try:
+            self._db = open_database(path, timeout=5)
+            with self._db:
+                self._db.execute("CREATE TABLE IF NOT EXISTS breakers ("
+                                 "endpoint TEXT PRIMARY KEY, failures INTEGER, "
+                                 "opened_until REAL)")
+        except sqlite3.Error as e:
+            LOG.warning("Circuit breaker state unavailable, breaker disabled. {}".format(e))
+            self._db = None
+
+    def check(self):
+        """
+        Raise CircuitOpenError while the circuit is open.  After reset_timeout the
+        open period is extended by one reset_timeout, so concurrent executions don't
+        all send trial queries at once.
+        """
+        if self._db is None:
+            return
+        now = time.time()
+        try:
+            with self._db:
+                row = self._db.execute("SELECT failures, opened_until FROM breakers "
+                                       "WHERE endpoint = ?", (self.key,)).fetchone()
+                if row is None or row[0] < self.failure_threshold:
+                    return
+                if row[1] > now:
+                    raise CircuitOpenError(self.key, row[1])
+                # Half-open: the caller whose update lands runs the trial query, the
+                # condition fails for the others once opened_until was extended.
+                claimed = self._db.execute("UPDATE breakers SET opened_until = ? "
+                                           "WHERE endpoint = ? AND opened_until <= ?",
+                                           (now + self.reset_timeout, self.key, now)).rowcount
+                if not claimed:
+                    raise CircuitOpenError(self.key, now + self.reset_timeout)
+        except sqlite3.Error as e:
+            LOG.warning("Circuit breaker check failed. {}".format(e))
+
+    def record_success(self):
+        self._update("INSERT OR REPLACE INTO breakers VALUES (?, 0, 0)", (self.key,))
+
+    def record_failure(self):
+        now = time.time()
+        self._update("INSERT OR IGNORE INTO breakers VALUES (?, 0, 0)", (self.key,))
+        self._update("UPDATE breakers SET failures = failures + 1, "
+                     "opened_until = CASE WHEN failures + 1 >= ? THEN ? ELSE opened_until END "
+                     "WHERE endpoint = ?", (self.failure_threshold, now + self.reset_timeout,
+                                            self.key))
+
+    def close(self):
+        if self._db is not None:
+            self._db.close()
+            self._db = None
+
+    def _update(self, statement, args):
+        if self._db is None:
+            return
+        try:
+            with self._db:
+                self._db.execute(statement, args)
+        except sqlite3.Error as e:
+            LOG.warning("Circuit breaker update failed. {}".format(e))
@@ -0,0 +1,154 @@
+"""
+Schema introspection of livestatus tables.
+
+The "columns" table describes every table and column the broker knows.  The
+schema is fetched with one query per endpoint and kept in the host wide state
+file for schema_ttl seconds, so Get can check the columns, filter and stats
+operands of a query locally: a typo fails without a broker round trip.
+
+Queries without columns return every column of the table, including large
+lists such as services_with_info.  Default projections name the columns sent
+instead, per table, from the default_columns setting or DEFAULT_COLUMNS when
+default_projection is enabled.
+"""
+import json
+import time
+import logging
+import difflib
+
+from lib.private import open_database
+from lib.query import LS_EOL, build_query
+from lib.retry import STATE_PATH, endpoint_key
+from lib.sites import SITE_COLUMN
+
+LOG = logging.getLogger(__name__)
+
+SCHEMA_TTL = 3600
+# A cached schema older than this is fetched again before rejecting a query, the
+# broker may have been upgraded with new columns.
+SCHEMA_RECHECK = 60
+# Tables answered whatever the schema, "columns" doesn't always describe itself.
+SCHEMA_TABLES = ('columns',)
+
+DEFAULT_COLUMNS = {
+    'hosts': ['name', 'address', 'state', 'state_type', 'has_been_checked', 'acknowledged',
+              'scheduled_downtime_depth', 'last_check', 'plugin_output'],
+    'services': ['host_name', 'description', 'state', 'state_type', 'has_been_checked',
+                 'acknowledged', 'scheduled_downtime_depth', 'last_check', 'plugin_output'],
+    'contacts': ['name', 'alias', 'email', 'pager'],
+    'hostgroups': ['name', 'alias', 'num_hosts', 'worst_host_state'],
+    'servicegroups': ['name', 'alias', 'num_services', 'worst_service_state'],
+    'downtimes': ['id', 'host_name', 'service_description', 'author', 'comment',
+                  'start_time', 'end_time', 'fixed'],
+    'comments': ['id', 'host_name', 'service_description', 'author', 'comment',
+                 'entry_time'],
+    'log': ['time', 'type', 'host_name', 'service_description', 'state', 'plugin_output'],
+}
+
+
+def default_columns(config, table):
+    """
+    Return the default projection of the table, None to request every column.
+    """
+    configured = config.get('default_columns') or {}
+    if table in configured:
+        return list(configured[table])
+    if config.get('default_projection', False) and table in DEFAULT_COLUMNS:
+        return list(DEFAULT_COLUMNS[table])
+    return None
+
+
+def _operand(item, stats=False):
+    """
+    Return the column of a filter or stats item, None for the &N, |N and ! operators.
+    """
+    item = item.strip()
+    if not item or item[0] in '&|!':
+        return None
+    words = item.split(None, 1)
+    if stats and len(words) == 2 and words[0] in ('sum', 'min', 'max', 'avg', 'std',
+                                                  'suminv', 'avginv'):
+        return words[1].strip()
+    return words[0]
+
+
+def referenced_columns(columns=None, filters=None, stats=None, wait=None):
+    """
+    Return the column names a query refers to.
+    """
+    names = list(columns or [])
+    names.extend(_operand(item) for item in filters or [])
+    names.extend(_operand(item, stats=True) for item in stats or [])
+    if wait:
+        condition = wait.get('condition') or []
+        if not isinstance(condition, list):
+            condition = [condition]
+        names.extend(_operand(item) for item in condition)
+    return [name for name in names if name is not None and name != SITE_COLUMN]
+
+
+def validate(schema, table, names):
+    """
+    Raise ValueError when the table or one of the column names isn't in the schema.
+    """
+    if table in SCHEMA_TABLES:
+        return
+    if table not in schema:
+        raise ValueError("Unknown table '{}'{}".format(
+            table, _suggest(table, schema.keys())))
+    known = schema[table]
+    for name in names:
+        if name not in known:
+            raise ValueError("Table {} has no column '{}'{}".format(
+                table, name, _suggest(name, known.keys())))
+
+
+def _suggest(name, candidates):
+    matches = difflib.get_close_matches(name, list(candidates), n=3)
+    if not matches:
+        return "."
+    return ", did you mean: {}?".format(", ".join(matches))
+
+
+class SchemaCache(object):
+    """
+    SchemaCache keeps the {table: {column: type}} schema of each endpoint in the
+    shared state file.
+    """
+    def __init__(self, path=STATE_PATH, ttl=SCHEMA_TTL):
+        self.path = path
+        self.ttl = float(ttl)                               # unit=seconds
+        self._db = open_database(path, timeout=5)
+        with self._db:
+            self._db.execute("CREATE TABLE IF NOT EXISTS schemas ("
+                             "endpoint TEXT PRIMARY KEY, fetched REAL, tables TEXT)")
+
+    def schema(self, live_status, max_age=None):
+        """
+        Return the schema of the client's endpoint, fetching it when missing or
+        older than max_age, ttl by default.  Returns None when the broker couldn't
+        describe itself.
+        """
+        if max_age is None:
+            max_age = self.ttl
+        key = endpoint_key(live_status.upstream)
+        row = self._db.execute("SELECT fetched, tables FROM schemas WHERE endpoint = ?",
+                               (key,)).fetchone()
+        if row is not None and time.time() - row[0] < max_age:
+            return json.loads(row[1])
+
+        query = build_query('columns', ['table', 'name', 'type']) + 'OutputFormat: json' + LS_EOL
+        rows = live_status.get_json(query)
+        if not rows:
+            LOG.warning("Unable to fetch the livestatus schema of {}.".format(key))
+            return json.loads(row[1]) if row is not None else None
+        tables = {}
+        for table, name, kind in rows:
+            tables.setdefault(table, {})[name] = kind
+        with self._db:
+            self._db.execute("INSERT OR REPLACE INTO schemas VALUES (?, ?, ?)",
+                             (key, time.time(), json.dumps(tables)))
+        return tables
+
+    def close(self):
+        self._db.close()
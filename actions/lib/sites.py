@@ -0,0 +1,199 @@
+"""
+Multi-site fan-out: the same livestatus query is sent to several sites and the
+replies are merged into one result.
+
+Sites are configured as a list of {"name": ..., "host": ..., "port": ...} objects.
+Without a sites setting the host/port settings form a single site.
+
+Rows are merged with the site name added as the first column, or at the position
+of a "site" entry in the requested columns.  Stats replies are aggregated:
+counts and sums are added up, min and max keep the extreme value.  avg and
+avginv are weighted by the number of rows each site averaged, counted by hidden
+stats added to the query (see stats_weights).  std can't be recombined from the
+site values.  Requesting the "site" column with stats keeps one row per site.
+"""
+import logging
+
+LOG = logging.getLogger(__name__)
+
+SITE_COLUMN = 'site'
+DEFAULT_SITE_NAME = 'default'
+STATS_FUNCTIONS = ('sum', 'min', 'max', 'avg', 'std', 'suminv', 'avginv')
+
+
+WEIGHTED_AGGREGATES = ('avg', 'avginv')
+
+AGGREGATES = {
+    'count': sum,
+    'sum': sum,
+    'suminv': sum,
+    'min': min,
+    'max': max,
+}
+
+
+def load_sites(config):
+    """
+    Return the configured sites as a list of {"name", "host", "port"} dicts.
+    """
+    sites = config.get('sites')
+    if not sites:
+        if not config.get('host'):
+            raise ValueError("Neither a host nor sites are configured.")
+        return [{'name': DEFAULT_SITE_NAME, 'host': config['host'], 'port': config.get('port')}]
+
+    result = []
+    names = set()
+    for index, site in enumerate(sites):
+        if 'host' not in site:
+            raise ValueError("Site {} has no host.".format(site.get('name', index)))
+        name = site.get('name', site['host'])
+        if name in names:
+            raise ValueError("Duplicate site name '{}'.".format(name))
+        names.add(name)
+        result.append({'name': name, 'host': site['host'], 'port': site.get('port')})
+    return result
+
+
+def default_site(config, name=None):
+    """
+    Return the site a single-site action or sensor talks to: the named site, else
+    the host/port settings or, with only sites configured, the first site.
+    Raises ValueError for an unknown name or a configuration without a host.
+    """
+    sites = load_sites(config)
+    if name is None:
+        return sites[0]
+    return select_sites(sites, [name])[0]
+
+
+def select_sites(sites, names=None):
+    """
+    Return the sites with the given names, or all of them when names is None.
+    """
+    if names is None:
+        return sites
+    known = dict((site['name'], site) for site in sites)
+    unknown = [name for name in names if name not in known]
+    if unknown:
+        raise ValueError("Unknown sites: {}".format(", ".join(unknown)))
+    return [known[name] for name in names]
+
+
+def split_site_column(columns):
+    """
+    Return (columns without "site", position of "site" in the requested columns).
+    The position is None when the site column wasn't requested.
+    """
+    if columns is None or SITE_COLUMN not in columns:
+        return columns, None
+    index = columns.index(SITE_COLUMN)
+    columns = [column for column in columns if column != SITE_COLUMN]
+    return columns or None, index
+
+
+def stats_aggregates(stats):
+    """
+    Return the aggregate name of every value column produced by the stats list.
+    StatsAnd/StatsOr/StatsNegate combine filters into a single count.
+    Raises ValueError for a malformed "&N" or "|N" operator.
+    """
+    aggregates = []
+    for item in stats:
+        item = item.strip()
+        if item.startswith('&') or item.startswith('|'):
+            count = item[1:].strip()
+            if not count.isdigit() or not 0 < int(count) <= len(aggregates):
+                raise ValueError("'{}' needs the number of preceding stats to combine, "
+                                 "at most {}.".format(item, len(aggregates)))
+            count = int(count)
+            del aggregates[len(aggregates) - count:]
+            aggregates.append('count')
+        elif item == '!':
+            continue
+        else:
+            words = item.split()
+            if len(words) == 2 and words[0].lower() in STATS_FUNCTIONS:
+                aggregates.append(words[0].lower())
+            else:
+                aggregates.append('count')
+    return aggregates
+
+
+def stats_weights(stats):
+    """
+    Return the hidden stats to append to a multi-site stats query: for every avg
+    and avginv, a count of the rows it averages (column = 0 or column != 0).
+    Raises ValueError for std, which can't be merged across sites.
+    """
+    hidden = []
+    for item in stats:
+        words = item.split()
+        if len(words) != 2:
+            continue
+        function = words[0].lower()
+        if function == 'std':
+            raise ValueError("std can't be combined across sites, request the site "
+                             "column to get it per site.")
+        if function in WEIGHTED_AGGREGATES:
+            hidden.extend(['{} = 0'.format(words[1]), '{} != 0'.format(words[1]), '|2'])
+    return hidden
+
+
+def merge_rows(replies, site_index=None):
+    """
+    Concatenate the (site name, rows) replies, inserting the site into every row,
+    as the first column unless site_index gives its position.
+    """
+    if site_index is None:
+        site_index = 0
+    merged = []
+    for name, rows in replies:
+        for row in rows:
+            row = list(row)
+            row.insert(site_index, name)
+            merged.append(row)
+    return merged
+
+
+def merge_stats(replies, aggregates, weighted=0):
+    """
+    Aggregate the (site name, rows) stats replies.  The leading columns of a row
+    which aren't stats values are the group key, as with "Columns:" in a stats query.
+
+    weighted - number of trailing counts added by stats_weights(), one per avg or
+               avginv in order.  They weigh the site averages and are left out
+               of the merged rows.
+    """
+    width = len(aggregates)
+    groups = {}
+    order = []
+    for name, rows in replies:
+        for row in rows:
+            key = tuple(row[:len(row) - width])
+            if key not in groups:
+                groups[key] = []
+                order.append(key)
+            groups[key].append(row[len(row) - width:])
+
+    visible = width - weighted
+    weights = {}
+    for index, aggregate in enumerate(aggregates[:visible]):
+        if aggregate in WEIGHTED_AGGREGATES:
+            weights[index] = visible + len(weights)
+
+    merged = []
+    for key in order:
+        row = list(key)
+        for index, aggregate in enumerate(aggregates[:visible]):
+            if index in weights:
+                pairs = [(values[index], values[weights[index]]) for values in groups[key]
+                         if values[index] is not None and values[weights[index]]]
+                total = sum(count for _, count in pairs)
+                row.append(float(sum(value * count for value, count in pairs)) / total
+                           if total else None)
+                continue
+            values = [values[index] for values in groups[key] if values[index] is not None]
+            row.append(AGGREGATES[aggregate](values) if values else None)
+        merged.append(row)
+    return merged
@@ -0,0 +1,237 @@
+"""
+Incremental parsing of livestatus replies.
+
+Livestatus answers "OutputFormat: json" queries with a single top level array
+of rows.  iter_json_rows() decodes that array one element at a time from a
+stream of bytes chunks, only keeping the unparsed tail of the reply in memory.
+
+iter_csv_rows() and iter_python_rows() do the same for the csv and python3
+output formats, which put one row per line.  csv fields are text: they are
+converted by the column types of the livestatus schema when known, so a host
+named "007" stays a string, and otherwise guessed from how they look.
+"""
+import re
+import ast
+import json
+import codecs
+
+# Dataset, column, list and host/service separators requested for csv replies.
+# Livestatus doesn't quote csv fields, control characters keep them unambiguous.
+CSV_SEPARATORS = ('\n', '\x1f', '\x1e', '\x1d')
+# Livestatus column types converted from csv text, the other types stay strings.
+CSV_NUMBER_TYPES = {'int': int, 'time': int, 'float': float}
+# Columns read as strings when the schema isn't known.
+CSV_STRING_COLUMNS = ('name', 'alias', 'address', 'description', 'display_name', 'author',
+                      'comment', 'email', 'pager')
+CSV_STRING_SUFFIXES = ('_name', '_alias', '_address', '_description', '_output')
+
+WHITESPACE = re.compile(r'[ \t\n\r]*')
+
+
+def iter_json_rows(chunks):
+    """
+    Yield the elements of a top level JSON array as the chunks arrive.
+
+    @chunks - an iterable of bytes making up the UTF-8 encoded reply.
+
+    Raises ValueError when the reply isn't a complete JSON array.
+    """
+    decode_text = codecs.getincrementaldecoder('utf-8')().decode
+    decoder = json.JSONDecoder()
+    buffer_ = ''
+    pos = 0
+    started = False
+    finished = False
+
+    for chunk in chunks:
+        buffer_ = buffer_[pos:] + decode_text(chunk)
+        pos = 0
+        while not finished:
+            pos = WHITESPACE.match(buffer_, pos).end()
+            if pos == len(buffer_):
+                break
+            char = buffer_[pos]
+            if not started:
+                if char != '[':
+                    raise ValueError("Livestatus reply isn't a JSON array.")
+                started = True
+                pos += 1
+            elif char == ',':
+                pos += 1
+            elif char == ']':
+                finished = True
+                pos += 1
+            else:
+                try:
+                    row, end = decoder.raw_decode(buffer_, pos)
+                except ValueError:
+                    # The row is incomplete, wait for the next chunk.
+                    break
+                if end == len(buffer_) and not isinstance(row, (list, dict, str)):
+                    # A bare number may continue in the next chunk.
+                    break
+                pos = end
+                yield row
+
+    decode_text(b'', True)
+    if not finished:
+        raise ValueError("Livestatus reply ended before the JSON array was closed.")
+
+
+def iter_lines(chunks, separator='\n'):
+    """
+    Yield the lines of a stream of UTF-8 encoded bytes chunks without their separator.
+    """
+    decode_text = codecs.getincrementaldecoder('utf-8')().decode
+    tail = ''
+    for chunk in chunks:
+        lines = (tail + decode_text(chunk)).split(separator)
+        tail = lines.pop()
+        for line in lines:
+            yield line
+    tail += decode_text(b'', True)
+    if tail:
+        yield tail
+
+
+def _csv_scalar(field):
+    if field and (field[0].isdigit() or field[0] == '-') and '_' not in field:
+        try:
+            return int(field)
+        except ValueError:
+            try:
+                return float(field)
+            except ValueError:
+                pass
+    return field
+
+
+def _csv_value(field, list_separator, pair_separator):
+    """
+    Convert a csv field to a number, a list, a list of host/service pairs or a string.
+    A list with a single element can't be told apart from a string and stays one.
+    """
+    if list_separator in field:
+        items = field.split(list_separator)
+        if pair_separator in field:
+            return [[_csv_scalar(value) for value in item.split(pair_separator)]
+                    for item in items]
+        return [_csv_scalar(item) for item in items]
+    return _csv_scalar(field)
+
+
+def _csv_list(field, list_separator, pair_separator):
+    """
+    Split a list column.  Host/service pairs keep their name as a string, plain
+    items are ids when all of them are integers and names otherwise.
+    """
+    if not field:
+        return []
+    items = field.split(list_separator)
+    if pair_separator in field:
+        pairs = [item.split(pair_separator) for item in items]
+        return [pair[:1] + [_csv_scalar(value) for value in pair[1:]] for pair in pairs]
+    if all(item.lstrip('-').isdigit() for item in items):
+        return [int(item) for item in items]
+    return items
+
+
+def _csv_typed(field, kind, list_separator, pair_separator):
+    if kind is None:
+        return _csv_value(field, list_separator, pair_separator)
+    if kind in CSV_NUMBER_TYPES:
+        try:
+            return CSV_NUMBER_TYPES[kind](field)
+        except ValueError:
+            return field
+    if kind == 'list':
+        return _csv_list(field, list_separator, pair_separator)
+    return field
+
+
+def csv_column_types(columns, known=None):
+    """
+    Return the livestatus type of each column for iter_csv_rows: from known, the
+    {column: type} schema of the table, else "string" for name and text columns
+    and None, guessed from the value, for the others.  None without columns.
+    """
+    if not columns:
+        return None
+    types = []
+    for column in columns:
+        if known is not None and column in known:
+            types.append(known[column])
+        elif column in CSV_STRING_COLUMNS or column.endswith(CSV_STRING_SUFFIXES):
+            types.append('string')
+        else:
+            types.append(None)
+    return types
+
+
+def iter_csv_rows(chunks, separators=CSV_SEPARATORS, types=None):
+    """
+    Yield the rows of a csv reply requested with the given Separators as the
+    chunks arrive.  List fields are split, numbers are converted to int or float.
+
+    @chunks - an iterable of bytes making up the UTF-8 encoded reply.
+    @types - the livestatus type of each column, as returned by csv_column_types().
+             Without a type, and for the stats values after the columns, the
+             value is guessed from how it looks.
+    """
+    dataset, column, list_separator, pair_separator = separators
+    types = types or []
+    for line in iter_lines(chunks, dataset):
+        if not line:
+            continue
+        yield [_csv_typed(field, types[index] if index < len(types) else None,
+                          list_separator, pair_separator)
+               for index, field in enumerate(line.split(column))]
+
+
+def iter_python_rows(chunks):
+    """
+    Yield the rows of a python or python3 reply as the chunks arrive.  Livestatus
+    writes one row per line, every row is evaluated with ast.literal_eval so only
+    literals are accepted.
+
+    @chunks - an iterable of bytes making up the UTF-8 encoded reply.
+
+    Raises ValueError when the reply isn't a list of rows.
+    """
+    started = False
+    finished = False
+    for line in iter_lines(chunks):
+        line = line.strip()
+        if not line:
+            continue
+        if finished:
+            raise ValueError("Unexpected data after the end of the python reply.")
+        if not started:
+            if not line.startswith('['):
+                raise ValueError("Livestatus reply isn't a python list.")
+            started = True
+            line = line[1:].lstrip()
+        if line.endswith(','):
+            line = line[:-1]
+        elif line.endswith(']'):
+            # The outer list closes on the last row.
+            line = line[:-1]
+            finished = True
+        else:
+            raise ValueError("Unexpected python row {}.".format(line[:80]))
+        if not line:
+            continue
+        try:
+            yield ast.literal_eval(line)
+        except (SyntaxError, ValueError) as e:
+            raise ValueError("Invalid python row: {}".format(e))
+    if not finished:
+        raise ValueError("Livestatus reply ended before the python list was closed.")
+
+
+PARSERS = {
+    'json': iter_json_rows,
+    'csv': iter_csv_rows,
+    'python': iter_python_rows,
+    'python3': iter_python_rows,
+}
@@ -0,0 +1,108 @@
+"""
+Time expressions of the downtime commands.
+
+Expressions are parsed with parsedatetime against one source time, so a batch
+of commands shares the same start and end whatever the number of targets.
+The calendar is built once per process.
+
+    for 5d                          now until 5 days from now
+    from 5 jan 2018 to 6 jan 2018   between two dates
+    in 1 hour for 4 hours           a window starting later
+    at 1pm to 2pm                   today between two times
+    until tomorrow 9am              now until a date
+"""
+import re
+import time
+
+import parsedatetime
+
+DEFAULT_DURATION = 1800
+
+_CALENDAR = None
+
+NUMBER = re.compile(r'^-?\d+(?:\.\d*)?$')
+
+WINDOW = re.compile(r'^(?:(?:from|at)\s+(?P<start>.+?)\s+(?:to|until)\s+(?P<end>.+)|'
+                    r'in\s+(?P<delay>.+?)\s+for\s+(?P<for_delay>.+)|'
+                    r'(?P<for_start>.+?)\s+for\s+(?P<for_length>.+)|'
+                    r'for\s+(?P<length>.+)|'
+                    r'until\s+(?P<until>.+))$', re.IGNORECASE)
+
+
+def calendar():
+    global _CALENDAR
+    if _CALENDAR is None:
+        _CALENDAR = parsedatetime.Calendar()
+    return _CALENDAR
+
+
+def parse_time(expression, now=None):
+    """
+    Return the epoch of a date/time expression, e.g. "tomorrow 9am".  Numbers and
+    number strings, e.g. "1700000000.5", are taken as epochs already, truncated to
+    the second.
+
+    Raises ValueError when the expression isn't understood.
+    """
+    if isinstance(expression, (int, float)):
+        return int(expression)
+    expression = str(expression).strip()
+    if NUMBER.match(expression):
+        return int(float(expression))
+    if now is None:
+        now = time.time()
+    time_struct, status = calendar().parse(expression, time.localtime(now))
+    if not status:
+        raise ValueError("Unable to parse the time '{}'.".format(expression))
+    return int(time.mktime(time_struct))
+
+
+def parse_duration(expression, now=None):
+    """
+    Return the seconds of a duration expression, e.g. "4 hours" or "5d".
+    Numbers and number strings are taken as seconds.
+
+    Raises ValueError when the expression isn't understood or isn't positive.
+    """
+    if isinstance(expression, (int, float)) or NUMBER.match(str(expression).strip()):
+        duration = int(float(expression))
+        if duration <= 0:
+            raise ValueError("The duration must be positive, got {}.".format(expression))
+        return duration
+    expression = str(expression).strip()
+    if now is None:
+        now = int(time.time())
+    duration = parse_time(expression, now) - int(now)
+    if duration <= 0:
+        raise ValueError("'{}' isn't a duration.".format(expression))
+    return duration
+
+
+def parse_window(expression, now=None):
+    """
+    Return the (start, end) epochs of a window expression, see the module examples.
+    """
+    if now is None:
+        now = int(time.time())
+    match = WINDOW.match(expression.strip())
+    if match is None:
+        raise ValueError("Unable to parse the time window '{}'.".format(expression))
+    groups = match.groupdict()
+    if groups['start'] is not None:
+        start = parse_time(groups['start'], now)
+        end = parse_time(groups['end'], now)
+    elif groups['delay'] is not None:
+        start = now + parse_duration(groups['delay'], now)
+        end = start + parse_duration(groups['for_delay'], now)
+    elif groups['for_start'] is not None:
+        start = parse_time(groups['for_start'], now)
+        end = start + parse_duration(groups['for_length'], now)
+    elif groups['length'] is not None:
+        start = now
+        end = start + parse_duration(groups['length'], now)
+    else:
+        start = now
+        end = parse_time(groups['until'], now)
+    if end <= start:
+        raise ValueError("The time window '{}' ends before it starts.".format(expression))
+    return start, end
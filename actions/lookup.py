@@ -0,0 +1,87 @@
+from st2actions.runners.pythonrunner import Action
+from st2common import log as logging
+
+import sqlite3
+
+from get_data import Get
+from lib.index import INDEX_FULL_REFRESH, INDEX_PATH, LookupIndex
+from lib.sites import SITE_COLUMN
+
+LOG = logging.getLogger(__name__)
+
+# kind: (table, column, LookupIndex method, updated by incremental refreshes)
+LOOKUPS = {
+    'host_address': ('hosts', 'address', 'host_address', False),
+    'host_services': ('hosts', 'services_with_state', 'host_services', True),
+    'contact_email': ('contacts', 'email', 'contact_email', False),
+}
+
+
+class Lookup(Action):
+    """
+    LiveStatus Lookup class, resolves a host or contact name from the local lookup
+    index when it is enabled and fresh enough, otherwise from livestatus.
+    """
+    def run(self, kind, name, max_staleness=None, priority="normal"):
+        """
+        The run method to be called by Stackstorm.
+
+        kind - host_address, host_services or contact_email.
+        name - the host or contact name.
+        max_staleness - the oldest index snapshot in seconds accepted, defaults to
+                        the index_max_staleness config.
+        priority - the queue priority of the livestatus fallback when admission
+                   control is enabled, high, normal or low.
+
+        Returns {"value": ..., "source": "index" or "livestatus", "staleness": seconds}.
+        """
+        if kind not in LOOKUPS:
+            return (False, "Unknown lookup '{}', expected one of: {}".format(
+                kind, ", ".join(sorted(LOOKUPS))))
+        table, column, method, incremental = LOOKUPS[kind]
+
+        if max_staleness is None:
+            max_staleness = self.config.get('index_max_staleness', 300)
+        found = self._from_index(method, name, max_staleness, incremental)
+        if found is not None:
+            return (True, found)
+
+        # Multi-site rows carry the site name, request it first to know where it is.
+        columns = [SITE_COLUMN, column] if self.config.get('sites') else [column]
+        success, rows = Get(self.config).run(table, columns, ['name = {}'.format(name)],
+                                             priority=priority)
+        if not success:
+            return (False, rows)
+        if not rows:
+            return (False, "No {} named {}.".format(table[:-1], name))
+        return (True, {"value": rows[0][columns.index(column)], "source": "livestatus",
+                       "staleness": 0})
+
+    def _from_index(self, method, name, max_staleness, incremental):
+        """
+        Return the lookup result from the index, None when the index is disabled,
+        too stale or doesn't know the name.  Lookups incremental refreshes don't
+        update are as stale as the last full snapshot.
+        """
+        if not self.config.get('index_enabled', False):
+            return None
+        try:
+            index = LookupIndex(self.config.get('index_path', INDEX_PATH),
+                                self.config.get('index_full_refresh', INDEX_FULL_REFRESH))
+        except sqlite3.Error as e:
+            LOG.warning("Lookup index unavailable, querying livestatus. {}".format(e))
+            return None
+        try:
+            staleness = index.staleness(full=not incremental)
+            if staleness is None or staleness > float(max_staleness):
+                LOG.info("Lookup index is stale ({}s), querying livestatus.".format(staleness))
+                return None
+            value = getattr(index, method)(name)
+        except sqlite3.Error as e:
+            LOG.warning("Lookup index read failed, querying livestatus. {}".format(e))
+            return None
+        finally:
+            index.close()
+        if value is None:
+            return None
+        return {"value": value, "source": "index", "staleness": round(staleness, 3)}
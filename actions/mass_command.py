@@ -0,0 +1,139 @@
+from st2actions.runners.pythonrunner import Action
+from st2common import log as logging
+
+import time
+
+from exec_command import LiveStatus, build_command
+from get_data import Get
+from lib.endpoint import parse_endpoint
+from lib.limiter import build_limiter
+from lib.proxy import command_proxy_url
+from lib.sites import SITE_COLUMN, load_sites
+from lib.timespec import parse_duration, parse_window
+
+LOG = logging.getLogger(__name__)
+
+# operation: {table: external command}
+OPERATIONS = {
+    'downtime': {'hosts': 'SCHEDULE_HOST_DOWNTIME',
+                 'services': 'SCHEDULE_SVC_DOWNTIME'},
+    'acknowledge': {'hosts': 'ACKNOWLEDGE_HOST_PROBLEM',
+                    'services': 'ACKNOWLEDGE_SVC_PROBLEM'},
+    'remove_acknowledgement': {'hosts': 'REMOVE_HOST_ACKNOWLEDGEMENT',
+                               'services': 'REMOVE_SVC_ACKNOWLEDGEMENT'},
+    'disable_notifications': {'hosts': 'DISABLE_HOST_NOTIFICATIONS',
+                              'services': 'DISABLE_SVC_NOTIFICATIONS'},
+    'enable_notifications': {'hosts': 'ENABLE_HOST_NOTIFICATIONS',
+                             'services': 'ENABLE_SVC_NOTIFICATIONS'},
+}
+
+# table: (columns identifying a target, command argument names)
+TARGETS = {
+    'hosts': (['name'], ['host_name']),
+    'services': (['host_name', 'description'], ['host_name', 'service_description']),
+}
+
+
+class MassCommand(Action):
+    """
+    LiveStatus MassCommand class, applies one operation to every host or service
+    matching a query.
+    """
+    def run(self, operation, table, filters=None, window=None, duration=None, fixed=True,
+           sticky=True, notify=True, persistent=True, author="Unknown",
+           comment="No comment provided.", dry_run=False, batch_size=500, sites=None):
+        """
+        The run method to be called by Stackstorm.
+
+        operation - downtime, acknowledge, remove_acknowledgement, disable_notifications
+                    or enable_notifications.
+        table - hosts or services.
+        filters - Get filters selecting the targets, e.g. ["host_groups >= web", "state = 2"].
+        window - the downtime window, e.g. "for 5d", "at 1pm to 2pm" or
+                 "from 5 jan 2018 to 6 jan 2018", defaults to the next 30 minutes.
+        duration - the length of a flexible (fixed=false) downtime, defaults to the window.
+        dry_run - return the targets and command lines without submitting them.
+
+        The targets are resolved with a single query and the time expressions are
+        parsed once, every command of the batch shares the same timestamp and window.
+        """
+        if operation not in OPERATIONS:
+            return (False, "Unknown operation '{}', expected one of: {}".format(
+                operation, ", ".join(sorted(OPERATIONS))))
+        if table not in TARGETS:
+            return (False, "Unknown table '{}', expected one of: {}".format(
+                table, ", ".join(sorted(TARGETS))))
+        command = OPERATIONS[operation][table]
+        columns, arg_names = TARGETS[table]
+
+        now = int(time.time())
+        args = {}
+        if operation == 'downtime':
+            try:
+                start, end = parse_window(window or "for 30 minutes", now)
+                length = parse_duration(duration, now) if duration is not None else end - start
+            except ValueError as e:
+                return (False, "Invalid downtime: {}".format(e))
+            args.update(start_time=start, end_time=end, fixed=fixed, duration=length,
+                        author=author, comment=comment)
+        elif operation == 'acknowledge':
+            args.update(sticky=sticky, notify=notify, persistent=persistent,
+                        author=author, comment=comment)
+
+        multi_site = bool(self.config.get('sites')) or sites is not None
+        if multi_site:
+            columns = [SITE_COLUMN] + columns
+        success, rows = Get(self.config).run(table, columns, filters, sites=sites)
+        if not success:
+            return (False, "Unable to resolve the targets: {}".format(rows))
+
+        # site name: command lines, a single None site without multi-site.
+        batches = {}
+        targets = []
+        for row in rows:
+            site = row.pop(0) if multi_site else None
+            target = dict(zip(arg_names, row))
+            target.update(args)
+            try:
+                line = build_command(command, target).execute(now)
+            except (TypeError, ValueError) as e:
+                return (False, "Invalid command {} for {}: {}".format(command, row, e))
+            batches.setdefault(site, []).append(line)
+            targets.append([site] + row if multi_site else row)
+
+        result = {
+            "command": command,
+            "targets": len(targets),
+            "dry_run": dry_run,
+        }
+        if operation == 'downtime':
+            result["window"] = {"start": args['start_time'], "end": args['end_time']}
+        if dry_run:
+            result["target_list"] = targets
+            result["commands"] = [line for site in sorted(batches, key=str)
+                                  for line in batches[site]]
+            return (True, result)
+
+        result["submitted"] = 0
+        result["queue_wait"] = 0.0
+        errors = {}
+        endpoints = dict((site['name'], site) for site in load_sites(self.config))
+        for site, lines in sorted(batches.items(), key=lambda item: str(item[0])):
+            if site is None:
+                host, port, proxy = self.config['host'], self.config.get('port'), \
+                    command_proxy_url(self.config)
+            else:
+                host, port, proxy = endpoints[site]['host'], endpoints[site].get('port'), None
+            live_status = LiveStatus(host, port, proxy=proxy,
+                                     limiter=build_limiter(self.config,
+                                                           parse_endpoint(host, port)))
+            sent, error = live_status.submit_commands(lines, batch_size)
+            result["submitted"] += sent
+            result["queue_wait"] += live_status.queue_wait
+            if error is not None:
+                LOG.error("Submitting {} commands to {} failed after {} lines: {}".format(
+                    command, site or self.config['host'], sent, error))
+                errors[site or self.config['host']] = error
+        if errors:
+            result["errors"] = errors
+        return (not errors, result)
@@ -0,0 +1,216 @@
+#!/usr/bin/env python
+"""
+Benchmark the livestatus client paths against the synthetic server in
+benchmarks/fake_livestatus.py.
+
+Every client path runs in its own process so its peak RSS can be reported
+together with queries/sec, p50/p99 latency and bytes/sec.  Results can be saved
+and later compared against a baseline.
+
+Usage: python benchmarks/bench_clients.py [--hosts 1000] [--services-per-host 20]
+           [--queries 200] [--save results.json] [--baseline results.json]
+"""
+import os
+import sys
+import json
+import time
+import asyncio
+import argparse
+import resource
+import multiprocessing
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.join(HERE, '..', 'actions'))
+sys.path.insert(0, HERE)
+
+import fake_livestatus  # noqa: E402
+from lib.aio_client import AsyncLiveStatus  # noqa: E402
+from lib.client import LiveStatus  # noqa: E402
+from lib.query import LS_EOL, build_query, output_format_headers, process_filters  # noqa: E402
+from lib.reducers import build_reducer  # noqa: E402
+from lib.stream import CSV_SEPARATORS, iter_csv_rows, iter_python_rows  # noqa: E402
+
+FILTERS = ['state != 0', 'acknowledged = 0', '&2', 'host_groups >= hg01', 'host_groups >= hg02',
+           '|2', '&2']
+
+
+def percentile(values, fraction):
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(round(fraction * (len(ordered) - 1))))]
+
+
+def run_build(args, endpoint):
+    latencies = []
+    for _ in range(args.queries * 100):
+        start = time.time()
+        build_query(args.table, args.columns, FILTERS, None, None)
+        latencies.append(time.time() - start)
+    return latencies, 0
+
+
+def _client(endpoint, keepalive):
+    return LiveStatus(endpoint[0], endpoint[1], query_retry_delay=0, query_duration=300,
+                      keepalive=keepalive)
+
+
+def _timed(args, call):
+    latencies = []
+    for _ in range(args.queries):
+        start = time.time()
+        if call() is None:
+            raise RuntimeError("Query failed.")
+        latencies.append(time.time() - start)
+    return latencies
+
+
+def run_oneshot_json(args, endpoint):
+    return _timed(args, lambda: _client(endpoint, False).get_json(args.query)), args.reply_size
+
+
+def run_keepalive_json(args, endpoint):
+    return _timed(args, lambda: _client(endpoint, True).get_json(args.query)), args.reply_size
+
+
+def run_keepalive_stream(args, endpoint):
+    def call():
+        reducer = build_reducer({"type": "count"})
+        for row in _client(endpoint, True).iter_json(args.query):
+            reducer.add(row)
+        return reducer.result()
+    return _timed(args, call), args.reply_size
+
+
+def run_keepalive_columnar(args, endpoint):
+    def call():
+        reducer = build_reducer({"type": "columnar"}, args.columns)
+        for row in _client(endpoint, True).iter_json(args.query):
+            reducer.add(row)
+        return reducer.result()
+    return _timed(args, call), args.reply_size
+
+
+def run_keepalive_csv(args, endpoint):
+    return _timed(args, lambda: _client(endpoint, True).get_rows(args.csv_query, iter_csv_rows)), \
+        args.csv_reply_size
+
+
+def run_keepalive_python3(args, endpoint):
+    return _timed(args, lambda: _client(endpoint, True).get_rows(args.python_query,
+                                                                iter_python_rows)), \
+        args.python_reply_size
+
+
+def run_asyncio(args, endpoint):
+    latencies = []
+
+    async def one(client):
+        start = time.time()
+        await client.get_json(args.query)
+        latencies.append(time.time() - start)
+
+    async def main():
+        client = AsyncLiveStatus(endpoint[0], endpoint[1], query_duration=300,
+                                 max_connections=args.concurrency)
+        await asyncio.gather(*[one(client) for _ in range(args.queries)])
+        await client.close()
+
+    asyncio.run(main())
+    return latencies, args.reply_size
+
+
+PATHS = [
+    ('build_query', run_build),
+    ('oneshot get_json', run_oneshot_json),
+    ('keepalive get_json', run_keepalive_json),
+    ('keepalive iter_json', run_keepalive_stream),
+    ('keepalive columnar', run_keepalive_columnar),
+    ('keepalive csv', run_keepalive_csv),
+    ('keepalive python3', run_keepalive_python3),
+    ('asyncio get_json', run_asyncio),
+]
+
+
+def measure(name, function, args, endpoint, queue):
+    start = time.time()
+    latencies, reply_size = function(args, endpoint)
+    elapsed = time.time() - start
+    queue.put({
+        'path': name,
+        'queries': len(latencies),
+        'qps': len(latencies) / elapsed,
+        'p50_ms': percentile(latencies, 0.5) * 1000,
+        'p99_ms': percentile(latencies, 0.99) * 1000,
+        'mb_per_s': reply_size * len(latencies) / elapsed / 1048576.0,
+        'peak_rss_mb': resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024.0,
+    })
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--hosts', type=int, default=1000)
+    parser.add_argument('--services-per-host', type=int, default=20)
+    parser.add_argument('--table', default='services')
+    parser.add_argument('--columns', default='host_name,description,state,plugin_output')
+    parser.add_argument('--queries', type=int, default=50)
+    parser.add_argument('--concurrency', type=int, default=8)
+    parser.add_argument('--latency', type=float, default=0.0)
+    parser.add_argument('--paths', default=None, help="Comma separated subset of the paths.")
+    parser.add_argument('--save', default=None, help="Write the results to this JSON file.")
+    parser.add_argument('--baseline', default=None, help="Compare against a saved JSON file.")
+    args = parser.parse_args()
+    args.columns = args.columns.split(',')
+    args.query = build_query(args.table, args.columns) + 'OutputFormat: json' + LS_EOL
+    args.csv_query = build_query(args.table, args.columns) + output_format_headers(
+        'csv', CSV_SEPARATORS)
+    args.python_query = build_query(args.table, args.columns) + output_format_headers('python3')
+
+    tables = fake_livestatus.generate_tables(args.hosts, args.services_per_host)
+    server = fake_livestatus.start(tables, settings=fake_livestatus.Settings(args.latency))
+    endpoint = server.server_address
+    raw = LiveStatus(endpoint[0], endpoint[1], keepalive=False).execute(args.query)
+    args.reply_size = len(raw.encode('utf-8'))
+    args.csv_reply_size = len(LiveStatus(endpoint[0], endpoint[1], keepalive=False).execute(
+        args.csv_query).encode('utf-8'))
+    args.python_reply_size = len(LiveStatus(endpoint[0], endpoint[1], keepalive=False).execute(
+        args.python_query).encode('utf-8'))
+    del raw
+
+    baseline = {}
+    if args.baseline:
+        with open(args.baseline) as handle:
+            baseline = dict((r['path'], r) for r in json.load(handle)['results'])
+
+    print("Reply size {:.2f} MB, {} queries per path".format(args.reply_size / 1048576.0,
+                                                             args.queries))
+    print("{:>22} {:>10} {:>10} {:>10} {:>10} {:>12}".format(
+        "path", "qps", "p50 ms", "p99 ms", "MB/s", "peak RSS MB"))
+    selected = args.paths.split(',') if args.paths else None
+    results = []
+    queue = multiprocessing.Queue()
+    for name, function in PATHS:
+        if selected and name not in selected:
+            continue
+        process = multiprocessing.Process(target=measure,
+                                          args=(name, function, args, endpoint, queue))
+        process.start()
+        result = queue.get()
+        process.join()
+        results.append(result)
+        line = "{path:>22} {qps:>10.1f} {p50_ms:>10.3f} {p99_ms:>10.3f} {mb_per_s:>10.1f} " \
+               "{peak_rss_mb:>12.1f}".format(**result)
+        if name in baseline:
+            line += "  ({:+.1f}% qps vs baseline)".format(
+                (result['qps'] / baseline[name]['qps'] - 1) * 100)
+        print(line)
+
+    server.shutdown()
+    if args.save:
+        with open(args.save, 'w') as handle:
+            json.dump({'args': {'hosts': args.hosts, 'services_per_host': args.services_per_host,
+                                'table': args.table, 'columns': args.columns,
+                                'queries': args.queries},
+                       'results': results}, handle, indent=2)
+
+
+if __name__ == '__main__':
+    main()
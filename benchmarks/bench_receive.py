@@ -0,0 +1,86 @@
+#!/usr/bin/env python
+"""
+Compare the legacy "buffer_ += data" receive loop against the recv_into engine
+in actions/lib/receive.py for 1 MB, 10 MB and 100 MB replies.
+
+Usage: python benchmarks/bench_receive.py [--sizes 1,10,100] [--legacy-max 10]
+"""
+import os
+import sys
+import time
+import socket
+import argparse
+import threading
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'actions'))
+
+from lib.receive import recv_exact, recv_until_eof  # noqa: E402
+
+MB = 1024 * 1024
+LEGACY_MAX_RECV = 4096
+
+
+def legacy_receive(server, size):
+    buffer_ = b''
+    data = server.recv(LEGACY_MAX_RECV)
+    while data:
+        buffer_ += data
+        data = server.recv(LEGACY_MAX_RECV)
+    return buffer_.decode('utf-8')
+
+
+def eof_receive(server, size):
+    return recv_until_eof(server).decode('utf-8')
+
+
+def fixed16_receive(server, size):
+    return recv_exact(server, size).decode('utf-8')
+
+
+def run_once(receiver, payload):
+    """
+    Stream payload over a socketpair and time the receiver until it decoded the reply.
+    """
+    reader, writer = socket.socketpair()
+
+    def send():
+        writer.sendall(payload)
+        writer.shutdown(socket.SHUT_WR)
+
+    sender = threading.Thread(target=send)
+    sender.start()
+    start = time.time()
+    result = receiver(reader, len(payload))
+    elapsed = time.time() - start
+    sender.join()
+    reader.close()
+    writer.close()
+    assert len(result) == len(payload)
+    return elapsed
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--sizes', default='1,10,100', help="Reply sizes in MB.")
+    parser.add_argument('--legacy-max', type=int, default=10,
+                        help="Skip the legacy loop above this size in MB, it is quadratic.")
+    parser.add_argument('--repeat', type=int, default=3)
+    args = parser.parse_args()
+
+    receivers = [('legacy +=', legacy_receive),
+                 ('recv_until_eof', eof_receive),
+                 ('recv_exact', fixed16_receive)]
+
+    print("{:>8} {:>16} {:>12} {:>12}".format("size MB", "receiver", "best s", "MB/s"))
+    for size in [int(s) for s in args.sizes.split(',')]:
+        payload = b'x' * (size * MB)
+        for name, receiver in receivers:
+            if receiver is legacy_receive and size > args.legacy_max:
+                print("{:>8} {:>16} {:>12}".format(size, name, "skipped"))
+                continue
+            best = min(run_once(receiver, payload) for _ in range(args.repeat))
+            print("{:>8} {:>16} {:>12.4f} {:>12.1f}".format(size, name, best, size / best))
+
+
+if __name__ == '__main__':
+    main()
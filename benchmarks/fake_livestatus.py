@@ -0,0 +1,536 @@
+#!/usr/bin/env python
+"""
+Synthetic Livestatus stand-in server for benchmarks and local testing.
+
+Generates hosts, services, contacts and log tables, records COMMAND requests and
+answers GET queries honouring Columns, ColumnHeaders, Filter/And/Or/Negate,
+Stats/StatsAnd/StatsOr/StatsNegate, Limit, OutputFormat (json, csv, python),
+Separators, KeepAlive, ResponseHeader: fixed16 and the Wait headers, which poll
+the tables until the condition holds.  Latency and errors can be injected.
+
+Usage: python benchmarks/fake_livestatus.py [--port 6557 | --unix /tmp/live]
+                                            [--hosts 1000] [--services-per-host 20]
+"""
+import re
+import sys
+import json
+import time
+import random
+import socket
+import argparse
+import threading
+
+try:
+    import socketserver
+except ImportError:
+    import SocketServer as socketserver
+
+STATES = {'hosts': 3, 'services': 4}
+
+
+class LivestatusQueryError(Exception):
+    def __init__(self, status, msg):
+        self.status = status
+        self.msg = msg
+
+
+def generate_tables(hosts=100, services_per_host=10, contacts=20, seed=42):
+    """
+    Return a dict of table name to list of row dicts.
+    """
+    rng = random.Random(seed)
+    now = int(time.time())
+    contact_rows = []
+    for index in range(contacts):
+        name = 'contact{:04d}'.format(index)
+        contact_rows.append({
+            'name': name,
+            'alias': 'Contact {}'.format(index),
+            'email': '{}@example.com'.format(name),
+            'pager': '+1555{:07d}'.format(index),
+            'can_submit_commands': rng.randint(0, 1),
+        })
+
+    host_rows = []
+    service_rows = []
+    for index in range(hosts):
+        name = 'host{:05d}'.format(index)
+        groups = ['hg{:02d}'.format(index % 10), 'all']
+        host_contacts = [contact_rows[(index + k) % contacts]['name']
+                         for k in range(min(2, contacts))]
+        host_state = 0 if rng.random() < 0.95 else rng.choice([1, 2])
+        services = []
+        for service_index in range(services_per_host):
+            description = 'service{:03d}'.format(service_index)
+            state = rng.choice([0] * 17 + [1, 2, 3])
+            last_check = now - rng.randint(0, 300)
+            service_rows.append({
+                'host_name': name,
+                'description': description,
+                'display_name': description,
+                'state': state,
+                'state_type': rng.randint(0, 1),
+                'has_been_checked': 1,
+                'last_check': last_check,
+                'last_state_change': last_check - rng.randint(0, 86400),
+                'acknowledged': 1 if state and rng.random() < 0.3 else 0,
+                'scheduled_downtime_depth': 0,
+                'plugin_output': 'CHECK {} - synthetic output for {}'.format(
+                    ['OK', 'WARNING', 'CRITICAL', 'UNKNOWN'][state], description),
+                'perf_data': 'time={:.3f}s;1;2;0; size={}B;;;0'.format(
+                    rng.random() * 3, rng.randint(100, 100000)),
+                'check_command': 'check_synthetic!{}'.format(service_index),
+                'contacts': host_contacts,
+                'host_groups': groups,
+                'groups': ['sg{:02d}'.format(service_index % 5)],
+                'host_address': '10.{}.{}.{}'.format(index // 65536 % 256,
+                                                     index // 256 % 256, index % 256),
+                'host_state': host_state,
+            })
+            services.append([description, state, 1])
+        last_check = now - rng.randint(0, 300)
+        host_rows.append({
+            'name': name,
+            'alias': name.upper(),
+            'address': '10.{}.{}.{}'.format(index // 65536 % 256, index // 256 % 256, index % 256),
+            'state': host_state,
+            'state_type': 1,
+            'has_been_checked': 1,
+            'last_check': last_check,
+            'last_state_change': last_check - rng.randint(0, 86400),
+            'acknowledged': 0,
+            'scheduled_downtime_depth': 0,
+            'plugin_output': 'PING OK - Packet loss = 0%',
+            'perf_data': 'rta={:.3f}ms;100;500;0 pl=0%;20;60;0'.format(rng.random() * 10),
+            'groups': groups,
+            'contacts': host_contacts,
+            'services': [s[0] for s in services],
+            'services_with_state': services,
+            'num_services': len(services),
+        })
+
+    # One alert per service over the last day, in time order like the livestatus log.
+    log_rows = []
+    for service in service_rows:
+        log_rows.append({
+            'time': now - rng.randint(0, 86400),
+            'type': 'SERVICE ALERT',
+            'host_name': service['host_name'],
+            'service_description': service['description'],
+            'state': service['state'],
+            'plugin_output': service['plugin_output'],
+        })
+    log_rows.sort(key=lambda row: row['time'])
+    for lineno, row in enumerate(log_rows):
+        row['lineno'] = lineno + 1
+
+    tables = {'hosts': host_rows, 'services': service_rows, 'contacts': contact_rows,
+              'log': log_rows,
+              'status': [{'program_start': now - 86400, 'program_version': 'fake-1.0',
+                          'num_hosts': len(host_rows), 'num_services': len(service_rows)}]}
+    tables['columns'] = column_rows(tables)
+    return tables
+
+
+def column_rows(tables):
+    """
+    Describe the generated tables the way the livestatus "columns" table does.
+    """
+    rows = []
+    for table, data in sorted(tables.items()):
+        if not data:
+            continue
+        for name, value in sorted(data[0].items()):
+            if isinstance(value, list):
+                kind = 'list'
+            elif isinstance(value, int):
+                kind = 'int'
+            elif isinstance(value, float):
+                kind = 'float'
+            else:
+                kind = 'string'
+            rows.append({'table': table, 'name': name, 'type': kind,
+                         'description': 'Synthetic {} column'.format(name)})
+    return rows
+
+
+def _convert(value, sample):
+    if isinstance(sample, bool) or not isinstance(sample, (int, float)):
+        return value
+    try:
+        return type(sample)(value)
+    except ValueError:
+        raise LivestatusQueryError(400, "Invalid value '{}' for a numeric column.".format(value))
+
+
+OPERATORS = ('!=~', '!~~', '=~', '~~', '!~', '!=', '<=', '>=', '=', '~', '<', '>')
+
+
+def compile_predicate(expression):
+    """
+    Turn a "column op value" filter expression into a predicate on row dicts.
+    """
+    match = re.match(r'^\s*(\S+)\s*({})\s?(.*)$'.format(
+        '|'.join(re.escape(op) for op in OPERATORS)), expression)
+    if not match:
+        raise LivestatusQueryError(400, "Invalid filter expression '{}'.".format(expression))
+    column, operator, value = match.groups()
+
+    def predicate(row):
+        if column not in row:
+            raise LivestatusQueryError(400, "Table has no column '{}'.".format(column))
+        field = row[column]
+        if isinstance(field, list):
+            members = [m[0] if isinstance(m, list) else m for m in field]
+            if operator == '>=':
+                return value in members
+            if operator == '<':
+                return value not in members
+            if operator == '=':
+                return not field if value == '' else False
+            if operator == '!=':
+                return bool(field) if value == '' else True
+            raise LivestatusQueryError(400, "Operator {} not supported on lists.".format(operator))
+        if operator in ('~', '~~', '!~', '!~~'):
+            flags = re.IGNORECASE if '~~' in operator else 0
+            found = re.search(value, str(field), flags) is not None
+            return not found if operator.startswith('!') else found
+        if operator in ('=~', '!=~'):
+            equal = str(field).lower() == value.lower()
+            return not equal if operator.startswith('!') else equal
+        other = _convert(value, field)
+        return {'=': field == other, '!=': field != other, '<': field < other,
+                '>': field > other, '<=': field <= other, '>=': field >= other}[operator]
+
+    return predicate
+
+
+def combine(stack, count, kind, header):
+    if count > len(stack) or count < 1:
+        raise LivestatusQueryError(400, "{}: {} exceeds the {} expressions.".format(
+            header, count, len(stack)))
+    operands = stack[-count:]
+    del stack[-count:]
+    if kind == 'and':
+        stack.append(lambda row: all(p(row) for p in operands))
+    else:
+        stack.append(lambda row: any(p(row) for p in operands))
+
+
+class Query(object):
+    """
+    A parsed livestatus GET query.
+    """
+    def __init__(self, text):
+        self.table = None
+        self.columns = None
+        self.column_headers = False
+        self.filters = []
+        self.stats = []
+        self.limit = None
+        self.output_format = 'csv'
+        self.separators = ['\n', ';', ',', '|']
+        self.keepalive = False
+        self.fixed16 = False
+        self.wait_object = None
+        self.wait_condition = []
+        self.wait_timeout = 0
+        self.parse(text)
+
+    def parse(self, text):
+        lines = [line for line in text.splitlines() if line.strip()]
+        if not lines:
+            raise LivestatusQueryError(400, "Empty query.")
+        if not lines[0].startswith('GET '):
+            raise LivestatusQueryError(400, "Only GET queries are supported.")
+        self.table = lines[0][4:].strip()
+        for line in lines[1:]:
+            header, _, value = line.partition(':')
+            value = value.strip()
+            if header == 'Columns':
+                self.columns = value.split()
+            elif header == 'ColumnHeaders':
+                self.column_headers = value == 'on'
+            elif header == 'Filter':
+                self.filters.append(compile_predicate(value))
+            elif header in ('And', 'Or'):
+                combine(self.filters, int(value), header.lower(), header)
+            elif header == 'Negate':
+                self._negate(self.filters, header)
+            elif header == 'Stats':
+                self.stats.append(self._stat(value))
+            elif header in ('StatsAnd', 'StatsOr'):
+                self._combine_stats(int(value), header[5:].lower(), header)
+            elif header == 'StatsNegate':
+                self._negate_stats()
+            elif header == 'Limit':
+                self.limit = int(value)
+            elif header == 'OutputFormat':
+                self.output_format = value
+            elif header == 'Separators':
+                self.separators = [chr(int(code)) for code in value.split()]
+            elif header == 'KeepAlive':
+                self.keepalive = value == 'on'
+            elif header == 'ResponseHeader':
+                self.fixed16 = value == 'fixed16'
+            elif header == 'WaitObject':
+                self.wait_object = value
+            elif header == 'WaitCondition':
+                self.wait_condition.append(compile_predicate(value))
+            elif header in ('WaitConditionAnd', 'WaitConditionOr'):
+                combine(self.wait_condition, int(value), header[13:].lower(), header)
+            elif header == 'WaitConditionNegate':
+                self._negate(self.wait_condition, header)
+            elif header == 'WaitTimeout':
+                self.wait_timeout = int(value)
+            elif header == 'WaitTrigger':
+                pass
+            elif header in ('Localtime', 'AuthUser', 'Timelimit'):
+                pass
+            else:
+                raise LivestatusQueryError(400, "Undefined request header '{}'.".format(header))
+
+    @staticmethod
+    def _negate(stack, header):
+        if not stack:
+            raise LivestatusQueryError(400, "{}: nothing to negate.".format(header))
+        operand = stack.pop()
+        stack.append(lambda row: not operand(row))
+
+    def _stat(self, value):
+        match = re.match(r'^(sum|min|max|avg) (\S+)$', value)
+        if match:
+            return (match.group(1), match.group(2))
+        return ('count', compile_predicate(value))
+
+    def _combine_stats(self, count, kind, header):
+        predicates = []
+        for _ in range(count):
+            if not self.stats or self.stats[-1][0] != 'count':
+                raise LivestatusQueryError(400, "{} needs {} filter stats.".format(header, count))
+            predicates.insert(0, self.stats.pop()[1])
+        combine(predicates, count, kind, header)
+        self.stats.append(('count', predicates[0]))
+
+    def _negate_stats(self):
+        if not self.stats or self.stats[-1][0] != 'count':
+            raise LivestatusQueryError(400, "StatsNegate needs a filter stat.")
+        predicate = self.stats.pop()[1]
+        self.stats.append(('count', lambda row: not predicate(row)))
+
+    def wait(self, tables):
+        """
+        Poll the wait object until the wait condition holds or WaitTimeout expired.
+        """
+        if not self.wait_condition or self.table not in tables:
+            return
+        deadline = time.time() + (self.wait_timeout or 3600000) / 1000.0
+        while time.time() < deadline:
+            for row in tables[self.table]:
+                if self.wait_object is not None and not self._is_wait_object(row):
+                    continue
+                if all(p(row) for p in self.wait_condition):
+                    return
+            time.sleep(0.05)
+
+    def _is_wait_object(self, row):
+        if self.table == 'services':
+            host_name, _, description = self.wait_object.replace(';', ' ').partition(' ')
+            return row['host_name'] == host_name and row['description'] == description
+        return row.get('name') == self.wait_object
+
+    def execute(self, tables):
+        if self.table not in tables:
+            raise LivestatusQueryError(404, "Invalid GET request, no such table '{}'.".format(
+                self.table))
+        rows = tables[self.table]
+        if self.filters:
+            predicates = self.filters
+            rows = [row for row in rows if all(p(row) for p in predicates)]
+        if self.stats:
+            return self._execute_stats(rows)
+        columns = self.columns or (sorted(rows[0].keys()) if rows else [])
+        if self.limit is not None:
+            rows = rows[:self.limit]
+        try:
+            result = [[row[column] for column in columns] for row in rows]
+        except KeyError as e:
+            raise LivestatusQueryError(400, "Table has no column {}.".format(e))
+        if self.column_headers or not self.columns:
+            result.insert(0, columns)
+        return result
+
+    def _execute_stats(self, rows):
+        groups = {}
+        for row in rows:
+            key = tuple(row[column] for column in self.columns or [])
+            groups.setdefault(key, []).append(row)
+        if not groups and not self.columns:
+            groups[()] = []
+        result = []
+        for key in sorted(groups):
+            values = list(key)
+            for kind, operand in self.stats:
+                group = groups[key]
+                if kind == 'count':
+                    values.append(sum(1 for row in group if operand(row)))
+                else:
+                    numbers = [row[operand] for row in group]
+                    if kind == 'sum':
+                        values.append(sum(numbers))
+                    elif kind == 'avg':
+                        values.append(float(sum(numbers)) / len(numbers) if numbers else 0)
+                    elif numbers:
+                        values.append(min(numbers) if kind == 'min' else max(numbers))
+                    else:
+                        values.append(0)
+            result.append(values)
+        return result
+
+    def render(self, result):
+        if self.output_format == 'json':
+            return '[' + ',\n'.join(json.dumps(row) for row in result) + ']\n'
+        if self.output_format in ('python', 'python3'):
+            return '[' + ',\n'.join(repr(row) for row in result) + ']\n'
+        row_sep, field_sep, list_sep, sub_sep = self.separators
+        lines = []
+        for row in result:
+            fields = []
+            for field in row:
+                if isinstance(field, list):
+                    fields.append(list_sep.join(
+                        sub_sep.join(str(v) for v in item) if isinstance(item, list) else
+                        str(item) for item in field))
+                else:
+                    fields.append(str(field))
+            lines.append(field_sep.join(fields))
+        return ''.join(line + row_sep for line in lines)
+
+
+class Handler(socketserver.StreamRequestHandler):
+    """
+    Answer queries on one connection, keeping it open while KeepAlive is on.
+    """
+    def handle(self):
+        settings = self.server.settings
+        while True:
+            lines = []
+            while True:
+                line = self.rfile.readline()
+                if not line or line in (b'\n', b'\r\n'):
+                    break
+                lines.append(line.decode('utf-8'))
+            if not lines:
+                return
+            keepalive = self._answer(''.join(lines), settings)
+            if not keepalive:
+                return
+
+    def _answer(self, text, settings):
+        if text.startswith('COMMAND '):
+            # Commands aren't answered and leave the connection open.
+            with self.server.lock:
+                self.server.commands.append(text[8:].strip())
+            return True
+        fixed16 = 'ResponseHeader: fixed16' in text
+        keepalive = 'KeepAlive: on' in text
+        if settings.latency:
+            time.sleep(settings.latency + random.random() * settings.jitter)
+        if settings.error_rate and random.random() < settings.error_rate:
+            if fixed16 and random.random() < 0.5:
+                self._send(fixed16, 500, "Injected failure.\n")
+                return keepalive
+            # Drop the connection without an answer.
+            self.connection.shutdown(socket.SHUT_RDWR)
+            return False
+        try:
+            query = Query(text)
+            query.wait(self.server.tables)
+            body = query.render(query.execute(self.server.tables))
+            status = 200
+        except LivestatusQueryError as e:
+            body, status = e.msg + '\n', e.status
+        self._send(fixed16, status, body)
+        return keepalive
+
+    def _send(self, fixed16, status, body):
+        payload = body.encode('utf-8')
+        if fixed16:
+            payload = '{:03d} {:11d}\n'.format(status, len(payload)).encode('utf-8') + payload
+        self.wfile.write(payload)
+        self.wfile.flush()
+
+
+class Settings(object):
+    def __init__(self, latency=0.0, jitter=0.0, error_rate=0.0):
+        self.latency = latency
+        self.jitter = jitter
+        self.error_rate = error_rate
+
+
+class FakeLivestatusServer(socketserver.ThreadingMixIn, socketserver.TCPServer):
+    daemon_threads = True
+    allow_reuse_address = True
+
+    def __init__(self, address, tables, settings=None):
+        socketserver.TCPServer.__init__(self, address, Handler)
+        self.tables = tables
+        self.settings = settings or Settings()
+        self.commands = []
+        self.lock = threading.Lock()
+
+
+if hasattr(socketserver, 'UnixStreamServer'):
+    class FakeLivestatusUnixServer(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+        daemon_threads = True
+
+        def __init__(self, path, tables, settings=None):
+            socketserver.UnixStreamServer.__init__(self, path, Handler)
+            self.tables = tables
+            self.settings = settings or Settings()
+            self.commands = []
+            self.lock = threading.Lock()
+
+
+def start(tables, port=0, unix=None, settings=None):
+    """
+    Serve the tables from a background thread and return the server.
+    """
+    if unix:
+        server = FakeLivestatusUnixServer(unix, tables, settings)
+    else:
+        server = FakeLivestatusServer(('127.0.0.1', port), tables, settings)
+    thread = threading.Thread(target=server.serve_forever)
+    thread.daemon = True
+    thread.start()
+    return server
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--port', type=int, default=6557)
+    parser.add_argument('--unix', default=None, help="Listen on this Unix socket path instead.")
+    parser.add_argument('--hosts', type=int, default=1000)
+    parser.add_argument('--services-per-host', type=int, default=20)
+    parser.add_argument('--contacts', type=int, default=50)
+    parser.add_argument('--latency', type=float, default=0.0, help="Seconds added to each reply.")
+    parser.add_argument('--jitter', type=float, default=0.0, help="Random extra latency.")
+    parser.add_argument('--error-rate', type=float, default=0.0,
+                        help="Fraction of queries answered with an error or a dropped connection.")
+    args = parser.parse_args()
+
+    tables = generate_tables(args.hosts, args.services_per_host, args.contacts)
+    settings = Settings(args.latency, args.jitter, args.error_rate)
+    server = start(tables, args.port, args.unix, settings)
+    sys.stdout.write("Fake livestatus listening on {}\n".format(
+        args.unix or '127.0.0.1:{}'.format(server.server_address[1])))
+    sys.stdout.flush()
+    try:
+        while True:
+            time.sleep(3600)
+    except KeyboardInterrupt:
+        server.shutdown()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,71 @@
+import os
+import sys
+import sqlite3
+
+from st2reactor.sensor.base import PollingSensor
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'actions'))
+
+from lib.client import LiveStatus  # noqa: E402
+from lib.limiter import build_limiter  # noqa: E402
+from lib.sites import default_site  # noqa: E402
+from lib.index import INDEX_FULL_REFRESH, INDEX_PATH, LookupIndex  # noqa: E402
+
+
+class LookupIndexSensor(PollingSensor):
+    """
+    Keep the local lookup index used by the livestatus.lookup action up to date.
+
+    Nothing is dispatched, the sensor only refreshes the index on every poll while
+    the index_enabled setting is on.
+    """
+    def __init__(self, sensor_service, config=None, poll_interval=60):
+        super(LookupIndexSensor, self).__init__(sensor_service=sensor_service,
+                                                config=config,
+                                                poll_interval=poll_interval)
+        self._logger = self._sensor_service.get_logger(name=self.__class__.__name__)
+        self._index = None
+
+    def setup(self):
+        pass
+
+    def poll(self):
+        if not self._config.get('index_enabled', False):
+            return
+        try:
+            if self._index is None:
+                self._index = LookupIndex(self._config.get('index_path', INDEX_PATH),
+                                          self._config.get('index_full_refresh',
+                                                           INDEX_FULL_REFRESH))
+            kind = self._index.refresh(self._live_status())
+        except sqlite3.Error as e:
+            self._logger.warning("Unable to update the lookup index. {}".format(e))
+            self.cleanup()
+            return
+        if kind is None:
+            self._logger.warning("Unable to refresh the lookup index from livestatus.")
+        else:
+            self._logger.debug("Lookup index {} refresh done.".format(kind))
+
+    def cleanup(self):
+        if self._index is not None:
+            self._index.close()
+            self._index = None
+
+    def add_trigger(self, trigger):
+        pass
+
+    def update_trigger(self, trigger):
+        pass
+
+    def remove_trigger(self, trigger):
+        pass
+
+    def _live_status(self):
+        # Failures are retried on the next poll rather than by sleeping in the client.
+        site = default_site(self._config)
+        live_status = LiveStatus(site['host'], site.get('port'),
+                                 query_max_retries=1, query_retry_delay=0,
+                                 keepalive=self._config.get('keepalive', True), priority='low')
+        live_status.limiter = build_limiter(self._config, live_status.upstream)
+        return live_status
@@ -0,0 +1,61 @@
+import os
+import sys
+import threading
+
+from st2reactor.sensor.base import Sensor
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'actions'))
+
+from lib.proxy import PROXY_SOCKET, LivestatusProxy  # noqa: E402
+from lib.sites import default_site  # noqa: E402
+
+
+class LivestatusProxySensor(Sensor):
+    """
+    Run the local livestatus proxy inside the sensor container while the
+    proxy_enabled setting is on.  Nothing is dispatched, the sensor only keeps
+    the proxy process alive next to the action runners.  With proxy_enabled off
+    the sensor idles until it is stopped, so the container doesn't respawn it.
+    """
+    def __init__(self, sensor_service, config=None):
+        super(LivestatusProxySensor, self).__init__(sensor_service=sensor_service,
+                                                    config=config)
+        self._logger = self._sensor_service.get_logger(name=self.__class__.__name__)
+        self._proxy = None
+        self._stopped = threading.Event()
+
+    def setup(self):
+        if not self._config.get('proxy_enabled', False):
+            return
+        options = {}
+        for key in ('query_max_retries', 'query_duration', 'query_retry_delay'):
+            if key in self._config:
+                options[key] = self._config[key]
+        site = default_site(self._config)
+        self._proxy = LivestatusProxy((site['host'], site.get('port')),
+                                      self._config.get('proxy_socket', PROXY_SOCKET),
+                                      ttl=self._config.get('cache_ttl'),
+                                      max_entries=self._config.get('cache_max_entries', 1000),
+                                      client_options=options,
+                                      allow_commands=self._config.get('proxy_commands', False))
+
+    def run(self):
+        if self._proxy is None:
+            self._logger.info("proxy_enabled is off, the livestatus proxy isn't started.")
+            self._stopped.wait()
+            return
+        self._proxy.serve_forever()
+
+    def cleanup(self):
+        self._stopped.set()
+        if self._proxy is not None:
+            self._proxy.shutdown()
+
+    def add_trigger(self, trigger):
+        pass
+
+    def update_trigger(self, trigger):
+        pass
+
+    def remove_trigger(self, trigger):
+        pass
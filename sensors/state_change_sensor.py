@@ -0,0 +1,109 @@
+import os
+import sys
+
+from st2reactor.sensor.base import PollingSensor
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'actions'))
+
+from lib.client import LiveStatus  # noqa: E402
+from lib.limiter import build_limiter  # noqa: E402
+from lib.sites import default_site  # noqa: E402
+from lib.query import LS_EOL, build_query  # noqa: E402
+
+TRIGGER = 'livestatus.state_change'
+COLUMNS = {
+    'hosts': ['name', 'state', 'state_type', 'last_state_change', 'plugin_output'],
+    'services': ['host_name', 'description', 'state', 'state_type', 'last_state_change',
+                 'plugin_output'],
+}
+
+
+class StateChangeSensor(PollingSensor):
+    """
+    Poll livestatus for hosts and services whose last_state_change is newer than the
+    previous poll and dispatch a trigger for every real state transition.
+
+    The first poll records the current states without dispatching anything.  Later
+    polls only request rows changed since the high-water mark, so a poll costs
+    O(changes) instead of O(all services).  Nothing is polled unless the
+    state_change_enabled setting is on.
+    """
+    def __init__(self, sensor_service, config=None, poll_interval=30):
+        super(StateChangeSensor, self).__init__(sensor_service=sensor_service,
+                                                config=config,
+                                                poll_interval=poll_interval)
+        self._logger = self._sensor_service.get_logger(name=self.__class__.__name__)
+        self._states = {}
+        self._high_water = {}
+
+    def setup(self):
+        pass
+
+    def poll(self):
+        if not self._config.get('state_change_enabled', False):
+            return
+        for table in COLUMNS:
+            self._poll_table(table)
+
+    def cleanup(self):
+        pass
+
+    def add_trigger(self, trigger):
+        pass
+
+    def update_trigger(self, trigger):
+        pass
+
+    def remove_trigger(self, trigger):
+        pass
+
+    def _live_status(self):
+        # Failures are retried on the next poll rather than by sleeping in the client.
+        site = default_site(self._config)
+        live_status = LiveStatus(site['host'], site.get('port'),
+                                 query_max_retries=1, query_retry_delay=0,
+                                 keepalive=self._config.get('keepalive', True), priority='low')
+        live_status.limiter = build_limiter(self._config, live_status.upstream)
+        return live_status
+
+    def _poll_table(self, table):
+        high_water = self._high_water.get(table)
+        filters = None
+        if high_water is not None:
+            filters = ['last_state_change >= {}'.format(high_water)]
+        query = build_query(table, COLUMNS[table], filters)
+        query += 'OutputFormat: json{}'.format(LS_EOL)
+
+        rows = self._live_status().get_json(query)
+        if rows is None:
+            self._logger.warning("Unable to poll livestatus table {}.".format(table))
+            return
+
+        for row in rows:
+            item = dict(zip(COLUMNS[table], row))
+            if table == 'hosts':
+                key = (sys.intern(item['name']), '')
+            else:
+                key = (sys.intern(item['host_name']), sys.intern(item['description']))
+            previous = self._states.get(key)
+            self._states[key] = item['state']
+            if high_water is None or item['last_state_change'] > high_water:
+                high_water = item['last_state_change']
+            if previous is None or previous == item['state']:
+                continue
+            self._dispatch(table, key, previous, item)
+
+        self._high_water[table] = high_water
+
+    def _dispatch(self, table, key, previous, item):
+        payload = {
+            'object_type': table[:-1],
+            'host_name': key[0],
+            'service_description': key[1],
+            'state': item['state'],
+            'previous_state': previous,
+            'state_type': item['state_type'],
+            'last_state_change': item['last_state_change'],
+            'plugin_output': item['plugin_output'],
+        }
+        self._sensor_service.dispatch(trigger=TRIGGER, payload=payload)